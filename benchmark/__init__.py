@@ -0,0 +1,3 @@
+"""
+    Benchmarks for the metrics, run against synthetic Augur-shaped data.
+"""
@@ -0,0 +1,181 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Times drawing the graph of each metric for every repo in a synthetic
+dataset, to show what each graph costs apart from gathering its data.
+
+The data for every repo is gathered first, and then three things are timed
+for each graph:
+* new figure: building a figure, drawing the data on it with the metric's
+  *_plot function and closing it, which is what every graph cost before the
+  template figures
+* template: putting the data into the metric's template figure, which is
+  kept from one repo to the next (see utils/render.py). Building the
+  template figure happens once for a run, and is timed separately as setup.
+* png: encoding the figure as a png, which is the same either way
+
+Usage
+-----
+
+usage: python -m benchmark.charts [-h] [-c AUGUR_CONFIG] [--repos REPOS] [--dpi DPI]
+
+  -c AUGUR_CONFIG, --configfile AUGUR_CONFIG
+                        The Augur config.json file for a dataset from benchmark/generate.py
+                        (default to generating one with --repos repos)
+  --repos REPOS         The number of repos to generate (default to 10)
+  --dpi DPI             The resolution to encode the pngs at (default to 500, like the graphs)
+
+Output
+------
+The milliseconds for each graph of each metric, on average, and for setting
+up each template figure.
+"""
+
+def gather_chart_data(engine, org_name, years, bus_days):
+    """ Gathers the data for the graph of each metric for every repo in an org
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+    org_name : str
+    years : int
+    bus_days : int
+
+    Returns
+    -------
+    chart_data : dict
+        metric -> list of the results of its *_data function, without the
+        ones with errors
+    """
+    from utils.date_calcs import get_dates
+    from utils.repo_info import get_org_repo_list
+    from metrics.release_frequency import activity_release_data
+    from metrics.closure_ratio import sustain_prs_by_repo_data
+    from metrics.bus_factor import contributor_risk_data
+    from metrics.first_response import response_time_data
+
+    start_date, end_date = get_dates(365 * years)
+
+    chart_data = {'release': [], 'closure_ratio': [], 'bus_factor': [], 'first_response': []}
+    for repo_id, repo_name in get_org_repo_list(org_name, engine):
+        chart_data['release'].append(activity_release_data(repo_id, repo_name, org_name, start_date, end_date, engine))
+        chart_data['closure_ratio'].append(sustain_prs_by_repo_data(repo_id, repo_name, org_name, start_date, end_date, engine))
+        chart_data['bus_factor'].append(contributor_risk_data(repo_id, repo_name, org_name, start_date, end_date, engine))
+        chart_data['first_response'].append(response_time_data(repo_id, repo_name, org_name, start_date, end_date, engine, bus_days))
+
+    return {metric: [data for data in metric_data if data[0] != -1] for metric, metric_data in chart_data.items()}
+
+def time_charts(chart_data, bus_days, dpi):
+    """ Times drawing each graph on a new figure and on the template figure,
+    and encoding it as a png
+
+    Parameters
+    ----------
+    chart_data : dict
+        from gather_chart_data
+    bus_days : int
+    dpi : int
+
+    Returns
+    -------
+    timings : dict
+        metric -> number of charts, the seconds to set up the template figure
+        and the average seconds for the new figure, the template and the png
+    """
+    import io
+    import time
+    import matplotlib.pyplot as plt
+    from utils.render import setup_style, metric_template, clear_templates
+    from metrics.release_frequency import activity_release_plot, activity_release_template, activity_release_update
+    from metrics.closure_ratio import sustain_prs_by_repo_plot, sustain_prs_by_repo_template, sustain_prs_by_repo_update
+    from metrics.bus_factor import contributor_risk_plot, contributor_risk_template, contributor_risk_update
+    from metrics.first_response import response_time_plot, response_time_template, response_time_update
+
+    renderers = {
+        'release': (activity_release_plot, activity_release_template, activity_release_update, {}),
+        'closure_ratio': (sustain_prs_by_repo_plot, sustain_prs_by_repo_template, sustain_prs_by_repo_update, {}),
+        'bus_factor': (contributor_risk_plot, contributor_risk_template, contributor_risk_update, {}),
+        'first_response': (response_time_plot, response_time_template, response_time_update, {'bus_days': bus_days}),
+    }
+
+    setup_style()
+    clear_templates()
+
+    timings = {}
+    for metric, (plot, template_function, update, kwargs) in renderers.items():
+        new_seconds = 0.0
+        template_seconds = 0.0
+        png_seconds = 0.0
+
+        start = time.perf_counter()
+        template = metric_template('benchmark_' + metric, template_function)
+        setup_seconds = time.perf_counter() - start
+
+        for data in chart_data[metric]:
+            start = time.perf_counter()
+            fig, ax = plt.subplots()
+            fig.set_size_inches(24, 8)
+            plot(ax, data, **kwargs)
+            plt.close(fig)
+            new_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            update(template, data, **kwargs)
+            template_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            template['fig'].savefig(io.BytesIO(), format='png', bbox_inches='tight', dpi=dpi)
+            png_seconds += time.perf_counter() - start
+
+        charts = len(chart_data[metric])
+        timings[metric] = {
+            'charts': charts,
+            'setup': setup_seconds,
+            'new_figure': new_seconds / charts if charts else 0,
+            'template': template_seconds / charts if charts else 0,
+            'png': png_seconds / charts if charts else 0,
+        }
+
+    clear_templates()
+
+    return timings
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    import warnings
+    from os.path import join
+    from benchmark.run import ORG_NAME, YEARS, BUS_DAYS
+    from utils.augur_connect import augur_db_connect
+
+    warnings.simplefilter("ignore")
+
+    parser = argparse.ArgumentParser(prog='python -m benchmark.charts')
+
+    parser.add_argument("-c", "--configfile", required=False, dest = "augur_config", default=None, help="The Augur config.json file for a dataset from benchmark/generate.py (default to generating one with --repos repos)")
+    parser.add_argument("--repos", required=False, dest = "repos", type=int, default=10, help="The number of repos to generate (default to 10)")
+    parser.add_argument("--dpi", required=False, dest = "dpi", type=int, default=500, help="The resolution to encode the pngs at (default to 500, like the graphs)")
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_file = args.augur_config
+        if config_file == None:
+            from benchmark.generate import generate_tables, write_tables, write_config
+
+            print('Generating', args.repos, 'repos')
+            database = join(tmp_dir, 'charts.sqlite')
+            write_tables(generate_tables(ORG_NAME, repos=args.repos), 'sqlite', database)
+            config_file = write_config('sqlite', database)
+
+        engine = augur_db_connect(config_file)
+        chart_data = gather_chart_data(engine, ORG_NAME, YEARS, BUS_DAYS)
+        engine.dispose()
+
+    print('Timing the graphs')
+    timings = time_charts(chart_data, BUS_DAYS, args.dpi)
+
+    print('\n{:<16} {:>6} {:>12} {:>12} {:>12} {:>12}'.format('metric', 'charts', 'new figure', 'template', 'png', 'setup (once)'))
+    for metric, timing in timings.items():
+        print('{:<16} {:>6} {:>10.1f}ms {:>10.1f}ms {:>10.1f}ms {:>10.1f}ms'.format(metric, timing['charts'],
+            timing['new_figure'] * 1000, timing['template'] * 1000, timing['png'] * 1000, timing['setup'] * 1000))
@@ -0,0 +1,365 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Checks the metric functions for performance regressions, by running a
+fixed benchmark scenario and comparing it with the baseline committed in
+benchmark/baseline.json.
+
+The scenario is a synthetic dataset generated with benchmark/generate.py
+from SCENARIO, in a temporary SQLite file. Each metric's *_data function is
+run for every repo, and four things are measured for each function over all
+of the repos:
+* seconds: the wall time, the fastest of several runs
+* queries: the number of queries run (see utils/timing.py)
+* rows: the number of rows fetched by those queries
+* peak_bytes: the highest memory allocated by Python for one repo, measured
+  with tracemalloc in a separate run so it doesn't slow down the timed runs
+
+A measure is a regression when it is higher than the baseline by more than
+its tolerance, both as a ratio and as an amount (so that a few milliseconds
+of noise on a fast function don't fail the check). The tolerances are kept
+in the baseline file, from TOLERANCES when it is created, so they can be
+adjusted there. The number of queries has no tolerance.
+
+The backfill (see utils/backfill.py) computes the metrics as of each
+month-end with its own vectorized code, so the check also computes the
+backfill for the last month-end of each repo and compares it with the
+summary values of a normal run. Any difference is reported as a mismatch.
+
+The seconds depend on the machine, so the baseline should be measured on
+the machine that runs the check, with --update. The queries and rows are the
+same on any machine, except for a few rows at the edges of the window as the
+days of the month go by.
+
+Usage
+-----
+
+usage: python -m benchmark.regress [-h] [--baseline BASELINE_FILE] [--update] [--runs RUNS]
+
+  --baseline BASELINE_FILE
+                        The baseline JSON file (default to benchmark/baseline.json)
+  --update              Save the measures as the new baseline instead of comparing them
+  --runs RUNS           The number of timed runs of each function (default to 5)
+
+Output
+------
+A table of each measure of each function with the baseline, the current
+value and the change, followed by the regressions and the backfill
+mismatches. The exit status is 1 if there are any, or if there is no
+baseline to compare with.
+"""
+
+# The dataset the functions are run against (see generate_tables in
+# benchmark/generate.py)
+SCENARIO = {'repos': 10, 'prs': 1000, 'commits': 5000, 'seed': 42}
+
+# For each measure, the ratio and the amount over the baseline that is still
+# allowed
+TOLERANCES = {
+    'seconds': {'ratio': 0.5, 'amount': 0.02},
+    'queries': {'ratio': 0.0, 'amount': 0},
+    'rows': {'ratio': 0.05, 'amount': 20},
+    'peak_bytes': {'ratio': 0.25, 'amount': 512 * 1024},
+}
+
+def metric_functions():
+    """ Gets the *_data function of each metric, with the arguments it takes
+    after the engine
+
+    Returns
+    -------
+    functions : dict
+        function name -> (function, extra arguments)
+    """
+    from benchmark.run import BUS_DAYS
+    from metrics.release_frequency import activity_release_data
+    from metrics.closure_ratio import sustain_prs_by_repo_data
+    from metrics.bus_factor import contributor_risk_data
+    from metrics.first_response import response_time_data
+
+    functions = {
+        'activity_release_data': (activity_release_data, []),
+        'sustain_prs_by_repo_data': (sustain_prs_by_repo_data, []),
+        'contributor_risk_data': (contributor_risk_data, []),
+        'response_time_data': (response_time_data, [BUS_DAYS]),
+    }
+
+    return functions
+
+def measure_functions(engine, runs=5):
+    """ Measures each metric's *_data function for every repo in the
+    benchmark org
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+    runs : int
+        the number of timed runs, of which the fastest is kept
+
+    Returns
+    -------
+    measures : dict
+        function name -> {'seconds', 'queries', 'rows', 'peak_bytes'}
+    """
+    import time
+    import tracemalloc
+    from benchmark.run import ORG_NAME, YEARS
+    from utils.date_calcs import get_dates
+    from utils.repo_info import get_org_repo_list
+    from utils.timing import stage, get_records, clear_records
+
+    start_date, end_date = get_dates(365 * YEARS)
+    repos = get_org_repo_list(ORG_NAME, engine)
+
+    measures = {}
+    for name, (function, extra_args) in metric_functions().items():
+        # The first call imports the libraries the function uses
+        repo_id, repo_name = repos[0]
+        function(repo_id, repo_name, ORG_NAME, start_date, end_date, engine, *extra_args)
+
+        seconds = None
+        for run in range(runs):
+            clear_records()
+            start = time.perf_counter()
+            for repo_id, repo_name in repos:
+                function(repo_id, repo_name, ORG_NAME, start_date, end_date, engine, *extra_args)
+            run_seconds = time.perf_counter() - start
+            if seconds == None or run_seconds < seconds:
+                seconds = run_seconds
+
+        queries = [record for record in get_records() if record['stage'] == 'query']
+
+        # The stage records the peak of everything run inside it, including
+        # the stages of the queries, which reset the traced peak
+        peak_bytes = 0
+        tracemalloc.start()
+        try:
+            for repo_id, repo_name in repos:
+                with stage('benchmark') as record:
+                    function(repo_id, repo_name, ORG_NAME, start_date, end_date, engine, *extra_args)
+                peak_bytes = max(peak_bytes, record['memory_peak_bytes'])
+        finally:
+            tracemalloc.stop()
+            clear_records()
+
+        measures[name] = {
+            'seconds': round(seconds, 4),
+            'queries': len(queries),
+            'rows': sum(record.get('rows', 0) for record in queries),
+            'peak_bytes': peak_bytes,
+        }
+
+    return measures
+
+def check_backfill(engine):
+    """ Compares the backfill for the last month-end of each repo in the
+    benchmark org with the summary values of a normal run
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    mismatches : list
+        (repo name, column, normal run value, backfill value) tuples
+    """
+    from benchmark.run import ORG_NAME, YEARS, BUS_DAYS
+    from utils.backfill import backfill_windows, backfill_repo_data
+    from utils.dashboard import summary_values
+    from utils.date_calcs import get_dates
+    from utils.gather import iter_repo_queries, repo_metric_data
+    from utils.repo_info import get_org_repo_list
+
+    start_date, end_date = get_dates(365 * YEARS)
+    window_dates = backfill_windows(1, YEARS)
+
+    mismatches = []
+    for repo_id, repo_name, query_results in iter_repo_queries(get_org_repo_list(ORG_NAME, engine), ORG_NAME, start_date, end_date, engine):
+        repo_data = repo_metric_data(query_results, repo_id, repo_name, ORG_NAME, start_date, end_date, engine, [BUS_DAYS])
+        values = summary_values(repo_data, BUS_DAYS)
+        last_row = backfill_repo_data(query_results, repo_id, repo_name, window_dates, engine, [BUS_DAYS])[BUS_DAYS].iloc[-1]
+
+        for column, value in values.items():
+            if last_row[column] != value:
+                mismatches.append((repo_name, column, value, last_row[column]))
+
+    return mismatches
+
+def compare_measures(baseline, measures, tolerances):
+    """ Compares the measures with the baseline
+
+    Parameters
+    ----------
+    baseline : dict
+        function name -> measures, from the baseline file
+    measures : dict
+        from measure_functions
+    tolerances : dict
+        measure -> {'ratio', 'amount'}
+
+    Returns
+    -------
+    comparisons : list
+        (function name, measure, baseline value, current value, status)
+        tuples, where status is 'regression', 'improved', 'ok' or 'new'
+        for measures that are not in the baseline
+    """
+
+    comparisons = []
+    for name, function_measures in measures.items():
+        for measure, value in function_measures.items():
+            base = baseline.get(name, {}).get(measure)
+            if base == None:
+                comparisons.append((name, measure, None, value, 'new'))
+                continue
+
+            tolerance = tolerances[measure]
+            if value > base * (1 + tolerance['ratio']) and value - base > tolerance['amount']:
+                status = 'regression'
+            elif value * (1 + tolerance['ratio']) < base and base - value > tolerance['amount']:
+                status = 'improved'
+            else:
+                status = 'ok'
+            comparisons.append((name, measure, base, value, status))
+
+    return comparisons
+
+def format_value(measure, value):
+    """ Formats a measure for the report
+
+    Parameters
+    ----------
+    measure : str
+    value : float or int
+
+    Returns
+    -------
+    text : str
+    """
+
+    if value == None:
+        return '-'
+    elif measure == 'seconds':
+        return '{:.3f}s'.format(value)
+    elif measure == 'peak_bytes':
+        return '{:.0f} KB'.format(value / 1024)
+    return str(value)
+
+def print_report(baseline_results, comparisons, tolerances):
+    """ Prints the comparison with the baseline and the regressions
+
+    Parameters
+    ----------
+    baseline_results : dict
+        the baseline file
+    comparisons : list
+        from compare_measures
+    tolerances : dict
+    """
+
+    print('\nCompared with the baseline from commit', baseline_results.get('commit', 'unknown')[:10],
+        'on', baseline_results.get('created_at', 'unknown'), 'with Python', baseline_results.get('python', 'unknown'))
+    print('\n{:<26} {:<11} {:>11} {:>11} {:>9}'.format('function', 'measure', 'baseline', 'current', 'change'))
+
+    for name, measure, base, value, status in comparisons:
+        change = '' if not base else '{:+.1f}%'.format((value - base) / base * 100)
+        flag = {'regression': '  REGRESSION', 'improved': '  improved', 'new': '  new'}.get(status, '')
+        print('{:<26} {:<11} {:>11} {:>11} {:>9}{}'.format(name, measure, format_value(measure, base), format_value(measure, value), change, flag))
+
+    regressions = [comparison for comparison in comparisons if comparison[4] == 'regression']
+    if regressions:
+        print('\n' + str(len(regressions)), 'regressions:')
+        for name, measure, base, value, status in regressions:
+            tolerance = tolerances[measure]
+            print('  {} {}: {} -> {} (allowed up to +{:.0f}% and +{})'.format(name, measure, format_value(measure, base),
+                format_value(measure, value), tolerance['ratio'] * 100, format_value(measure, tolerance['amount'])))
+    else:
+        print('\nNo regressions')
+
+    if any(comparison[4] == 'improved' for comparison in comparisons):
+        print('Some measures improved beyond their tolerance. Run with --update to save them as the new baseline.')
+
+if __name__ == "__main__":
+    import argparse
+    import datetime
+    import json
+    import platform
+    import sys
+    import tempfile
+    import warnings
+    from os.path import dirname, abspath, exists, join
+    from benchmark.generate import generate_tables, write_tables, write_config
+    from benchmark.run import ORG_NAME, git_commit
+    from utils.augur_connect import augur_db_connect
+
+    warnings.simplefilter("ignore")
+
+    parser = argparse.ArgumentParser(prog='python -m benchmark.regress')
+
+    parser.add_argument("--baseline", required=False, dest = "baseline_file", default=join(dirname(abspath(__file__)), 'baseline.json'), help="The baseline JSON file (default to benchmark/baseline.json)")
+    parser.add_argument("--update", required=False, dest = "update", action='store_true', help="Save the measures as the new baseline instead of comparing them")
+    parser.add_argument("--runs", required=False, dest = "runs", type=int, default=5, help="The number of timed runs of each function (default to 5)")
+
+    args = parser.parse_args()
+
+    baseline_results = None
+    if not args.update:
+        if not exists(args.baseline_file):
+            print('There is no baseline in', args.baseline_file, '. Run with --update to measure one. Exiting')
+            sys.exit(1)
+        with open(args.baseline_file) as f:
+            baseline_results = json.load(f)
+        if baseline_results.get('scenario') != SCENARIO:
+            print('The baseline in', args.baseline_file, 'was measured for another scenario. Run with --update to measure it again. Exiting')
+            sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print('Generating', SCENARIO['repos'], 'repos')
+        database = join(tmp_dir, 'regress.sqlite')
+        write_tables(generate_tables(ORG_NAME, **SCENARIO), 'sqlite', database)
+        engine = augur_db_connect(write_config('sqlite', database))
+
+        print('Measuring the metric functions')
+        measures = measure_functions(engine, args.runs)
+
+        print('Comparing the backfill with a normal run')
+        mismatches = check_backfill(engine)
+        engine.dispose()
+
+    if mismatches:
+        print(len(mismatches), 'backfill mismatches with the normal run (repo, column, normal run, backfill):')
+        for repo_name, column, value, backfill_value in mismatches:
+            print(' ', repo_name, column, repr(value), repr(backfill_value))
+    else:
+        print('The backfill matches the normal run')
+
+    if args.update:
+        results = {
+            'commit': git_commit(),
+            'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'scenario': SCENARIO,
+            'tolerances': TOLERANCES,
+            'functions': measures,
+        }
+        # Tolerances adjusted in the last baseline are kept
+        if exists(args.baseline_file):
+            with open(args.baseline_file) as f:
+                results['tolerances'] = json.load(f).get('tolerances', TOLERANCES)
+
+        with open(args.baseline_file, 'w') as f:
+            json.dump(results, f, indent=4)
+            f.write('\n')
+
+        for name, function_measures in measures.items():
+            print('  {:<26} {}'.format(name, ', '.join(measure + ' ' + format_value(measure, value) for measure, value in function_measures.items())))
+        print('Baseline saved as', args.baseline_file)
+        sys.exit(1 if mismatches else 0)
+
+    tolerances = dict(TOLERANCES, **baseline_results.get('tolerances', {}))
+    comparisons = compare_measures(baseline_results['functions'], measures, tolerances)
+    print_report(baseline_results, comparisons, tolerances)
+
+    if mismatches or any(comparison[4] == 'regression' for comparison in comparisons):
+        sys.exit(1)
@@ -0,0 +1,266 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Times the metric functions and the full health_by_repo.py org loop
+against synthetic datasets of several sizes, and saves the results as JSON so
+they can be compared between commits.
+
+For each scale (number of repos), a dataset is generated with
+benchmark/generate.py, and then:
+* each metric's *_data function is timed for every repo, including its queries
+* each metric's *_graph function is timed for every repo, with the data
+  passed in so that only the graph is timed
+* health_by_repo.py is run for the whole org and its wall time is measured
+
+Usage
+-----
+
+usage: python -m benchmark.run [-h] [--scales SCALES [SCALES ...]] [--backend {sqlite,duckdb}] [--no-graphs]
+                               [--no-org-loop] [-o OUTPUT_FILE]
+
+  --scales SCALES [SCALES ...]
+                        The numbers of repos to generate (default to 5 20 50)
+  --backend             The type of database to generate (default to sqlite)
+  --no-graphs           Don't time the *_graph functions
+  --no-org-loop         Don't time the full health_by_repo.py run
+  -o OUTPUT_FILE, --output OUTPUT_FILE
+                        The JSON file for the results (default to
+                        output/benchmark/benchmark_COMMIT_YYYYMMDD-HHMMSS.json)
+"""
+
+ORG_NAME = 'benchmark_org'
+YEARS = 1
+BUS_DAYS = 2
+
+def summarize_times(times):
+    """ Summarizes a list of timings
+
+    Parameters
+    ----------
+    times : list
+        seconds (float)
+
+    Returns
+    -------
+    summary : dict
+    """
+    summary = {
+        'calls': len(times),
+        'total': sum(times),
+        'mean': sum(times) / len(times) if times else 0,
+        'max': max(times) if times else 0,
+    }
+
+    return summary
+
+def time_metrics(engine, graphs=True):
+    """ Times the *_data and *_graph function of each metric for every repo in
+    the benchmark org
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+    graphs : bool
+        whether to time the *_graph functions
+
+    Returns
+    -------
+    timings : dict
+        function name -> summary of the timings (see summarize_times)
+    """
+    import time
+    from utils.date_calcs import get_dates
+    from utils.repo_info import get_org_repos
+    from metrics.release_frequency import activity_release_data, activity_release_graph
+    from metrics.closure_ratio import sustain_prs_by_repo_data, sustain_prs_by_repo_graph
+    from metrics.bus_factor import contributor_risk_data, contributor_risk_graph
+    from metrics.first_response import response_time_data, response_time_graph
+
+    start_date, end_date = get_dates(365 * YEARS)
+    repoDF = get_org_repos(ORG_NAME, engine)
+
+    times = {}
+
+    def timed(name, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        times.setdefault(name, []).append(time.perf_counter() - start)
+        return result
+
+    for repo_id, repo_name in zip(repoDF['repo_id'], repoDF['repo_name']):
+        data = timed('activity_release_data', activity_release_data, repo_id, repo_name, ORG_NAME, start_date, end_date, engine)
+        if graphs:
+            timed('activity_release_graph', activity_release_graph, repo_id, repo_name, ORG_NAME, start_date, end_date, engine, YEARS, data=data)
+
+        data = timed('sustain_prs_by_repo_data', sustain_prs_by_repo_data, repo_id, repo_name, ORG_NAME, start_date, end_date, engine)
+        if graphs:
+            timed('sustain_prs_by_repo_graph', sustain_prs_by_repo_graph, repo_id, repo_name, ORG_NAME, start_date, end_date, engine, YEARS, data=data)
+
+        data = timed('contributor_risk_data', contributor_risk_data, repo_id, repo_name, ORG_NAME, start_date, end_date, engine)
+        if graphs:
+            timed('contributor_risk_graph', contributor_risk_graph, repo_id, repo_name, ORG_NAME, start_date, end_date, engine, YEARS, data=data)
+
+        data = timed('response_time_data', response_time_data, repo_id, repo_name, ORG_NAME, start_date, end_date, engine, BUS_DAYS)
+        if graphs:
+            timed('response_time_graph', response_time_graph, repo_id, repo_name, ORG_NAME, start_date, end_date, engine, BUS_DAYS, YEARS, data=data)
+
+    timings = {name: summarize_times(function_times) for name, function_times in times.items()}
+
+    return timings
+
+def time_org_loop(config_file):
+    """ Runs health_by_repo.py for the whole benchmark org and measures its
+    wall time, including Python startup and imports
+
+    Parameters
+    ----------
+    config_file : str
+
+    Returns
+    -------
+    seconds : float
+    """
+    import sys
+    import time
+    import subprocess
+    from os.path import dirname, abspath
+
+    repo_dir = dirname(dirname(abspath(__file__)))
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, 'health_by_repo.py', '-o', ORG_NAME, '-y', str(YEARS), '-b', str(BUS_DAYS), '-c', config_file],
+        cwd=repo_dir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    return time.perf_counter() - start
+
+def clear_graphs():
+    """ Removes the graphs saved for the benchmark org, so that they are drawn
+    again instead of being kept because their data is unchanged
+    """
+    import shutil
+    from utils.file_operations import create_path_str
+
+    shutil.rmtree(create_path_str(ORG_NAME))
+
+def run_benchmark(scales, backend='sqlite', graphs=True, org_loop=True):
+    """ Generates a dataset for each scale and times the metrics against it
+
+    Parameters
+    ----------
+    scales : list
+        numbers of repos (int)
+    backend : str
+        'sqlite' or 'duckdb'
+    graphs : bool
+        whether to time the *_graph functions
+    org_loop : bool
+        whether to time the full health_by_repo.py run
+
+    Returns
+    -------
+    scale_results : list
+        one dict for each scale
+    """
+    import tempfile
+    from os.path import join
+    from benchmark.generate import generate_tables, write_tables, write_config
+    from utils.augur_connect import augur_db_connect
+
+    scale_results = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for repos in scales:
+            print('Generating', repos, 'repos')
+            database = join(tmp_dir, 'benchmark_' + str(repos) + '.' + backend)
+            tables = generate_tables(ORG_NAME, repos=repos)
+            write_tables(tables, backend, database)
+            config_file = write_config(backend, database)
+
+            engine = augur_db_connect(config_file)
+
+            print('Timing metric functions for', repos, 'repos')
+            clear_graphs()
+            result = {
+                'repos': repos,
+                'rows': {table: len(df) for table, df in tables.items()},
+                'functions': time_metrics(engine, graphs),
+            }
+            engine.dispose()
+
+            if org_loop:
+                print('Timing health_by_repo.py for', repos, 'repos')
+                clear_graphs()
+                result['org_loop_seconds'] = time_org_loop(config_file)
+
+            scale_results.append(result)
+
+    return scale_results
+
+def git_commit():
+    """ Gets the current git commit of this repository
+
+    Returns
+    -------
+    commit : str
+        the commit hash, or 'unknown'
+    """
+    import subprocess
+    from os.path import dirname, abspath
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=dirname(dirname(abspath(__file__))),
+            check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = 'unknown'
+
+    return commit
+
+if __name__ == "__main__":
+    import argparse
+    import datetime
+    import json
+    import platform
+    import warnings
+    from os.path import dirname, abspath, join
+    from pathlib import Path
+
+    warnings.simplefilter("ignore")
+
+    parser = argparse.ArgumentParser(prog='python -m benchmark.run')
+
+    parser.add_argument("--scales", required=False, dest = "scales", type=int, nargs='+', default=[5, 20, 50], help="The numbers of repos to generate (default to 5 20 50)")
+    parser.add_argument("--backend", required=False, dest = "backend", default='sqlite', choices=['sqlite', 'duckdb'], help="The type of database to generate (default to sqlite)")
+    parser.add_argument("--no-graphs", required=False, dest = "graphs", action='store_false', help="Don't time the *_graph functions")
+    parser.add_argument("--no-org-loop", required=False, dest = "org_loop", action='store_false', help="Don't time the full health_by_repo.py run")
+    parser.add_argument("-o", "--output", required=False, dest = "output_file", default=None, help="The JSON file for the results (default to output/benchmark/benchmark_COMMIT_YYYYMMDD-HHMMSS.json)")
+
+    args = parser.parse_args()
+
+    commit = git_commit()
+    now = datetime.datetime.now()
+
+    results = {
+        'commit': commit,
+        'created_at': now.isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'backend': args.backend,
+        'scales': run_benchmark(args.scales, args.backend, args.graphs, args.org_loop),
+    }
+
+    output_file = args.output_file
+    if output_file == None:
+        output_dir = join(dirname(dirname(abspath(__file__))), 'output', 'benchmark')
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        output_file = join(output_dir, 'benchmark_' + commit[:10] + '_' + now.strftime('%Y%m%d-%H%M%S') + '.json')
+
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=4)
+
+    for scale in results['scales']:
+        print('\n' + str(scale['repos']), 'repos:')
+        for name, summary in scale['functions'].items():
+            print('  {:<28} {:>8.3f}s total {:>8.3f}s mean'.format(name, summary['total'], summary['mean']))
+        if 'org_loop_seconds' in scale:
+            print('  {:<28} {:>8.3f}s'.format('health_by_repo.py', scale['org_loop_seconds']))
+
+    print('\nResults saved as', output_file)
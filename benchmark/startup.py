@@ -0,0 +1,179 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Checks that health_by_repo.py starts quickly, by timing it in a fresh
+Python process from startup to its first query, and fails if it takes longer
+than a budget or if it loads the heavy libraries before then.
+
+health_by_repo.py only imports pandas, matplotlib and seaborn when it starts
+to gather data, so that --help and a run for an invalid org or repo stop
+before they are loaded. Short runs for a single repo are mostly startup, so
+this is run to catch an import that brings them back. Two commands are run,
+each with python -X importtime:
+* health_by_repo.py --help
+* health_by_repo.py for a repo that doesn't exist, which connects to the
+  database, runs the query that looks up the repo and stops there
+
+Each is run several times and the fastest run is kept, since the first run
+also pays for reading the files from disk.
+
+Usage
+-----
+
+usage: python -m benchmark.startup [-h] [-c AUGUR_CONFIG] [--org ORG_NAME] [--budget BUDGET] [--runs RUNS]
+
+  -c AUGUR_CONFIG, --configfile AUGUR_CONFIG
+                        The Augur config.json file to connect with (default to a small
+                        SQLite dataset generated with benchmark/generate.py)
+  --org ORG_NAME        The name of the GitHub organization to look the repo up in
+                        (default to benchmark_org)
+  --budget BUDGET       The most seconds each command can take (default to 1.0)
+  --runs RUNS           The number of times to run each command (default to 3)
+
+Output
+------
+The seconds taken by each command, the seconds spent importing modules and
+any heavy libraries that were loaded. The exit status is 1 if a command took
+longer than the budget or loaded a heavy library.
+"""
+
+# Libraries that should not be loaded before the first query
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'matplotlib', 'seaborn']
+
+BUDGET_SECONDS = 1.0
+
+def parse_importtime(stderr):
+    """ Gets the modules imported by a process run with python -X importtime
+
+    Parameters
+    ----------
+    stderr : str
+        what the process wrote to stderr
+
+    Returns
+    -------
+    import_seconds : float
+        the time spent importing modules
+    modules : list
+        the names of the top-level modules and packages imported
+    """
+    import_seconds = 0.0
+    modules = []
+
+    # Each line is like "import time:  self [us] | cumulative | name",
+    # with the name indented under the module that imported it
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('| imported package'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        import_seconds += int(self_us) / 1000000
+        modules.append(name.strip().split('.')[0])
+
+    return import_seconds, sorted(set(modules))
+
+def time_command(args, runs):
+    """ Runs health_by_repo.py in a fresh Python process with -X importtime
+    and times it
+
+    Parameters
+    ----------
+    args : list
+        command line arguments for health_by_repo.py
+    runs : int
+
+    Returns
+    -------
+    result : dict
+        seconds for the fastest run, import_seconds and the heavy modules
+        that were loaded
+    """
+    import sys
+    import time
+    import subprocess
+    from os.path import dirname, abspath
+
+    repo_dir = dirname(dirname(abspath(__file__)))
+
+    result = None
+    for run in range(runs):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, '-X', 'importtime', 'health_by_repo.py'] + args,
+            cwd=repo_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        seconds = time.perf_counter() - start
+
+        import_seconds, modules = parse_importtime(process.stderr)
+        if result == None or seconds < result['seconds']:
+            result = {
+                'seconds': seconds,
+                'import_seconds': import_seconds,
+                'heavy_modules': [module for module in HEAVY_MODULES if module in modules],
+            }
+
+    return result
+
+def check_startup(config_file, org_name, budget=BUDGET_SECONDS, runs=3):
+    """ Times health_by_repo.py from startup to its first query and prints
+    the results
+
+    Parameters
+    ----------
+    config_file : str
+    org_name : str
+    budget : float
+        the most seconds each command can take
+    runs : int
+
+    Returns
+    -------
+    passed : bool
+    """
+    commands = [
+        ('--help', ['--help']),
+        ('first query', ['-o', org_name, '-r', 'no_such_repo', '-c', config_file]),
+    ]
+
+    passed = True
+    for name, args in commands:
+        result = time_command(args, runs)
+        print('{:<12} {:>7.3f}s total {:>7.3f}s imports'.format(name, result['seconds'], result['import_seconds']))
+
+        if result['heavy_modules']:
+            print('  loaded before the first query:', ', '.join(result['heavy_modules']))
+            passed = False
+        if result['seconds'] > budget:
+            print('  over the budget of', budget, 'seconds')
+            passed = False
+
+    return passed
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import tempfile
+    import warnings
+    from os.path import join
+
+    warnings.simplefilter("ignore")
+
+    parser = argparse.ArgumentParser(prog='python -m benchmark.startup')
+
+    parser.add_argument("-c", "--configfile", required=False, dest = "augur_config", default=None, help="The Augur config.json file to connect with (default to a small SQLite dataset generated with benchmark/generate.py)")
+    parser.add_argument("--org", required=False, dest = "org_name", default='benchmark_org', help="The name of the GitHub organization to look the repo up in (default to benchmark_org)")
+    parser.add_argument("--budget", required=False, dest = "budget", type=float, default=BUDGET_SECONDS, help="The most seconds each command can take (default to " + str(BUDGET_SECONDS) + ")")
+    parser.add_argument("--runs", required=False, dest = "runs", type=int, default=3, help="The number of times to run each command (default to 3)")
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_file = args.augur_config
+        if config_file == None:
+            from benchmark.generate import generate_tables, write_tables, write_config
+
+            database = join(tmp_dir, 'startup.sqlite')
+            write_tables(generate_tables(args.org_name, repos=1), 'sqlite', database)
+            config_file = write_config('sqlite', database)
+
+        passed = check_startup(config_file, args.org_name, args.budget, args.runs)
+
+    if not passed:
+        sys.exit(1)
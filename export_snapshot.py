@@ -0,0 +1,84 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Exports a local Parquet snapshot of the Augur data for a GitHub organization
+This script copies only the rows of the Augur tables that are needed to
+compute the Starter Project Health Metrics Model for the repositories in
+one GitHub organization over the requested number of years:
+repo, repo_groups, releases, pull_requests, pull_request_reviews,
+pull_request_message_ref, message, commits and contributors
+
+Each table is transferred in one bulk pass (COPY ... TO STDOUT on PostgreSQL)
+instead of the many small queries made by health_by_repo.py, so the snapshot
+can be taken once and the metrics computed from it as often as needed.
+
+Requirements
+------------
+
+The same config.json file used by health_by_repo.py. Writing the snapshot
+requires pyarrow, and reading it requires duckdb and duckdb-engine.
+
+To compute the metrics from the snapshot, use a config file like this
+one with health_by_repo.py:
+    {
+        "backend": "snapshot",
+        "database": "/path/to/snapshot_dir"
+    }
+
+Usage
+-----
+
+usage: export_snapshot.py [-h] -o ORG_NAME [-y YEARS] -c AUGUR_CONFIG [-d SNAPSHOT_DIR]
+
+  -h, --help            show this help message and exit
+  -o ORG_NAME, --org ORG_NAME
+                        The name of the GitHub organization to export (required)
+  -y YEARS, --years YEARS
+                        The number of years of data to export (default to 1)
+  -c AUGUR_CONFIG, --configfile AUGUR_CONFIG
+                        The full file path to an Augur config.json file (required)
+  -d SNAPSHOT_DIR, --snapshotdir SNAPSHOT_DIR
+                        The directory where the Parquet files will be written
+                        (default to output/YYYY-MM/org_name/_snapshot_yr_YEARS)
+
+Output
+------
+
+* One Parquet file per table and a snapshot.json file with the org, the
+  start and end dates and the rows exported from each table. Runs against
+  the snapshot stop with an error when they are for another org or a window
+  that the snapshot doesn't cover.
+"""
+import argparse
+from utils.augur_connect import augur_db_connect
+from utils.date_calcs import get_dates
+from utils.file_operations import create_path_str
+from utils.snapshot import export_snapshot
+
+# Gather options from command line arguments and store them in variables
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-o", "--org", required=True, dest = "org_name", help="The name of the GitHub organization to export (required)")
+parser.add_argument("-y", "--years", required=False, dest = "years", type=int, default=1, help="The number of years of data to export (default to 1)")
+parser.add_argument("-c", "--configfile", required=True, dest = "augur_config", help="The full file path to an Augur config.json file (required)")
+parser.add_argument("-d", "--snapshotdir", required=False, dest = "snapshot_dir", default=None, help="The directory where the Parquet files will be written (default to output/YYYY-MM/org_name/_snapshot_yr_YEARS)")
+
+args = parser.parse_args()
+org_name = args.org_name
+years = args.years
+augur_config = args.augur_config
+snapshot_dir = args.snapshot_dir
+
+# Get the dates for the export using the years argument if provided
+days = 365 * years
+start_date, end_date = get_dates(days)
+
+if snapshot_dir == None:
+    snapshot_dir = create_path_str(org_name) + '/_snapshot_yr_' + str(years)
+
+# Create the connection to the Augur database
+engine = augur_db_connect(augur_config)
+
+print('Exporting', org_name, 'from', start_date, 'to', end_date, 'into', snapshot_dir)
+
+export_snapshot(org_name, start_date, end_date, engine, snapshot_dir)
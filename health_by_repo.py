@@ -16,7 +16,21 @@ If a GitHub organization and repository are both specified, data will
 be gathered on that single repository only. 
 
 If only a GitHub organization is specified, it will gather data about
-every repository from that organization.
+every repository from that organization. Each repo is recorded in a
+checkpoint manifest as soon as it finishes, so a run that dies part way
+through can be continued with --resume (see utils/checkpoint.py). A repo
+that fails is reported and recorded, and the run goes on to the next repo.
+
+An org can also be run on several machines at once (see utils/work_queue.py).
+Start one coordinator with --coordinator queue.db, which adds the repos to a
+work queue in that SQLite file, waits and then writes the summaries, and
+any number of workers with --worker queue.db, on machines that can reach the
+same file. The workers take the years and business days from the queue.
+
+With --backfill N, the metrics are computed as of each of the last N
+month-ends instead, to show how they changed over time. The queries for a
+repo are run once for all of the months (see utils/backfill.py), and a CSV
+with one row per month is written for each repo instead of the graphs.
 
 Requirements
 ------------
@@ -35,10 +49,19 @@ config.json
     }
 Replace the 'x's with values to connect to your Augur database
 
+A local SQLite or DuckDB extract of the Augur tables can be used instead
+by adding "backend": "sqlite" or "backend": "duckdb" and setting
+"database" to the path of the file (see utils/augur_connect.py).
+
 Usage
 ----- 
 
-usage: health_by_repo.py [-h] -o ORG_NAME [-r REPO_NAME] [-y YEARS] [-b BUS_DAYS] -c AUGUR_CONFIG
+usage: health_by_repo.py [-h] -o ORG_NAME [-r REPO_NAME] [-y YEARS [YEARS ...]] [-b BUS_DAYS [BUS_DAYS ...]] -c AUGUR_CONFIG [-i IN_FLIGHT]
+                         [-t TRACE_FILE] [--profile-memory] [--memory-budget MEMORY_BUDGET] [--prometheus PROMETHEUS_FILE]
+                         [--resume] [--schedule] [--coordinator QUEUE_FILE | --worker QUEUE_FILE] [--backfill MONTHS]
+                         [--metrics METRIC [METRIC ...]] [--charts {dashboard,metrics,both,report}]
+                         [--approximate THRESHOLD] [--summary-format {csv,jsonl,parquet} [{csv,jsonl,parquet} ...]]
+                         [--repo-batch REPOS] [--summary-batch ROWS]
 
   -h, --help            show this help message and exit
   -o ORG_NAME, --org ORG_NAME
@@ -46,28 +69,133 @@ usage: health_by_repo.py [-h] -o ORG_NAME [-r REPO_NAME] [-y YEARS] [-b BUS_DAYS
   -r REPO_NAME, --repo REPO_NAME
                         The name of a GitHub repository in that org where your PRs can be found. If no repo is specified, data will be
                         collected for all repos from the given org.
-  -y YEARS, --years YEARS
-                        The number of years of data to collect (default to 1)
-  -b BUS_DAYS, --businessdays BUS_DAYS
-                        The number of business days to use in the time to first response calculation (default to 2)
+  -y YEARS [YEARS ...], --years YEARS [YEARS ...]
+                        The number of years of data to collect (default to 1). Several values can be given,
+                        like -y 1 2 3, and the data is fetched once for the widest window.
+  -b BUS_DAYS [BUS_DAYS ...], --businessdays BUS_DAYS [BUS_DAYS ...]
+                        The number of business days to use in the time to first response calculation (default to 2).
+                        Several values can be given, like -b 1 2 5.
   -c AUGUR_CONFIG, --configfile AUGUR_CONFIG
                         The full file path to an Augur config.json file (required)
+  -i IN_FLIGHT, --inflight IN_FLIGHT
+                        Gather data for up to this many repos at once, running all of the queries for
+                        a repo concurrently (default to 0, which runs the queries one after another)
+  -t TRACE_FILE, --trace TRACE_FILE
+                        Save the time spent in each query, transform and render stage, tagged by repo
+                        and metric, to this JSON lines file
+  --profile-memory      Record the peak memory of each query, transform and render stage for each repo
+                        with tracemalloc. The queries are run one after another, since the peaks can't
+                        be told apart for concurrent queries.
+  --memory-budget MEMORY_BUDGET
+                        Memory budget in MB for each repo. Repos estimated to need more have their
+                        commits counted in the database instead of fetched, or are skipped if that
+                        is not enough (see utils/memory.py).
+  --prometheus PROMETHEUS_FILE
+                        Save the total time for each stage and metric to this file in the Prometheus
+                        text format, for the node_exporter textfile collector
+  --resume              Continue the last run for the org, skipping the repos that it finished. It must
+                        have been run with the same years and business days in the same month.
+  --schedule            Process the largest repos first, by the rows counted for each repo or the time
+                        measured for it in earlier runs, and create the graphs for each repo as soon as
+                        its data is ready (see utils/schedule.py). Most useful with -i.
+  --coordinator QUEUE_FILE
+                        Add the repos in the org to a work queue in this SQLite file, wait for the
+                        workers to finish them and write the summaries. Starting it again with
+                        the same file and parameters picks up where it left off.
+  --worker QUEUE_FILE   Claim repos from the work queue in this SQLite file and gather the data and
+                        create the graphs for them one at a time, until every repo is finished
+  --backfill MONTHS     Compute the metrics as of each of the last MONTHS month-ends, with the data
+                        fetched once for all of them, and save them as a CSV for each repo instead of
+                        creating the graphs
+  --metrics METRIC [METRIC ...]
+                        The metrics to compute, out of release, closure_ratio, bus_factor and
+                        first_response (default to all of them). Only the data needed by these
+                        metrics is fetched (see metrics/registry.py).
+  --charts {dashboard,metrics,both,report}
+                        Draw the metrics for each repo as one dashboard graph, as a separate graph for
+                        each metric, or both (default to dashboard). With report, no graphs are
+                        drawn, and the data for the graphs is saved with a page that draws them in
+                        the browser instead.
+  --approximate THRESHOLD
+                        For a quick estimate, sample the PRs and commits of repos with more than
+                        THRESHOLD of them, so that about THRESHOLD of each are fetched. The summary
+                        CSVs get 95% confidence intervals and the names of the approximate values.
+  --summary-format {csv,jsonl,parquet} [{csv,jsonl,parquet} ...]
+                        Write the summary of each combination of years and business days as CSV,
+                        JSON lines or Parquet, or several of them (default to csv). JSON lines and
+                        Parquet have typed values (see utils/summary_writer.py). Parquet needs
+                        pyarrow.
+  --repo-batch REPOS    Fetch the repos of the org in batches of this many as the run goes, instead
+                        of holding the list of repos in memory (default to 1000). With --schedule,
+                        the repos of each batch are ordered largest first.
+  --summary-batch ROWS  Write the summary rows in batches of this many, which are the row groups of
+                        the Parquet files (default to 100)
 
 Output
 ------
 
 * Messages are printed to the screen for each data gathering step for each repo
 * Graphs are stored as png files in subdirectories of an "output" folder named like
-  output/YYYY-MM/org_name/repo_name
+  output/YYYY-MM/org_name/repo_name. By default, each repo has one dashboard
+  graph with every metric for each combination of years and business days,
+  named like repo_name_dashboard_y1_bd_2.png (see utils/dashboard.py)
+* With --charts report, the data for the graphs of each repo is saved as
+  repo_name_report.json, and the org folder gets _org_name_report.json and
+  _org_name_report.html, a page that draws the graphs for every repo in the
+  browser without a server (see utils/report.py)
+* When gathering data on an org, a summary CSV is written for every combination
+  of years and business days, named like _org_name_output_yr_1_bdays_2.csv,
+  along with a checkpoint manifest, _org_name_checkpoint.jsonl, that records
+  each repo as it finishes. With --summary-format, the summaries are written
+  as .jsonl or .parquet files instead or as well.
+* For a single repo, the summary is written in the repo folder, named like
+  repo_name_output_yr_1_bdays_2.csv
+* Repos that failed are listed at the end, and the exit status is 1 if there
+  were any
+* The exit status is 1 if there are no repos for the org in the Augur
+  database
+* Workers write the graphs under their own output folder, and leave the
+  summaries to the coordinator
+* With --backfill, a CSV is written for every combination of years and
+  business days in each repo folder instead of the graphs, named like
+  repo_name_backfill_y1_bd_2.csv, with the metrics as of each month-end
+* With --approximate, the summary CSVs have four more columns: approximate,
+  with the names of the values that are estimates from a sample, and
+  first_resp_mos_ci, closure_ratio_mos_ci and bus_factor_ci, with their
+  95% confidence intervals (see utils/approximate.py)
+* With --metrics, only the graphs for those metrics are created, and the
+  columns of the other metrics are left empty in the CSVs
+* The stages and repos that took the most time are printed at the end (see
+  utils/timing.py)
 
 """
 import argparse
+import itertools
+import os
+import socket
 import sys
-import pandas as pd
+import time
+import traceback
+# pandas, matplotlib and seaborn are only imported by the functions that use
+# them, so that --help and runs for an invalid org or repo stop before they
+# are loaded (see benchmark/startup.py)
 from utils.augur_connect import augur_db_connect
-from utils.date_calcs import get_dates
-from utils.repo_info import get_repo_info, fork_archive, get_org_repos
-from utils.file_operations import create_path_str
+from utils.date_calcs import get_windows
+from utils.repo_info import REPO_BATCH_SIZE, get_repo_info, iter_org_repos
+from utils.file_operations import create_path_str, output_path
+from utils.gather import iter_repo_queries, slice_query_results, repo_metric_data
+from utils.timing import tagged, stage, record_event, fold_records, print_summary, start_trace, close_trace, write_prometheus
+from utils.memory import start_profiling, print_memory_summary
+from utils.snapshot import check_snapshot
+from utils.checkpoint import checkpoint_filename, csv_key, read_checkpoint, iter_checkpoint, start_checkpoint, checkpoint_repo
+from utils.schedule import schedule_batches, record_costs
+from utils.work_queue import create_queue, queue_params, queue_counts, iter_claimed_repos, start_heartbeat, finish_repo, wait_for_queue, merge_queue
+from utils.summary_writer import SUMMARY_FORMATS, BATCH_SIZE, summary_row, open_summaries, write_summary, close_summary
+from utils.backfill import backfill_windows, backfill_repo_data, write_backfill
+from utils.dashboard import dashboard_graph, summary_values
+from utils.report import window_report, write_repo_report, write_org_report
+from utils.approximate import approximate_metric_data
+from metrics.registry import METRICS
 from metrics.release_frequency import activity_release_graph
 from metrics.closure_ratio import sustain_prs_by_repo_graph
 from metrics.first_response import response_time_graph
@@ -78,77 +206,442 @@ parser = argparse.ArgumentParser()
 
 parser.add_argument("-o", "--org", required=True, dest = "org_name", help="The name of the GitHub organization for data collection on your repo(s) (required)")
 parser.add_argument("-r", "--repo", required=False, dest = "repo_name", default=None, help="The name of a GitHub repository in that org where your PRs can be found. If no repo is specified, data will be collected for all repos from the given org.")
-parser.add_argument("-y", "--years", required=False, dest = "years", type=int, default=1, help="The number of years of data to collect (default to 1)")
-parser.add_argument("-b", "--businessdays", required=False, dest = "bus_days", type=int, default=2, help="The number of business days to use in the time to first response calculation (default to 2)")
+parser.add_argument("-y", "--years", required=False, dest = "years", type=int, nargs='+', default=[1], help="The number of years of data to collect (default to 1). Several values can be given, like -y 1 2 3, and the data is fetched once for the widest window.")
+parser.add_argument("-b", "--businessdays", required=False, dest = "bus_days", type=int, nargs='+', default=[2], help="The number of business days to use in the time to first response calculation (default to 2). Several values can be given, like -b 1 2 5.")
 parser.add_argument("-c", "--configfile", required=True, dest = "augur_config", help="The full file path to an Augur config.json file (required)")
+parser.add_argument("-i", "--inflight", required=False, dest = "in_flight", type=int, default=0, help="Gather data for up to this many repos at once, running all of the queries for a repo concurrently (default to 0, which runs the queries one after another)")
+parser.add_argument("-t", "--trace", required=False, dest = "trace_file", default=None, help="Save the time spent in each query, transform and render stage, tagged by repo and metric, to this JSON lines file")
+parser.add_argument("--profile-memory", required=False, dest = "profile_memory", action='store_true', help="Record the peak memory of each query, transform and render stage for each repo with tracemalloc. The queries are run one after another, since the peaks can't be told apart for concurrent queries.")
+parser.add_argument("--memory-budget", required=False, dest = "memory_budget", type=float, default=None, help="Memory budget in MB for each repo. Repos estimated to need more have their commits counted in the database instead of fetched, or are skipped if that is not enough.")
+parser.add_argument("--prometheus", required=False, dest = "prometheus_file", default=None, help="Save the total time for each stage and metric to this file in the Prometheus text format, for the node_exporter textfile collector")
+parser.add_argument("--resume", required=False, dest = "resume", action='store_true', help="Continue the last run for the org, skipping the repos that it finished. It must have been run with the same years and business days in the same month.")
+parser.add_argument("--schedule", required=False, dest = "schedule", action='store_true', help="Process the largest repos first, by the rows counted for each repo or the time measured for it in earlier runs, and create the graphs for each repo as soon as its data is ready. Most useful with -i.")
+queue_group = parser.add_mutually_exclusive_group()
+queue_group.add_argument("--coordinator", required=False, dest = "coordinator_queue", default=None, help="Add the repos in the org to a work queue in this SQLite file, wait for the workers to finish them and write the summaries. Starting it again with the same file and parameters picks up where it left off.")
+queue_group.add_argument("--worker", required=False, dest = "worker_queue", default=None, help="Claim repos from the work queue in this SQLite file and gather the data and create the graphs for them, until every repo is finished")
+parser.add_argument("--backfill", required=False, dest = "backfill", type=int, default=None, help="Compute the metrics as of each of the last MONTHS month-ends, with the data fetched once for all of them, and save them as a CSV for each repo instead of creating the graphs")
+parser.add_argument("--metrics", required=False, dest = "metrics", nargs='+', choices=list(METRICS), default=list(METRICS), help="The metrics to compute (default to all of them). Only the data needed by these metrics is fetched.")
+parser.add_argument("--charts", required=False, dest = "charts", choices=['dashboard', 'metrics', 'both', 'report'], default='dashboard', help="Draw the metrics for each repo as one dashboard graph, as a separate graph for each metric, or both (default to dashboard). With report, the data for the graphs is saved with a page that draws them in the browser instead.")
+parser.add_argument("--approximate", required=False, dest = "approximate", type=int, default=None, help="For a quick estimate, sample the PRs and commits of repos with more than THRESHOLD of them, so that about THRESHOLD of each are fetched. The summary CSVs get confidence intervals and the names of the approximate values.")
+parser.add_argument("--summary-format", required=False, dest = "summary_formats", nargs='+', choices=SUMMARY_FORMATS, default=['csv'], help="Write the summary of each combination of years and business days as CSV, JSON lines or Parquet, or several of them (default to csv). JSON lines and Parquet have typed values. Parquet needs pyarrow.")
+parser.add_argument("--repo-batch", required=False, dest = "repo_batch", type=int, default=REPO_BATCH_SIZE, help="Fetch the repos of the org in batches of this many as the run goes, instead of holding the list of repos in memory (default to " + str(REPO_BATCH_SIZE) + ")")
+parser.add_argument("--summary-batch", required=False, dest = "summary_batch", type=int, default=BATCH_SIZE, help="Write the summary rows in batches of this many, which are the row groups of the Parquet files (default to " + str(BATCH_SIZE) + ")")
 
 args = parser.parse_args()
 org_name = args.org_name
 repo_name = args.repo_name
-years = args.years
-bus_days = args.bus_days
+# The same numbers of years or business days given twice would open the
+# same summary twice
+years_list = sorted(set(args.years), reverse=True)
+bus_days_list = sorted(set(args.bus_days))
 augur_config = args.augur_config
+in_flight = args.in_flight
+trace_file = args.trace_file
+prometheus_file = args.prometheus_file
+profile_memory = args.profile_memory
+memory_budget = args.memory_budget
+resume = args.resume
+schedule = args.schedule
+coordinator_queue = args.coordinator_queue
+worker_queue = args.worker_queue
+backfill = args.backfill
+metrics = [metric for metric in METRICS if metric in args.metrics]
+charts = args.charts
+approximate = args.approximate
+summary_formats = list(dict.fromkeys(args.summary_formats))
+summary_batch = args.summary_batch
+repo_batch = args.repo_batch
+
+if (coordinator_queue != None or worker_queue != None) and (repo_name != None or resume):
+    print('The coordinator and worker options are for a whole org, and cannot be used with --repo or --resume. Exiting')
+    sys.exit(1)
+
+if backfill != None and (backfill < 1 or resume or coordinator_queue != None or worker_queue != None or approximate != None):
+    print('--backfill needs at least 1 month, and cannot be used with --resume, --coordinator, --worker or --approximate. Exiting')
+    sys.exit(1)
+
+if repo_batch < 1:
+    print('--repo-batch needs at least 1 repo. Exiting')
+    sys.exit(1)
+
+if approximate != None and approximate < 24:
+    print('--approximate needs a threshold of at least 24, the fewest PRs needed for the metrics. Exiting')
+    sys.exit(1)
+
+# Looked up without importing pyarrow, which is only loaded to write the
+# summaries
+if 'parquet' in summary_formats:
+    import importlib.util
+    if importlib.util.find_spec('pyarrow') == None:
+        print('--summary-format parquet needs pyarrow. Exiting')
+        sys.exit(1)
+
+# Workers run with the parameters that the coordinator put in the work queue
+if worker_queue != None:
+    params = queue_params(worker_queue)
+    if params == None:
+        print('There is no work queue in', worker_queue, 'yet. Start the coordinator first. Exiting')
+        sys.exit(1)
+    if params['org_name'] != org_name:
+        print('The work queue in', worker_queue, 'is for', params['org_name'], 'and not', org_name, '. Exiting')
+        sys.exit(1)
+    years_list = sorted(set(params['years']), reverse=True)
+    bus_days_list = params['bus_days']
+    metrics = params.get('metrics', list(METRICS))
+    approximate = params.get('approximate')
+    worker_id = socket.gethostname() + ':' + str(os.getpid())
+    # The order of the repos is set by the coordinator
+    schedule = False
+    # A worker only claims a repo when it has finished the last one, so
+    # that it never waits on the queue while holding a lease
+    if in_flight > 0:
+        print('Workers gather one repo at a time. Start more workers instead of using -i')
+        in_flight = 0
+
+if profile_memory:
+    start_profiling()
+    if in_flight > 0:
+        print('Running the queries one after another to profile memory')
+        in_flight = 0
+
+# The timings are written to the trace as each repo finishes
+if trace_file != None:
+    try:
+        start_trace(trace_file)
+    except OSError:
+        print('Could not write to the trace file', trace_file, '. Exiting')
+        sys.exit(1)
+
+run_start = time.perf_counter()
 
 # Print parameters to the screen
-print('Parameters: Years =', years, 'Business Days', bus_days)
+print('Parameters: Years =', years_list, 'Business Days', bus_days_list, 'Metrics', metrics)
 
-# Get the dates for the analysis using the years argument if provided
-days = 365 * years
-start_date, end_date = get_dates(days)
+# Get the dates for the analysis for each of the years arguments. The data
+# is fetched once for the widest window (the first one) and narrowed down
+# for the others.
+windows = get_windows(years_list)
+years, start_date, end_date = windows[0]
+
+# For a backfill, the data is fetched once from the start of the widest
+# window for the oldest month-end through the last complete month
+if backfill != None:
+    backfill_dates = {years: backfill_windows(backfill, years) for years, window_start, window_end in windows}
+    start_date = backfill_dates[years][0][0]
+    print('Backfilling the metrics as of', backfill, 'month-ends from', backfill_dates[years][0][1], 'to', end_date)
+
+if worker_queue != None and params['end_date'] != end_date:
+    print('The work queue in', worker_queue, 'was made for a run ending on', params['end_date'], 'instead of', end_date, '. Exiting')
+    sys.exit(1)
 
 # Create the connection to the Augur database
 engine = augur_db_connect(augur_config)
 
+# A snapshot has to be for this org and cover the whole window, or the
+# metrics would be computed from missing rows
+snapshot_error = check_snapshot(engine, org_name, start_date, end_date)
+if snapshot_error != None:
+    print(snapshot_error, '. Exiting')
+    sys.exit(1)
+
+# The ids of the repos finished by the last run, when resuming it
+completed = set()
+manifest = None
+summary_writers = []
+
 if repo_name == None:
     # This is the case where data is gathered on all repos from an org
-    repoDF = get_org_repos(org_name, engine)
+    # The repos are fetched in batches as the run goes, so that the list of
+    # repos is never held in memory for orgs with a very large number of them
+    repo_batches = iter_org_repos(org_name, engine, repo_batch)
+    first_batch = next(repo_batches, None)
+    if first_batch == None:
+        print('There are no repos for the', org_name, 'org in the Augur database. Exiting')
+        sys.exit(1)
     print("multiple repos")
+    repo_batches = itertools.chain([first_batch], repo_batches)
 
-    # When gathering data on an org, it can be helpful to have a summary CSV
+    # When gathering data on an org, it can be helpful to have a summary
+    # for each combination of years and business days
     path = create_path_str(org_name)
-    output_filename = path + '/_' + org_name + '_output_yr_' + str(years) + '_bdays_' + str(bus_days) + '.csv'
 
-    try:
-        csv_output = open(output_filename, 'w')
-        csv_output.write('org_name,repo_name,releases,first_resp_mos,closure_ratio_mos,bus_factor,bus_factor_percents,fork,archive\n')
-    except:
-        print('Could not write to csv file. Exiting')
-        sys.exit(1)
+    # The checkpoint manifest records each repo as it finishes, with its
+    # rows for the summaries
+    manifest_filename = checkpoint_filename(path, org_name)
+    checkpoint_params = {'org_name': org_name, 'years': years_list, 'bus_days': bus_days_list, 'end_date': end_date, 'metrics': metrics, 'approximate': approximate}
+
+    if resume:
+        completed = read_checkpoint(manifest_filename, checkpoint_params)
+        if completed == None:
+            print('The last run for', org_name, 'used different parameters, so it cannot be resumed. Exiting')
+            sys.exit(1)
+        print('Resuming:', len(completed), 'repos were finished by the last run')
+
+    # Workers leave the summaries to the coordinator, and the work queue
+    # takes the place of the checkpoint manifest. A backfill writes a CSV
+    # for each repo instead.
+    if worker_queue == None and backfill == None:
+        try:
+            summary_writers = open_summaries(path, '_' + org_name, years_list, bus_days_list, summary_formats, approximate != None, summary_batch)
+        except OSError:
+            print('Could not write to the summary files. Exiting')
+            sys.exit(1)
+
+    if coordinator_queue == None and worker_queue == None and backfill == None:
+        manifest = start_checkpoint(manifest_filename, checkpoint_params, completed)
+
+        # The summaries start with the rows of the repos finished by the last
+        # run, read back from the manifest one repo at a time
+        if completed:
+            try:
+                for entry in iter_checkpoint(manifest_filename):
+                    write_summary(summary_writers, entry['summary_rows'])
+            except OSError:
+                print('Could not write to the summary files. Exiting')
+                sys.exit(1)
 
 else:
     # This is the case where data is gathered on a single org / repo combo
     repo_id = get_repo_info(engine, org_name, repo_name)
-    repoDF = pd.DataFrame([[repo_id, repo_name]], columns=['repo_id', 'repo_name'])
+    repo_batches = [[(repo_id, repo_name)]]
+
+    # The summary for a single repo goes in its folder
+    path = output_path(repo_name, org_name)
+    if backfill == None:
+        try:
+            summary_writers = open_summaries(path, repo_name, years_list, bus_days_list, summary_formats, approximate != None, summary_batch)
+        except OSError:
+            print('Could not write to the summary files. Exiting')
+            sys.exit(1)
+
+# Collect data for every repo in repo_batches
+# The queries for each repo are run once for the widest window. With the
+# in_flight option, the queries for the next repos are run concurrently in
+# the background while the graphs are created for each repo.
+
+# Errors are caught for each repo, so that one repo that fails is reported
+# and recorded without stopping the run.
+
+repo_batches = ([(repo_id, repo_name) for repo_id, repo_name in batch if str(repo_id) not in completed] for batch in repo_batches)
+failed = []
+
+# With the schedule option, the repos in each batch are ordered largest first
+# and are handed over as soon as their data is ready. The costs of the repos
+# are kept until they finish, and the measured ones until they are saved.
+if schedule:
+    repo_costs = {}
+    measured_costs = {}
+    repo_batches = schedule_batches(repo_batches, org_name, start_date, end_date, engine, repo_costs)
+
+repos = (repo for batch in repo_batches for repo in batch)
+
+# The report lists every repo in the org, which are fetched again in batches
+# when it is written
+if args.repo_name == None:
+    report_repo_names = (name for batch in iter_org_repos(org_name, engine, repo_batch) for repo_id, name in batch)
+else:
+    report_repo_names = [args.repo_name]
+
+# The coordinator only fills the work queue, waits for the workers and
+# writes their results to the summaries
+if coordinator_queue != None:
+    created = create_queue(coordinator_queue, checkpoint_params, repos)
+    if created == None:
+        print('The work queue in', coordinator_queue, 'was made for other parameters. Exiting')
+        sys.exit(1)
+    elif created:
+        print('Added', sum(queue_counts(coordinator_queue).values()), 'repos to the work queue in', coordinator_queue)
+    else:
+        print('Picking up the work queue in', coordinator_queue)
+
+    wait_for_queue(coordinator_queue)
+
+    if charts == 'report':
+        json_filename, html_filename = write_org_report(org_name, report_repo_names)
+        print('Report for', org_name, 'saved as', html_filename)
+
+    failed = merge_queue(coordinator_queue, summary_writers)
+    for writer in summary_writers:
+        close_summary(writer)
+    print('Summaries written for', org_name, 'in', path)
+
+    if failed:
+        print(len(failed), 'repos failed:')
+        for repo_name, error in failed:
+            print(' ', repo_name, '-', error)
+        print('Start the coordinator and workers again with the same work queue to retry them')
+        sys.exit(1)
+    sys.exit(0)
 
-# Collect data for every repo in repoDF
+# Workers claim the repos from the work queue one at a time, and renew
+# their leases on them in the background
+if worker_queue != None:
+    repos = iter_claimed_repos(worker_queue, worker_id)
+    heartbeat = start_heartbeat(worker_queue, worker_id)
 
-for repo in repoDF.iterrows():
-    repo_id = repo[1]['repo_id']
-    repo_name = repo[1]['repo_name']
+for repo_id, repo_name, query_results in iter_repo_queries(repos, org_name, start_date, end_date, engine, in_flight, memory_budget, ordered=not schedule, metrics=metrics, approximate=approximate):
 
-    # Check to see if the repo is Forked or Archived, since those impact 
-    # how you might interpret this data and print them to the screen
-    # In general, this model isn't intended to be used with forked
-    # or archived repos.
-    is_forked, is_archived = fork_archive(repo_name, org_name, engine)
-    print(org_name, repo_name, '- Forked:', str(is_forked), 'Archived:', str(is_archived))
+    # Rows for the summaries, written once the repo is finished
+    summary_rows = {}
+    repo_done = False
 
-    # This section collects all of the data using the functions for each graph
-    # found in common_functions.py and creates the graphs for each metric
-    # Skips archived repos
+    try:
+        with tagged(org=org_name, repo=repo_name), stage('repo'):
+            if 'error' in query_results:
+                raise query_results['error']
+
+            # Check to see if the repo is Forked or Archived, since those impact 
+            # how you might interpret this data and print them to the screen
+            # In general, this model isn't intended to be used with forked
+            # or archived repos.
+            is_forked, is_archived = query_results['fork_archive']
+            print(org_name, repo_name, '- Forked:', str(is_forked), 'Archived:', str(is_archived))
+
+            # With a memory budget, repos that need too much memory have their
+            # commits counted in the database, or are skipped
+            plan, estimate = query_results.get('memory_plan', ('full', None))
+            if plan == 'aggregate':
+                print('Estimated to need', round(estimate / 1024 / 1024, 1), 'MB without the commits, which are counted in the database to stay within the memory budget')
+            elif plan == 'skip':
+                print('Skipped: estimated to need', round(estimate / 1024 / 1024, 1), 'MB, which is over the memory budget of', memory_budget, 'MB')
+                record_event('skip', reason='memory_budget', estimate_bytes=estimate, budget_mb=memory_budget)
+
+            # This section computes the data for each metric from the query results
+            # for each window and creates the graphs for each metric
+            # Skips archived repos
+
+            if is_archived == False and plan != 'skip' and backfill != None:
+                for years, window_start, window_end in windows:
+                    series = backfill_repo_data(query_results, repo_id, repo_name, backfill_dates[years], engine, bus_days_list, metrics)
+                    for filename in write_backfill(series, repo_name, org_name, years):
+                        print('Metrics as of each month-end for', org_name, '/', repo_name, 'saved as', filename)
+
+            elif is_archived == False and plan != 'skip':
+                report_windows = []
+                for years, window_start, window_end in windows:
+                    window_results = slice_query_results(query_results, window_start, window_end)
+                    repo_data = repo_metric_data(window_results, repo_id, repo_name, org_name, window_start, window_end, engine, bus_days_list, metrics)
+
+                    # The intervals come from the sampled counts, which are
+                    # then scaled up for the graphs
+                    if approximate != None:
+                        intervals = approximate_metric_data(repo_data, window_results.get('sample', {}), bus_days_list)
+
+                    if charts == 'report':
+                        report_windows.append(window_report(repo_data, years, window_start, window_end, bus_days_list))
+
+                    if charts in ['metrics', 'both']:
+                        if 'release' in repo_data:
+                            with stage('render', metric='release'):
+                                activity_release_graph(repo_id, repo_name, org_name, window_start, window_end, engine, years, data=repo_data['release'])
+
+                        if 'closure_ratio' in repo_data:
+                            with stage('render', metric='closure_ratio'):
+                                sustain_prs_by_repo_graph(repo_id, repo_name, org_name, window_start, window_end, engine, years, data=repo_data['closure_ratio'])
+
+                        if 'bus_factor' in repo_data:
+                            with stage('render', metric='bus_factor'):
+                                contributor_risk_graph(repo_id, repo_name, org_name, window_start, window_end, engine, years, data=repo_data['bus_factor'])
+
+                    for bus_days in bus_days_list:
+                        if charts in ['metrics', 'both'] and 'first_response' in repo_data:
+                            with stage('render', metric='first_response'):
+                                response_time_graph(repo_id, repo_name, org_name, window_start, window_end, engine, bus_days, years, data=repo_data['first_response'][bus_days])
+
+                        if charts in ['dashboard', 'both']:
+                            with stage('render', metric='dashboard'):
+                                dashboard_graph(repo_name, org_name, window_start, window_end, years, bus_days, repo_data)
+
+                        # The summary values of the metrics that were not selected are left empty
+                        values = summary_values(repo_data, bus_days)
+                        interval = intervals[bus_days] if approximate != None else None
+                        summary_rows[csv_key(years, bus_days)] = summary_row(org_name, repo_name, values, is_forked, is_archived, interval)
+
+            # Archived and skipped repos are listed in the report without graphs
+            if charts == 'report' and backfill == None:
+                with stage('render', metric='report'):
+                    write_repo_report(repo_name, org_name, is_forked, is_archived, report_windows if is_archived == False and plan != 'skip' else [])
+
+    except Exception as e:
+        print('Error gathering data for', org_name, '/', repo_name, '- skipping this repo')
+        traceback.print_exception(type(e), e, e.__traceback__)
+        with tagged(org=org_name, repo=repo_name):
+            record_event('error', error=repr(e))
+        failed.append(repo_name)
+
+        if worker_queue != None:
+            finish_repo(worker_queue, repo_id, worker_id, error=repr(e))
+        elif manifest != None:
+            checkpoint_repo(manifest, repo_id, repo_name, 'failed', error=repr(e))
+
+    else:
+        # The rows may still be waiting in a batch when the repo is recorded
+        # as done. A resumed run rewrites the summaries from the manifest,
+        # so it never loses or repeats a row.
+        if worker_queue != None:
+            finish_repo(worker_queue, repo_id, worker_id, summary_rows)
+        else:
+            write_summary(summary_writers, summary_rows)
+            if manifest != None:
+                checkpoint_repo(manifest, repo_id, repo_name, 'done', summary_rows)
+        repo_done = True
+
+    # The timings of the repo are added to the totals instead of being kept
+    # for the rest of the run
+    repo_seconds = fold_records(repo_name, memory_budget)
+
+    # Save the time measured for the repos for the next scheduled runs, a
+    # batch at a time
+    if schedule:
+        cost = repo_costs.pop(str(repo_id), None)
+        if repo_done and cost != None:
+            measured_costs[str(repo_id)] = dict(cost, seconds=repo_seconds)
+        if len(measured_costs) >= repo_batch:
+            record_costs(org_name, measured_costs)
+            measured_costs = {}
 
-    if is_archived == False:
-        releases = activity_release_graph(repo_id, repo_name, org_name, start_date, end_date, engine, years)
+    # Print a separator between repos
+    print('-------------')
 
-        closure_ratio_mos = sustain_prs_by_repo_graph(repo_id, repo_name, org_name, start_date, end_date, engine, years)
+for writer in summary_writers:
+    close_summary(writer)
 
-        bus_factor, bus_factor_percents = contributor_risk_graph(repo_id, repo_name, org_name, start_date, end_date, engine, years)
+if manifest != None:
+    manifest.close()
 
-        first_resp_mos = response_time_graph(repo_id, repo_name, org_name, start_date, end_date, engine, bus_days, years)
+if worker_queue != None:
+    heartbeat.set()
 
-        if len(repoDF) > 1:
-            csv_line = org_name + ',' + repo_name + ',' + releases + ',' + first_resp_mos + ',' + closure_ratio_mos + ',' + bus_factor + ',' + bus_factor_percents + ',' + str(is_forked) + ',' + str(is_archived) + '\n'
-            csv_output.write(csv_line)
-    
-    # Print a separator between repos
-    print('-------------')
+# The report for the org includes the repos finished by earlier runs that
+# were resumed. Workers leave it to the coordinator.
+if charts == 'report' and backfill == None and worker_queue == None:
+    json_filename, html_filename = write_org_report(org_name, report_repo_names)
+    print('Report for', org_name, 'saved as', html_filename)
+
+# Print the slowest stages and repos, and save the timings if requested
+run_seconds = time.perf_counter() - run_start
+print('Finished in', round(run_seconds, 1), 'seconds')
+fold_records(budget_mb=memory_budget, finished=True)
+print_summary()
+
+if profile_memory:
+    print_memory_summary(memory_budget)
+
+if trace_file != None:
+    close_trace()
+    print('Timings saved as', trace_file)
+
+if prometheus_file != None:
+    write_prometheus(prometheus_file, org_name, run_seconds)
+    print('Prometheus metrics saved as', prometheus_file)
+
+if schedule and measured_costs:
+    record_costs(org_name, measured_costs)
+
+# Report the repos that failed, with a non-zero exit status so that
+# scheduled runs notice them
+if failed:
+    print(len(failed), 'repos failed:', ', '.join(failed))
+    if manifest != None:
+        print('Run again with --resume to retry them')
+    sys.exit(1)
@@ -3,8 +3,65 @@
 
 """ Contains functions used to gather data and graph the Bus Factor metric
 """
-def commit_author_data(repo_id, start_date, end_date, engine):
-    """ Gets data about the number of commits from each author
+
+# The datasets this metric is computed from (see metrics/registry.py)
+DATASETS = ['commits']
+
+def bot_commit_filter_sql():
+    """ Builds the conditions that leave out the commits made by known bots
+
+    Returns
+    -------
+    filter_str : str
+        conditions to add to a WHERE clause on the commits table
+    """
+    filter_str = """
+                        AND commits.cmt_author_name NOT LIKE 'snyk%'
+                        AND commits.cmt_author_name NOT LIKE '%bot'
+                        AND commits.cmt_author_name NOT LIKE '%Bot'
+                        AND commits.cmt_author_name NOT LIKE '%BOT'
+                        AND commits.cmt_author_name NOT LIKE 'dependabot%'
+                        AND commits.cmt_author_name NOT LIKE 'gerrit%'
+                        AND commits.cmt_author_name NOT LIKE '%utomation%'
+                        AND commits.cmt_author_name NOT LIKE '%ipeline%'
+                        AND commits.cmt_author_name != 'Travis CI'"""
+
+    return filter_str
+
+def human_commits_sql(repo_id, start_date, end_date, commit_sample=1):
+    """ Builds the query for the commits made by humans (excluding known bots),
+    which is shared by commit_data and commit_author_counts
+
+    Parameters
+    ----------
+    repo_id : str
+    start_date : str
+    end_date : str
+    commit_sample : int
+        keep about 1 in every commit_sample commits (see utils/approximate.py)
+
+    Returns
+    -------
+    query_str : str
+    """
+    from utils.approximate import commit_sample_sql
+
+    query_str = f"""
+                    SELECT
+                        DISTINCT commits.cmt_commit_hash, commits.cmt_author_timestamp, contributors.cntrb_login
+                    FROM
+                        commits, contributors
+                    WHERE 
+                        commits.repo_id = {repo_id}
+                        AND commits.cmt_ght_author_id = contributors.cntrb_id{bot_commit_filter_sql()}
+                        AND commits.cmt_author_timestamp >= {start_date}
+                        AND commits.cmt_author_timestamp <= {end_date}{commit_sample_sql(commit_sample)}
+                    """
+
+    return query_str
+
+def commit_data(repo_id, start_date, end_date, engine, commit_sample=1):
+    """ Gets the commits made by humans (excluding known bots)
 
     Parameters
     ----------
@@ -12,42 +69,56 @@ def commit_author_data(repo_id, start_date, end_date, engine):
     start_date : str
     end_date : str
     engine : sqlalchemy object
+    commit_sample : int
+        keep about 1 in every commit_sample commits (see utils/approximate.py)
 
     Returns
     -------
-    authorDF : dataframe
+    commitsDF : dataframe
     """
     import pandas as pd
+    import sqlalchemy as s
+    from utils.fetch import fetch_df
     #from utils.date_calcs import convert_to_dt
 
     #start_date, end_date = convert_to_dt(start_date, end_date)
 
     #Commit data - from humans excluding known bots
     commitsDF = pd.DataFrame()
-    commitsquery = f"""
-                    SELECT
-                        DISTINCT(commits.cmt_commit_hash), commits.cmt_author_timestamp, contributors.cntrb_login
-                    FROM
-                        commits, contributors
-                    WHERE 
-                        commits.repo_id = {repo_id}
-                        AND commits.cmt_ght_author_id = contributors.cntrb_id
-                        AND commits.cmt_author_name NOT LIKE 'snyk%%'
-                        AND commits.cmt_author_name NOT LIKE '%%bot'
-                        AND commits.cmt_author_name NOT LIKE '%%Bot'
-                        AND commits.cmt_author_name NOT LIKE '%%BOT'
-                        AND commits.cmt_author_name NOT LIKE 'dependabot%%'
-                        AND commits.cmt_author_name NOT LIKE 'gerrit%%'
-                        AND commits.cmt_author_name NOT LIKE '%%utomation%%'
-                        AND commits.cmt_author_name NOT LIKE '%%ipeline%%'
-                        AND commits.cmt_author_name != 'Travis CI'
-                        AND commits.cmt_author_timestamp >= {start_date}
-                        AND commits.cmt_author_timestamp <= {end_date}
+    commitsquery = s.sql.text(human_commits_sql(repo_id, start_date, end_date, commit_sample) + """
                     ORDER BY
                         contributors.cntrb_login;
-                    """
+                    """)
     
-    commitsDF = pd.read_sql_query(commitsquery, con=engine)
+    commitsDF = fetch_df(commitsquery, engine, parse_dates=['cmt_author_timestamp'])
+
+    return commitsDF
+
+def commit_author_data(repo_id, start_date, end_date, engine, commitsDF=None):
+    """ Gets data about the number of commits from each author
+
+    Parameters
+    ----------
+    repo_id : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy object
+    commitsDF : dataframe
+        data from commit_data if it has already been gathered (optional)
+
+    Returns
+    -------
+    authorDF : dataframe
+    """
+    import pandas as pd
+    from utils.summary_tables import summary_schema
+
+    if commitsDF is None:
+        # The commits are already counted by author in the summary tables
+        if summary_schema(engine, end_date) != None:
+            return commit_author_counts(repo_id, start_date, end_date, engine)
+        commitsDF = commit_data(repo_id, start_date, end_date, engine)
+
     total_commits = commitsDF.cmt_commit_hash.nunique()    
 
     authorDF = pd.DataFrame()
@@ -62,7 +133,80 @@ def commit_author_data(repo_id, start_date, end_date, engine):
 
     return authorDF
 
-def contributor_risk_data(repo_id, repo_name, org_name, start_date, end_date, engine):
+def commit_author_counts(repo_id, start_date, end_date, engine):
+    """ Gets the same data as commit_author_data, but the commits are counted
+    by the database, so only one row per author is fetched. This is used
+    instead of commit_data and commit_author_data for repos with too many
+    commits to fetch within the memory budget (see utils/memory.py), and
+    when the summary tables can be used (see utils/summary_tables.py).
+
+    Parameters
+    ----------
+    repo_id : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy object
+
+    Returns
+    -------
+    authorDF : dataframe
+    """
+    import sqlalchemy as s
+    from utils.fetch import fetch_df
+    from utils.summary_tables import summary_schema
+
+    schema = summary_schema(engine, end_date)
+    if schema != None:
+        # Commits are counted by day in the summary tables, so the end date
+        # is left out, like it is for all but commits made exactly at midnight
+        authorquery = s.sql.text(f"""
+                    SELECT
+                        login AS name,
+                        CAST(SUM(commits) AS BIGINT) AS commits,
+                        (SELECT CAST(SUM(commits) AS BIGINT) FROM {schema}.repo_commits
+                            WHERE repo_id = {repo_id}
+                            AND commit_date >= {start_date}
+                            AND commit_date < {end_date}) AS total_commits
+                    FROM
+                        {schema}.author_commits
+                    WHERE
+                        repo_id = {repo_id}
+                        AND commit_date >= {start_date}
+                        AND commit_date < {end_date}
+                    GROUP BY
+                        login
+                    """)
+    else:
+        authorquery = s.sql.text(f"""
+                    WITH human_commits AS ({human_commits_sql(repo_id, start_date, end_date)})
+                    SELECT
+                        cntrb_login AS name,
+                        COUNT(*) AS commits,
+                        (SELECT COUNT(DISTINCT cmt_commit_hash) FROM human_commits) AS total_commits
+                    FROM
+                        human_commits
+                    WHERE
+                        cntrb_login IS NOT NULL
+                    GROUP BY
+                        cntrb_login
+                    """)
+
+    countsDF = fetch_df(authorquery, engine)
+
+    # Sorted by name first, like the groupby in commit_author_data, so that
+    # authors with the same number of commits are in the same order
+    authorDF = countsDF[['name', 'commits']].sort_values('name').reset_index(drop=True)
+    authorDF['commits'] = authorDF['commits'].astype('int64')
+    authorDF = authorDF.sort_values('commits', ascending=False)
+
+    if len(countsDF) > 0:
+        authorDF['percent'] = authorDF['commits'] / int(countsDF['total_commits'].iloc[0])
+    else:
+        authorDF['percent'] = authorDF['commits']
+
+    return authorDF
+
+def contributor_risk_data(repo_id, repo_name, org_name, start_date, end_date, engine, authorDF=None):
     """ Gathers data about the top contributors (by commit) - no more than 8 contributors
 
     Parameters
@@ -73,6 +217,8 @@ def contributor_risk_data(repo_id, repo_name, org_name, start_date, end_date, en
     start_date : str
     end_date : str
     engine : sqlalchemy object
+    authorDF : dataframe
+        data from commit_author_data if it has already been gathered (optional)
 
     Returns
     -------
@@ -87,32 +233,21 @@ def contributor_risk_data(repo_id, repo_name, org_name, start_date, end_date, en
     """
     import pandas as pd
     import textwrap
+    from metrics.thresholds import BUS_FACTOR_PEOPLE, bus_factor_people
 
-    authorDF = commit_author_data(repo_id, start_date, end_date, engine)
+    if authorDF is None:
+        authorDF = commit_author_data(repo_id, start_date, end_date, engine)
 
-    cum_percent = 0
     people_list = []
 
-    i = 1
-    num_people = 0
-
-    for item in authorDF.iterrows():
+    for item in authorDF.head(BUS_FACTOR_PEOPLE).iterrows():
         name = item[1]['name']
         percent = item[1]['percent']
         commits = item[1]['commits']
 
-        cum_percent += percent
-
         people_list.append([name, percent, commits])
 
-        if (cum_percent > .70 and num_people == 0):
-            num_people = i
-
-        if i == 8:
-            if cum_percent <= .70:
-                num_people = i
-            break
-        i+=1
+    num_people = bus_factor_people([person[1] for person in people_list])
 
     risk_list = []
 
@@ -146,7 +281,87 @@ def contributor_risk_data(repo_id, repo_name, org_name, start_date, end_date, en
 
     return error_num, error_text, names, percents, commits, title, interpretation, num_people
 
-def contributor_risk_graph(repo_id, repo_name, org_name, start_date, end_date, engine, years):
+def contributor_risk_template(ax, title_size=30):
+    """ Sets up the parts of a contributor risk graph that are the same for
+    every repo on a set of axes (see utils/render.py)
+
+    Parameters
+    ----------
+    ax : matplotlib axes
+    title_size : int
+        font size of the title
+
+    Returns
+    -------
+    template : dict
+        for contributor_risk_update
+    """
+
+    ax.xaxis.grid(False)
+    ax.set_ylabel('Commits')
+
+    return {'ax': ax, 'bars': [], 'labels': [], 'title_size': title_size}
+
+def contributor_risk_update(template, data):
+    """ Puts the data from the contributor_risk_data function into a graph
+    from contributor_risk_template. The bars and their labels are replaced,
+    since the number of people changes from repo to repo.
+
+    Parameters
+    ----------
+    template : dict
+    data : tuple
+        results of contributor_risk_data, without an error
+    """
+    import numpy as np
+    import seaborn as sns
+
+    error_num, error_text, names, percents, commits, title, interpretation, num_people = data
+
+    ax = template['ax']
+
+    for artist in template['bars'] + template['labels']:
+        artist.remove()
+
+    # The colors of sns.barplot
+    colors = [sns.desaturate(color, .75) for color in sns.color_palette(n_colors=len(names))]
+
+    positions = np.arange(len(names))
+    template['bars'] = list(ax.bar(positions, commits, 0.8, color=colors))
+
+    ax.set_xlim(-.5, len(names) - .5)
+    ax.set_xticks(positions)
+    ax.set_xticklabels(names, wrap=True)
+    ax.relim()
+    ax.autoscale_view()
+
+    ax.set_title(title, fontsize=template['title_size'])
+    xlabel_str = '\nKey Contributors\n\n' + interpretation
+    ax.set_xlabel(xlabel_str)
+
+    template['labels'] = []
+    for p, percent in zip(template['bars'], percents):
+        template['labels'].append(ax.annotate("{:.0%}".format(percent), (p.get_x() + p.get_width() / 2., p.get_height()),
+            ha='center', va='center', color='gray', xytext=(0, 20),
+            textcoords='offset points'))
+
+def contributor_risk_plot(ax, data, title_size=30):
+    """ Draws the data from the contributor_risk_data function on a set of
+    axes, which can be a whole graph or one part of a dashboard (see
+    utils/dashboard.py)
+
+    Parameters
+    ----------
+    ax : matplotlib axes
+    data : tuple
+        results of contributor_risk_data, without an error
+    title_size : int
+        font size of the title
+    """
+
+    contributor_risk_update(contributor_risk_template(ax, title_size), data)
+
+def contributor_risk_graph(repo_id, repo_name, org_name, start_date, end_date, engine, years, data=None):
     """ Graphs data from the contributor_risk_data function
 
     Parameters
@@ -157,50 +372,40 @@ def contributor_risk_graph(repo_id, repo_name, org_name, start_date, end_date, e
     start_date : str
     end_date : str
     engine : sqlalchemy object
+    years : int
+    data : tuple
+        results of contributor_risk_data if they have already been gathered (optional)
 
     Output
     ------
     Saves a png file in the location defined in the output_filename function.
 
     """
-    import seaborn as sns
-    import matplotlib
-    import matplotlib.pyplot as plt
-    from utils.file_operations import output_filename
+    from utils.file_operations import output_filename, chart_hash, chart_up_to_date, save_chart
+    from utils.render import metric_template
 
-    error_num, error_text, names, percents, commits, title, interpretation, num_people = contributor_risk_data(repo_id, repo_name, org_name, start_date, end_date, engine)
+    if data is None:
+        data = contributor_risk_data(repo_id, repo_name, org_name, start_date, end_date, engine)
+
+    error_num, error_text, names, percents, commits, title, interpretation, num_people = data
 
     if error_num == -1:
         return "Error","Error"
 
-    matplotlib.use('Agg') #prevents from tying to send plot to screen
-    sns.set_style('ticks')
-    sns.set(style="whitegrid", font_scale=2)
- 
-    fig, ax = plt.subplots()
- 
-    # the size of A4 paper
-    fig.set_size_inches(24, 8)
-
-    risk_bar = sns.barplot(x=names, y=commits).set_title(title, fontsize=30)
-
-    risk_bar_labels = ax.set_xticklabels(names, wrap=True)
-    risk_bar_labels = ax.set_ylabel('Commits')
-    xlabel_str = '\nKey Contributors\n\n' + interpretation
-    risk_bar_labels = ax.set_xlabel(xlabel_str)
-
-    i = 0
-    for p in ax.patches:
-        ax.annotate("{:.0%}".format(percents[i]), (p.get_x() + p.get_width() / 2., p.get_height()),
-            ha='center', va='center', color='gray', xytext=(0, 20),
-            textcoords='offset points')
-        i+=1
-
     filename_str = 'bus_factor_y' + str(years)
     filename = output_filename(repo_name, org_name, filename_str)
 
-    fig.savefig(filename, bbox_inches='tight', dpi=500)
-    plt.close(fig)
+    # Don't draw the graph again if the data and settings haven't changed
+    content_hash = chart_hash(data, metric=filename_str, size=(24, 8), font_scale=2, dpi=500)
+    if chart_up_to_date(filename, content_hash):
+        print('Bus Factor / Contributor Risk for', org_name, '/', repo_name, 'is unchanged in', filename)
+        return str(num_people), '--'.join(str(x) for x in percents)
+
+    # The figure is kept and drawn again for the next repo
+    template = metric_template('bus_factor', contributor_risk_template)
+    contributor_risk_update(template, data)
+
+    save_chart(template['fig'], filename, content_hash, bbox_inches='tight', dpi=500)
 
     print('Bus Factor / Contributor Risk for', org_name, '/', repo_name, 'from', start_date, 'to', end_date, '\nsaved as', filename)
     print(num_people, 'people make up > 70% of the commits in the past year.')
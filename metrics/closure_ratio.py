@@ -5,6 +5,45 @@
 Ratio metric
 """
 
+# The datasets this metric is computed from (see metrics/registry.py)
+DATASETS = ['prs_all', 'prs_closed']
+
+def summary_month_sql(schema, count_column, repo_id, start_date):
+    """ Builds the query for the monthly PR counts from the pr_monthly_counts
+    summary table (see utils/summary_tables.py). Months without any PRs are
+    left out, like they are by the queries on pull_requests.
+
+    Parameters
+    ----------
+    schema : str
+    count_column : str
+        'total' or 'closed'
+    repo_id : str
+    start_date : str
+
+    Returns
+    -------
+    query_str : str
+    """
+    from utils.date_calcs import parse_date
+
+    start_dt = parse_date(start_date)
+
+    query_str = f"""
+                    SELECT
+                        year,
+                        month,
+                        {count_column} AS total_prs_open_closed
+                    FROM
+                        {schema}.pr_monthly_counts
+                    WHERE
+                        repo_id = {repo_id}
+                        AND year * 12 + month >= {start_dt.year * 12 + start_dt.month}
+                        AND {count_column} > 0
+        """
+
+    return query_str
+
 def monthly_prs_closed(repo_id, repo_name, start_date, end_date, engine):
     """ Gets data about the PRs closed for every month
 
@@ -21,79 +60,34 @@ def monthly_prs_closed(repo_id, repo_name, start_date, end_date, engine):
     pr_monthdf : dataframe
     """
     import pandas as pd
+    import sqlalchemy as s
+    from utils.sql_dialect import date_part_sql
+    from utils.fetch import fetch_df
+    from utils.summary_tables import summary_schema
 
     pr_monthDF = pd.DataFrame()
-    pr_monthquery = f"""
+    schema = summary_schema(engine, end_date)
+    if schema != None:
+        pr_monthquery = s.sql.text(summary_month_sql(schema, 'closed', repo_id, start_date))
+    else:
+        pr_monthquery = s.sql.text(f"""
                     SELECT
-                        * 
+                        {date_part_sql('year', 'pull_requests.pr_created_at', engine)} AS year,
+                        {date_part_sql('month', 'pull_requests.pr_created_at', engine)} AS month,
+                        COUNT ( pull_requests.pr_src_id ) AS total_prs_open_closed
                     FROM
-                        (
-                        SELECT
-                            date_part( 'year', month :: DATE ) AS YEAR,
-                            date_part( 'month', month :: DATE ) AS month 
-                        FROM
-                            ( SELECT * FROM ( SELECT month :: DATE FROM generate_series ( TIMESTAMP {start_date}, TIMESTAMP {end_date}, INTERVAL '1 month' ) month ) d ) x 
-                        ) y
-                        LEFT OUTER JOIN (
-                        SELECT
-                            repo_id,
-                            repo_name,
-                            repo_group,
-                            date_part( 'year', pr_created_at :: DATE ) AS YEAR,
-                            date_part( 'month', pr_created_at :: DATE ) AS month,
-                            COUNT ( pr_src_id ) AS total_prs_open_closed 
-                        FROM
-                            (
-                            SELECT
-                                repo.repo_id AS repo_id,
-                                repo.repo_name AS repo_name,
-                                repo_groups.rg_name AS repo_group,
-                                pull_requests.pr_created_at AS pr_created_at,
-                                pull_requests.pr_closed_at AS pr_closed_at,
-                                pull_requests.pr_src_id AS pr_src_id
-                            FROM
-                                repo,
-                                repo_groups,
-                                pull_requests 
-                            WHERE
-                                repo.repo_group_id = repo_groups.repo_group_id 
-                                AND repo.repo_id = pull_requests.repo_id 
-                                AND repo.repo_id = {repo_id} 
-                                AND pull_requests.pr_src_state = 'closed'  
-                            ) L 
-                        GROUP BY
-                            L.repo_id,
-                            L.repo_name,
-                            L.repo_group,
-                            YEAR,
-                            month 
-                        ORDER BY
-                            repo_id,
-                            YEAR,
-                            month 
-                        ) T USING ( month, YEAR ) 
-                    ORDER BY
-                        YEAR,
-                        month;
-
-        """
-    pr_monthDFa = pd.read_sql_query(pr_monthquery, con=engine)
-
-    pr_monthDFa[['repo_id']] = pr_monthDFa[['repo_id']].fillna(value=repo_id)
-    
-    # Hack to fill in repo_name where there are nan's
-    pr_monthDFa[['repo_name']] = pr_monthDFa[['repo_name']].fillna(value=repo_name)
-    
-    pr_monthDF = pr_monthDFa
-    pr_monthDF.set_index('repo_id', 'year', 'month')
-
-
-    pr_monthDF[['total_prs_open_closed']] = pr_monthDF[['total_prs_open_closed']].fillna(0)
-
-    pr_monthDF['year'] = pr_monthDF['year'].map(int)
-    pr_monthDF['month'] = pr_monthDF['month'].map(int)
-    pr_monthDF['month'] = pr_monthDF['month'].apply('{:0>2}'.format)
-    pr_monthDF['yearmonth'] = pr_monthDF['year'].map(str) + '-' + pr_monthDF['month'].map(str)
+                        pull_requests
+                    WHERE
+                        pull_requests.repo_id = {repo_id}
+                        AND pull_requests.pr_src_state = 'closed'
+                        AND pull_requests.pr_created_at >= {start_date}
+                    GROUP BY
+                        {date_part_sql('year', 'pull_requests.pr_created_at', engine)},
+                        {date_part_sql('month', 'pull_requests.pr_created_at', engine)}
+        """)
+    pr_countsDF = fetch_df(pr_monthquery, engine)
+
+    pr_monthDF = fill_pr_months(pr_countsDF, repo_id, repo_name, start_date, end_date, closed=True)
 
     return pr_monthDF
 
@@ -114,77 +108,115 @@ def monthly_prs_all(repo_id, repo_name, start_date, end_date, engine):
     """
 
     import pandas as pd
+    import sqlalchemy as s
+    from utils.sql_dialect import date_part_sql
+    from utils.fetch import fetch_df
+    from utils.summary_tables import summary_schema
 
     pr_monthDF = pd.DataFrame()
 
-    pr_monthquery = f"""
+    schema = summary_schema(engine, end_date)
+    if schema != None:
+        pr_monthquery = s.sql.text(summary_month_sql(schema, 'total', repo_id, start_date))
+    else:
+        pr_monthquery = s.sql.text(f"""
                     SELECT
-                        * 
+                        {date_part_sql('year', 'pull_requests.pr_created_at', engine)} AS year,
+                        {date_part_sql('month', 'pull_requests.pr_created_at', engine)} AS month,
+                        COUNT ( pull_requests.pr_src_id ) AS total_prs_open_closed
                     FROM
-                        (
-                        SELECT
-                            date_part( 'year', month :: DATE ) AS YEAR,
-                            date_part( 'month', month :: DATE ) AS month 
-                        FROM
-                            ( SELECT * FROM ( SELECT month :: DATE FROM generate_series ( TIMESTAMP {start_date}, TIMESTAMP {end_date}, INTERVAL '1 month' ) month ) d ) x 
-                        ) y
-                        LEFT OUTER JOIN (
-                        SELECT
-                            repo_id,
-                            repo_name,
-                            repo_group,
-                            date_part( 'year', pr_created_at :: DATE ) AS YEAR,
-                            date_part( 'month', pr_created_at :: DATE ) AS month,
-                            COUNT ( pr_src_id ) AS total_prs_open_closed 
-                        FROM
-                            (
-                            SELECT
-                                repo.repo_id AS repo_id,
-                                repo.repo_name AS repo_name,
-                                repo_groups.rg_name AS repo_group,
-                                pull_requests.pr_created_at AS pr_created_at,
-                                pull_requests.pr_closed_at AS pr_closed_at,
-                                pull_requests.pr_src_id AS pr_src_id
-                            FROM
-                                repo,
-                                repo_groups,
-                                pull_requests 
-                            WHERE
-                                repo.repo_group_id = repo_groups.repo_group_id 
-                                AND repo.repo_id = pull_requests.repo_id 
-                                AND repo.repo_id = {repo_id} 
-                            ) L 
-                        GROUP BY
-                            L.repo_id,
-                            L.repo_name,
-                            L.repo_group,
-                            YEAR,
-                            month 
-                        ORDER BY
-                            repo_id,
-                            YEAR,
-                            month 
-                        ) T USING ( month, YEAR ) 
-                    ORDER BY
-                        YEAR,
-                        month;
+                        pull_requests
+                    WHERE
+                        pull_requests.repo_id = {repo_id}
+                        AND pull_requests.pr_created_at >= {start_date}
+                    GROUP BY
+                        {date_part_sql('year', 'pull_requests.pr_created_at', engine)},
+                        {date_part_sql('month', 'pull_requests.pr_created_at', engine)}
+        """)
+    pr_countsDF = fetch_df(pr_monthquery, engine)
+
+    pr_monthDF = fill_pr_months(pr_countsDF, repo_id, repo_name, start_date, end_date)
 
-        """
-    pr_monthDFa = pd.read_sql_query(pr_monthquery, con=engine)
+    return pr_monthDF
+
+def fill_pr_months(pr_countsDF, repo_id, repo_name, start_date, end_date, closed=False):
+    """ Turns the number of PRs counted for each month into the data returned
+    by monthly_prs_all or monthly_prs_closed
+
+    Parameters
+    ----------
+    pr_countsDF : dataframe
+        with year, month and total_prs_open_closed columns
+    repo_id : str
+    repo_name : str
+    start_date : str
+    end_date : str
+    closed : bool
+        if True, the month is formatted with two digits and a yearmonth
+        column is added, like monthly_prs_closed
+
+    Returns
+    -------
+    pr_monthDF : dataframe
+    """
+    from utils.date_calcs import get_months
+
+    pr_countsDF[['year', 'month']] = pr_countsDF[['year', 'month']].astype(int)
+
+    # Every month in the date range is reported, even those without any PRs
+    pr_monthDFa = get_months(start_date, end_date).merge(pr_countsDF, how='left', on=['year', 'month'])
+
+    pr_monthDFa['repo_id'] = repo_id
+    pr_monthDFa['repo_name'] = repo_name
 
-    pr_monthDFa[['repo_id']] = pr_monthDFa[['repo_id']].fillna(value=repo_id)
-    
-    # Hack to fill in repo_name where there are nan's
-    pr_monthDFa[['repo_name']] = pr_monthDFa[['repo_name']].fillna(value=repo_name)
-    
     pr_monthDF = pr_monthDFa
     pr_monthDF.set_index('repo_id', 'year', 'month')
 
     pr_monthDF[['total_prs_open_closed']] = pr_monthDF[['total_prs_open_closed']].fillna(0)
 
+    if closed:
+        pr_monthDF['year'] = pr_monthDF['year'].map(int)
+        pr_monthDF['month'] = pr_monthDF['month'].map(int)
+        pr_monthDF['month'] = pr_monthDF['month'].apply('{:0>2}'.format)
+        pr_monthDF['yearmonth'] = pr_monthDF['year'].map(str) + '-' + pr_monthDF['month'].map(str)
+
     return pr_monthDF
 
-def sustain_prs_by_repo_data(repo_id, repo_name, org_name, start_date, end_date, engine):
+def monthly_prs_from_rows(pull_requestsDF, repo_id, repo_name, start_date, end_date, closed=False):
+    """ Counts the PRs for every month from the pull requests fetched by
+    pull_request_data, instead of querying the database again. This gives
+    the same data as monthly_prs_all, or monthly_prs_closed when closed is
+    True.
+
+    Parameters
+    ----------
+    pull_requestsDF : dataframe
+        from pull_request_data in metrics/pull_requests.py
+    repo_id : str
+    repo_name : str
+    start_date : str
+    end_date : str
+    closed : bool
+
+    Returns
+    -------
+    pr_monthDF : dataframe
+    """
+    import pandas as pd
+
+    # Like COUNT ( pull_requests.pr_src_id ), PRs without one are not counted
+    prsDF = pull_requestsDF[pull_requestsDF['pr_src_id'].notna()]
+    if closed:
+        prsDF = prsDF[prsDF['pr_src_state'] == 'closed']
+
+    pr_countsDF = pd.DataFrame({'year': prsDF['pr_created_at'].dt.year, 'month': prsDF['pr_created_at'].dt.month})
+    pr_countsDF = pr_countsDF.groupby(['year', 'month']).size().reset_index(name='total_prs_open_closed')
+
+    pr_monthDF = fill_pr_months(pr_countsDF, repo_id, repo_name, start_date, end_date, closed)
+
+    return pr_monthDF
+
+def sustain_prs_by_repo_data(repo_id, repo_name, org_name, start_date, end_date, engine, all_prsDF=None, closed_prsDF=None):
     """ Processes data from the queries in the monthly_prs_all and monthly_prs_closed
     functions and manipulates them into a format that can be used to easily graph them.
 
@@ -196,6 +228,10 @@ def sustain_prs_by_repo_data(repo_id, repo_name, org_name, start_date, end_date,
     start_date : str
     end_date : str
     engine : sqlalchemy object
+    all_prsDF : dataframe
+        data from monthly_prs_all if it has already been gathered (optional)
+    closed_prsDF : dataframe
+        data from monthly_prs_closed if it has already been gathered (optional)
 
     Returns
     -------
@@ -208,17 +244,20 @@ def sustain_prs_by_repo_data(repo_id, repo_name, org_name, start_date, end_date,
     """
 
     import pandas as pd
+    from metrics.thresholds import MIN_PRS, GAP_SHARE, CLOSURE_SKIP_MONTHS, gap_trend, trend_text
 
-    all_prsDF = monthly_prs_all(repo_id, repo_name, start_date, end_date, engine)
+    if all_prsDF is None:
+        all_prsDF = monthly_prs_all(repo_id, repo_name, start_date, end_date, engine)
 
     # Return with no data if there are no PRs
-    if all_prsDF['total_prs_open_closed'].sum() < 24:
+    if all_prsDF['total_prs_open_closed'].sum() < MIN_PRS:
         return -1, 'TOO FEW PRs', None, None, None, None
     else:
         error_num = 0
         error_text = None
 
-    closed_prsDF = monthly_prs_closed(repo_id, repo_name, start_date, end_date, engine)
+    if closed_prsDF is None:
+        closed_prsDF = monthly_prs_closed(repo_id, repo_name, start_date, end_date, engine)
 
     pr_sustainDF = pd.DataFrame()
 
@@ -237,7 +276,7 @@ def sustain_prs_by_repo_data(repo_id, repo_name, org_name, start_date, end_date,
     month_num = 0
     m = 1
     for diff_per in pr_sustainDF['diff_per']:
-        if (diff_per > 0.15 and m > 6):
+        if (diff_per > GAP_SHARE and m > CLOSURE_SKIP_MONTHS):
             month_num+=1
         m+=1
 
@@ -248,25 +287,66 @@ def sustain_prs_by_repo_data(repo_id, repo_name, org_name, start_date, end_date,
     recent_yearmonth = pr_sustainDF['yearmonth'][9] + ' - ' + pr_sustainDF['yearmonth'][11]
     prev_yearmonth = pr_sustainDF['yearmonth'][6] + ' - ' + pr_sustainDF['yearmonth'][8]   
 
-    magnitude = abs(prev_mo_diff - recent_mo_diff) / (prev_mo_diff + recent_mo_diff)
-
-    if magnitude <= .1:
-        trend = '\nTrend: Neutral - the ' + recent_yearmonth + ' gap is similar to the ' + prev_yearmonth + ' gap.'
-    elif recent_mo_diff == prev_mo_diff:
-        trend = '\nTrend: Neutral - the ' + recent_yearmonth + ' gap is similar to the ' + prev_yearmonth + ' gap.'
-    elif recent_mo_diff < prev_mo_diff:
-        trend = '\nTrend: Positive - the ' + recent_yearmonth + ' gap is smaller than the ' + prev_yearmonth + ' gap.' 
-    elif recent_mo_diff > prev_mo_diff:
-        trend = '\nTrend: Negative - the ' + recent_yearmonth + ' gap is larger than the ' + prev_yearmonth + ' gap.'
-    else:
-        trend = ''
-    title += trend
+    title += trend_text(gap_trend(recent_mo_diff, prev_mo_diff), recent_yearmonth, prev_yearmonth)
 
     interpretation = 'Interpretation: Healthy projects will have little or no gap. A large or increasing gap requires attention.'
 
     return error_num, error_text, pr_sustainDF, title, interpretation, month_num  
 
-def sustain_prs_by_repo_graph(repo_id, repo_name, org_name, start_date, end_date, engine, years):
+def sustain_prs_by_repo_template(ax, title_size=30):
+    """ Sets up the parts of a closure ratio graph that are the same for every
+    repo on a set of axes (see utils/render.py)
+
+    Parameters
+    ----------
+    ax : matplotlib axes
+    title_size : int
+        font size of the title
+
+    Returns
+    -------
+    template : dict
+        for sustain_prs_by_repo_update
+    """
+    from utils.render import line_chart_template
+
+    return line_chart_template(ax, ['Total', 'Closed'], title_size)
+
+def sustain_prs_by_repo_update(template, data):
+    """ Puts the data returned by the sustain_prs_by_repo_data function into a
+    graph from sustain_prs_by_repo_template
+
+    Parameters
+    ----------
+    template : dict
+    data : tuple
+        results of sustain_prs_by_repo_data, without an error
+    """
+    from utils.render import line_chart_update
+
+    error_num, error_text, pr_sustainDF, title, interpretation, month_num = data
+
+    xlabel_str = 'Year Month\n\n' + interpretation
+    line_chart_update(template, pr_sustainDF['yearmonth'], [pr_sustainDF['all_total'], pr_sustainDF['closed_total']],
+        ['Total', 'Closed'], title, xlabel_str)
+
+def sustain_prs_by_repo_plot(ax, data, title_size=30):
+    """ Draws the data returned by the sustain_prs_by_repo_data function on a
+    set of axes, which can be a whole graph or one part of a dashboard (see
+    utils/dashboard.py)
+
+    Parameters
+    ----------
+    ax : matplotlib axes
+    data : tuple
+        results of sustain_prs_by_repo_data, without an error
+    title_size : int
+        font size of the title
+    """
+
+    sustain_prs_by_repo_update(sustain_prs_by_repo_template(ax, title_size), data)
+
+def sustain_prs_by_repo_graph(repo_id, repo_name, org_name, start_date, end_date, engine, years, data=None):
     """ Graph the data returned by the sustain_prs_by_repo_data function
 
     Parameters
@@ -277,52 +357,44 @@ def sustain_prs_by_repo_graph(repo_id, repo_name, org_name, start_date, end_date
     start_date : str
     end_date : str
     engine : sqlalchemy object
+    years : int
+    data : tuple
+        results of sustain_prs_by_repo_data if they have already been gathered (optional)
 
     Output
     ------
     Saves a png file in the location defined in the output_filename function.
 
     """
-    import pandas as pd
-    import seaborn as sns
-    import matplotlib
-    import matplotlib.pyplot as plt
-    import datetime
-    from matplotlib.ticker import MaxNLocator
     import warnings
-    from utils.file_operations import output_filename
+    from utils.file_operations import output_filename, chart_hash, chart_up_to_date, save_chart
+    from utils.render import metric_template
 
     warnings.simplefilter("ignore") # Ignore fixed formatter warning.
 
-    error_num, error_text, pr_sustainDF, title, interpretation, month_num = sustain_prs_by_repo_data(repo_id, repo_name, org_name, start_date, end_date, engine)
+    if data is None:
+        data = sustain_prs_by_repo_data(repo_id, repo_name, org_name, start_date, end_date, engine)
+
+    error_num, error_text, pr_sustainDF, title, interpretation, month_num = data
 
     if error_num == -1:
         print("Closure Ratio: Too few PRs to calculate")
         return "Too Few PRs"
 
-    matplotlib.use('Agg') #prevents from tying to send plot to screen
-    sns.set_style('ticks')
-    sns.set(style="whitegrid", font_scale=2)
-
-    fig, ax = plt.subplots()
-    ax.yaxis.set_major_locator(MaxNLocator(integer=True))
-
-    # the size of A4 paper
-    fig.set_size_inches(24, 8)
-
-    plottermonth = sns.lineplot(x='yearmonth', y='all_total', data=pr_sustainDF, sort=False, color='black', label='Total', linewidth=2.5)
-    plottermonth = sns.lineplot(x='yearmonth', y='closed_total', data=pr_sustainDF, sort=False, color='green', label='Closed', linewidth=2.5, linestyle='dashed').set_title(title, fontsize=30)
-
-    plottermonthlabels = ax.set_xticklabels(pr_sustainDF['yearmonth'],rotation=45)
-    plottermonthlabels = ax.set_ylabel('Number of PRs')
-    xlabel_str = 'Year Month\n\n' + interpretation
-    plottermonthlabels = ax.set_xlabel(xlabel_str)
-
     filename_str = 'change_request_closure_ratio_pr_y' + str(years) 
     filename = output_filename(repo_name, org_name, filename_str)
 
-    fig.savefig(filename, bbox_inches='tight', dpi=500)
-    plt.close(fig)
+    # Don't draw the graph again if the data and settings haven't changed
+    content_hash = chart_hash(data, metric=filename_str, size=(24, 8), font_scale=2, dpi=500)
+    if chart_up_to_date(filename, content_hash):
+        print('Change Request Closure Ratio (keeping up with contributions) for', org_name, '/', repo_name, 'is unchanged in', filename)
+        return str(month_num)
+
+    # The figure is kept and drawn again for the next repo
+    template = metric_template('change_request_closure_ratio', sustain_prs_by_repo_template)
+    sustain_prs_by_repo_update(template, data)
+
+    save_chart(template['fig'], filename, content_hash, bbox_inches='tight', dpi=500)
 
     print('Change Request Closure Ratio (keeping up with contributions) for', org_name, '/', repo_name, 'from', start_date, 'to', end_date, '\nsaved as', filename)
     print('Number of months in the past 6 months with > 15% of PRs not closed:', month_num)
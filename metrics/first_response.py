@@ -4,50 +4,93 @@
 """ Contains functions used to gather data and graph the Time to First Response metric
 """
 
-def response_time_db(repo_id, repo_name, start_date, end_date, engine):
-    """ Gather data about PR reponse times
+# The datasets this metric is computed from (see metrics/registry.py)
+DATASETS = ['pr_response', 'pr_first_review']
+
+def first_comment_db(repo_id, start_date, end_date, engine):
+    """ Gather data about the first comment, merge and close times for each PR,
+    since merge and close can be first response for trivial PRs.
 
     Parameters
     ----------
     repo_id : str
-    repo_name : str
     start_date : str
     end_date : str
     engine : sqlalchemy object
 
     Returns
     -------
-    pr_all : dataframe
+    pr_response : dataframe
     """
     import pandas as pd
     import sqlalchemy as s
+    from utils.fetch import fetch_df
+    from utils.summary_tables import summary_schema
 
-    pr_all = pd.DataFrame()
-
-    # This query gets first_comment, merged, and closed times, since
-    # merge and close can be first response for trivial PRs.
     pr_response = pd.DataFrame()
 
-    pr_query = s.sql.text(f"""
+    schema = summary_schema(engine, end_date)
+    if schema != None:
+        pr_query = s.sql.text(f"""
+                        SELECT pull_request_id, pr_created_at, pr_merged_at, pr_closed_at, first_comment_time
+                        FROM {schema}.pr_first_response
+                        WHERE repo_id = {repo_id}
+                               AND pr_created_at > {start_date}
+                               AND pr_created_at <= {end_date}
+                        """)
+    else:
+        pr_query = s.sql.text(f"""
                         SELECT pull_requests.pull_request_id, pull_requests.pr_created_at,
                                pull_requests.pr_merged_at, pull_requests.pr_closed_at,
                                MIN(message.msg_timestamp) AS first_comment_time
                         FROM repo, 
                                pull_requests left outer join pull_request_message_ref 
                                on pull_requests.pull_request_id = pull_request_message_ref.pull_request_id
-                               left outer join message on pull_request_message_ref.pr_message_ref_src_comment_id = message.platform_msg_id and cntrb_id not in (select cntrb_id from contributors where cntrb_login like '%[bot]')
+                               left outer join message on pull_request_message_ref.pr_message_ref_src_comment_id = message.platform_msg_id and message.cntrb_id not in (select cntrb_id from contributors where cntrb_login like '%[bot]')
                         WHERE repo.repo_id = {repo_id}
                                AND repo.repo_id = pull_requests.repo_id                  
                                AND pull_requests.pr_created_at > {start_date}
                                AND pull_requests.pr_created_at <= {end_date}
-                        GROUP BY pull_requests.pull_request_id
+                        GROUP BY pull_requests.pull_request_id, pull_requests.pr_created_at,
+                               pull_requests.pr_merged_at, pull_requests.pr_closed_at
                         """)
-    pr_response = pd.read_sql(pr_query, con=engine)
-    
-    # This query gets first review time
+    pr_response = fetch_df(pr_query, engine, parse_dates=['pr_created_at', 'pr_merged_at', 'pr_closed_at', 'first_comment_time'])
+
+    return pr_response
+
+def first_review_db(repo_id, start_date, end_date, engine):
+    """ Gather data about the first review time for each PR
+
+    Parameters
+    ----------
+    repo_id : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy object
+
+    Returns
+    -------
+    pr_first_review : dataframe
+    """
+    import pandas as pd
+    import sqlalchemy as s
+    from utils.fetch import fetch_df
+    from utils.summary_tables import summary_schema
+
     pr_first_review = pd.DataFrame()
 
-    pr_query = s.sql.text(f"""
+    schema = summary_schema(engine, end_date)
+    if schema != None:
+        pr_query = s.sql.text(f"""
+                     SELECT pull_request_id, first_review
+                     FROM {schema}.pr_first_response
+                     WHERE repo_id = {repo_id}
+                         AND first_review IS NOT NULL
+                         AND pr_created_at > {start_date}
+                         AND pr_created_at <= {end_date}
+                      """)
+    else:
+        pr_query = s.sql.text(f"""
                      SELECT 
                          pull_requests.pull_request_id,
                          MIN(pull_request_reviews.pr_review_submitted_at) as first_review
@@ -62,9 +105,83 @@ def response_time_db(repo_id, repo_name, start_date, end_date, engine):
                      GROUP BY
                          pull_requests.pull_request_id
                       """)
-    pr_first_review = pd.read_sql(pr_query, con=engine)
+    pr_first_review = fetch_df(pr_query, engine, parse_dates=['first_review'])
+
+    return pr_first_review
+
+def first_comments_from_rows(pull_requestsDF, pr_activityDF, botsDF, start_date, end_date):
+    """ Gets the same data as first_comment_db from the pull requests and the
+    comments fetched by pull_request_data and pr_activity_data, instead of
+    querying the database again
+
+    Parameters
+    ----------
+    pull_requestsDF : dataframe
+        from pull_request_data in metrics/pull_requests.py
+    pr_activityDF : dataframe
+        from pr_activity_data in metrics/pull_requests.py
+    botsDF : dataframe
+        from bot_contributor_data in metrics/pull_requests.py
+    start_date : str
+    end_date : str
+
+    Returns
+    -------
+    pr_response : dataframe
+    """
+    from utils.date_calcs import convert_dates
+
+    start_dt, end_dt = convert_dates(start_date, end_date)
+
+    pr_response = pull_requestsDF[(pull_requestsDF['pr_created_at'] > start_dt) & (pull_requestsDF['pr_created_at'] <= end_dt)]
+    pr_response = pr_response[['pull_request_id', 'pr_created_at', 'pr_merged_at', 'pr_closed_at']]
+
+    # Comments from bots are left out. Like NOT IN in SQL, comments without
+    # a contributor are left out too, unless there are no bots at all.
+    comments = pr_activityDF[pr_activityDF['activity'] == 'comment']
+    if len(botsDF) > 0:
+        comments = comments[comments['cntrb_id'].notna() & ~comments['cntrb_id'].isin(botsDF['cntrb_id'])]
+    first_comments = comments.groupby('pull_request_id')['first_time'].min().rename('first_comment_time').reset_index()
+
+    pr_response = pr_response.merge(first_comments, how='left', on='pull_request_id').reset_index(drop=True)
+
+    return pr_response
+
+def first_reviews_from_activity(pr_activityDF):
+    """ Gets the same data as first_review_db from the reviews fetched by
+    pr_activity_data, instead of querying the database again
+
+    Parameters
+    ----------
+    pr_activityDF : dataframe
+        from pr_activity_data in metrics/pull_requests.py
+
+    Returns
+    -------
+    pr_first_review : dataframe
+    """
+    reviews = pr_activityDF[pr_activityDF['activity'] == 'review']
+
+    pr_first_review = reviews[['pull_request_id', 'first_time']].rename(columns={'first_time': 'first_review'}).reset_index(drop=True)
+
+    return pr_first_review
+
+def combine_response_times(pr_response, pr_first_review, repo_name):
+    """ Combine the data from the first_comment_db and first_review_db functions
+    and find the first response from all 4 sources
+
+    Parameters
+    ----------
+    pr_response : dataframe
+    pr_first_review : dataframe
+    repo_name : str
+
+    Returns
+    -------
+    pr_all : dataframe
+    """
+    import pandas as pd
 
-    # combine dataframes and find the first response from all 4 sources
     pr_all = pd.merge(pr_response,pr_first_review,how='outer',on='pull_request_id')
 
     pr_all['repo_name'] = repo_name
@@ -74,7 +191,30 @@ def response_time_db(repo_id, repo_name, start_date, end_date, engine):
 
     return pr_all
 
-def response_time_data(repo_id, repo_name, org_name, start_date, end_date, engine, bus_days):
+def response_time_db(repo_id, repo_name, start_date, end_date, engine):
+    """ Gather data about PR reponse times
+
+    Parameters
+    ----------
+    repo_id : str
+    repo_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy object
+
+    Returns
+    -------
+    pr_all : dataframe
+    """
+    pr_response = first_comment_db(repo_id, start_date, end_date, engine)
+
+    pr_first_review = first_review_db(repo_id, start_date, end_date, engine)
+
+    pr_all = combine_response_times(pr_response, pr_first_review, repo_name)
+
+    return pr_all
+
+def response_time_data(repo_id, repo_name, org_name, start_date, end_date, engine, bus_days, pr_all=None):
     """ Process the data from the queries in the response_time_db function to calculate
     which ones are in / out of guidelines for the number of business days specified
 
@@ -86,6 +226,9 @@ def response_time_data(repo_id, repo_name, org_name, start_date, end_date, engin
     start_date : str
     end_date : str
     engine : sqlalchemy object
+    bus_days : int
+    pr_all : dataframe
+        data from response_time_db if it has already been gathered (optional)
 
     Returns
     -------
@@ -101,14 +244,16 @@ def response_time_data(repo_id, repo_name, org_name, start_date, end_date, engin
     import datetime
     from dateutil.relativedelta import relativedelta
     from pandas.tseries.offsets import BusinessDay
+    from metrics.thresholds import MIN_PRS, GAP_SHARE, RESPONSE_MONTHS, gap_trend, trend_text
 
-    pr_all = response_time_db(repo_id, repo_name, start_date, end_date, engine)
+    if pr_all is None:
+        pr_all = response_time_db(repo_id, repo_name, start_date, end_date, engine)
 
     bd = pd.tseries.offsets.BusinessDay(n = bus_days)
 
-    # Don't gather data if less than 24 PRs
+    # Don't gather data if less than MIN_PRS PRs
     # Or if non_null count is 0
-    if len(pr_all) < 24:
+    if len(pr_all) < MIN_PRS:
         return -1, 'TOO FEW PRs', None, None, None, None
     elif pr_all['first_response_time'].count() == 0:
         return -1, 'PR COMMENTS MISSING', None, None, None, None
@@ -159,11 +304,11 @@ def response_time_data(repo_id, repo_name, org_name, start_date, end_date, engin
         first_response = first_response.sort_values('yearmonth').reset_index(drop=True)
 
     month_num = 0
-    six_months = str(datetime.date.today() + relativedelta(months=-7)) # 7 because we don't gather current partial month data
+    six_months = str(datetime.date.today() + relativedelta(months=-(RESPONSE_MONTHS + 1))) # + 1 because we don't gather current partial month data
     for item in first_response.iterrows():
         year_month = item[1]['yearmonth']
         percent = item[1]['out_percent']
-        if (percent > 0.15 and year_month >= six_months):
+        if (percent > GAP_SHARE and year_month >= six_months):
             month_num+=1
 
     title = org_name + "/" + repo_name + "\nTime to First Response"
@@ -173,25 +318,72 @@ def response_time_data(repo_id, repo_name, org_name, start_date, end_date, engin
     recent_yearmonth = first_response['yearmonth'][9] + ' - ' + first_response['yearmonth'][11] 
     prev_yearmonth = first_response['yearmonth'][6] + ' - ' + first_response['yearmonth'][8] 
 
-    magnitude = abs(prev_mo - recent_mo) / (prev_mo + recent_mo)
-
-    if magnitude <= .1:
-        trend = '\nTrend: Neutral - the ' + recent_yearmonth + ' gap is similar to the ' + prev_yearmonth + ' gap.'
-    elif recent_mo == prev_mo:
-        trend = '\nTrend: Neutral - the ' + recent_yearmonth + ' gap is similar to the ' + prev_yearmonth + ' gap.'
-    elif recent_mo < prev_mo:
-        trend = '\nTrend: Positive - the ' + recent_yearmonth + ' gap is smaller than the ' + prev_yearmonth + ' gap.'
-    elif recent_mo > prev_mo:
-        trend = '\nTrend: Negative - the ' + recent_yearmonth + ' gap is larger than the ' + prev_yearmonth + ' gap.'
-    else:
-        trend = ''
-    title += trend
+    title += trend_text(gap_trend(recent_mo, prev_mo), recent_yearmonth, prev_yearmonth)
 
     interpretation = 'Interpretation: Healthy projects will have little or no gap. A large or increasing gap requires attention.'
     
     return error_num, error_text, first_response, title, interpretation, month_num
 
-def response_time_graph(repo_id, repo_name, org_name, start_date, end_date, engine, bus_days, years):
+def response_time_template(ax, title_size=30):
+    """ Sets up the parts of a time to first response graph that are the same
+    for every repo on a set of axes (see utils/render.py)
+
+    Parameters
+    ----------
+    ax : matplotlib axes
+    title_size : int
+        font size of the title
+
+    Returns
+    -------
+    template : dict
+        for response_time_update
+    """
+    from utils.render import line_chart_template
+
+    # The label of the second line depends on the business days, and is set
+    # for each graph
+    return line_chart_template(ax, ['Total', 'Response'], title_size)
+
+def response_time_update(template, data, bus_days):
+    """ Puts the data from the response_time_data function into a graph from
+    response_time_template
+
+    Parameters
+    ----------
+    template : dict
+    data : tuple
+        results of response_time_data, without an error
+    bus_days : int
+    """
+    from utils.render import line_chart_update
+
+    error_num, error_text, first_response, title, interpretation, month_num = data
+
+    y_guidelines_label = 'Response < ' + str(bus_days) +  ' bus days'
+
+    interpretation_str = 'Year Month\n\n' + interpretation
+    line_chart_update(template, first_response['yearmonth'], [first_response['total_prs'], first_response['in_guidelines']],
+        ['Total', y_guidelines_label], title, interpretation_str)
+
+def response_time_plot(ax, data, bus_days, title_size=30):
+    """ Draws the data from the response_time_data function on a set of axes,
+    which can be a whole graph or one part of a dashboard (see
+    utils/dashboard.py)
+
+    Parameters
+    ----------
+    ax : matplotlib axes
+    data : tuple
+        results of response_time_data, without an error
+    bus_days : int
+    title_size : int
+        font size of the title
+    """
+
+    response_time_update(response_time_template(ax, title_size), data, bus_days)
+
+def response_time_graph(repo_id, repo_name, org_name, start_date, end_date, engine, bus_days, years, data=None):
     """ Graphs the data from the response_time_data function
 
     Parameters
@@ -202,53 +394,45 @@ def response_time_graph(repo_id, repo_name, org_name, start_date, end_date, engi
     start_date : str
     end_date : str
     engine : sqlalchemy object
+    bus_days : int
+    years : int
+    data : tuple
+        results of response_time_data if they have already been gathered (optional)
 
     Output
     ------
     Saves a png file in the location defined in the output_filename function.
     """
-    import pandas as pd
-    import numpy as np
-    import seaborn as sns
-    import matplotlib
-    import matplotlib.pyplot as plt
-    from matplotlib.ticker import MaxNLocator
     import warnings
-    from utils.file_operations import output_filename
+    from utils.file_operations import output_filename, chart_hash, chart_up_to_date, save_chart
+    from utils.render import metric_template
     
     warnings.simplefilter("ignore") # Ignore fixed formatter warning.
 
-    error_num, error_text, first_response, title, interpretation, month_num = response_time_data(repo_id, repo_name, org_name, start_date, end_date, engine, bus_days)
+    if data is None:
+        data = response_time_data(repo_id, repo_name, org_name, start_date, end_date, engine, bus_days)
+
+    error_num, error_text, first_response, title, interpretation, month_num = data
 
     # Don't gather data if less than 24 PRs
     if error_num == -1:
         print("First Response: Too few PRs to calculate")
         return "Too Few PRs"
 
-    sns.set_style('ticks')
-    sns.set(style="whitegrid", font_scale=2)
-
-    fig, ax = plt.subplots()
-    ax.yaxis.set_major_locator(MaxNLocator(integer=True))
-
-    # the size of A4 paper
-    fig.set_size_inches(24, 8)
-
-    y_guidelines_label = 'Response < ' + str(bus_days) +  ' bus days'
-
-    plottermonth = sns.lineplot(x='yearmonth', y='total_prs', data=first_response, sort=False, color='black', label='Total', linewidth=2.5)
-    plottermonth = sns.lineplot(x='yearmonth', y='in_guidelines', data=first_response, sort=False, color='green', label=y_guidelines_label, linewidth=2.5, linestyle='dashed').set_title(title, fontsize=30) 
-
-    plottermonthlabels = ax.set_xticklabels(first_response['yearmonth'],rotation=45)
-    plottermonthlabels = ax.set_ylabel('Number of PRs')
-    interpretation_str = 'Year Month\n\n' + interpretation
-    plottermonthlabels = ax.set_xlabel(interpretation_str)
-
     filename_str = 'time_to_first_response_pr_y' + str(years) + '_bd_' + str(bus_days)
     filename = output_filename(repo_name, org_name, filename_str)
 
-    fig.savefig(filename, bbox_inches='tight', dpi=500)
-    plt.close(fig)
+    # Don't draw the graph again if the data and settings haven't changed
+    content_hash = chart_hash(data, metric=filename_str, size=(24, 8), font_scale=2, dpi=500)
+    if chart_up_to_date(filename, content_hash):
+        print('Time to first response for', org_name, '/', repo_name, 'is unchanged in', filename)
+        return str(month_num)
+
+    # The figure is kept and drawn again for the next repo
+    template = metric_template('time_to_first_response', response_time_template)
+    response_time_update(template, data, bus_days)
+
+    save_chart(template['fig'], filename, content_hash, bbox_inches='tight', dpi=500)
 
     print('Time to first response for', org_name, '/', repo_name, 'from', start_date, 'to', end_date, '\nsaved as', filename)
     print(month_num, 'months with more than 10% of pull requests not responded to within specified business days in the past 6 months')
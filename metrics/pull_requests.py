@@ -0,0 +1,138 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains the queries for the pull request data shared by several metrics
+(see metrics/registry.py). The Change Request Closure Ratio and the Time to
+First Response are both computed from the pull requests of a repo, so they
+are fetched once and each metric derives what it needs from them.
+"""
+
+def pull_request_data(repo_id, start_date, end_date, engine, pr_sample=1):
+    """ Gets the pull requests created from the start date through the last
+    day of the end date
+
+    Parameters
+    ----------
+    repo_id : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy object
+    pr_sample : int
+        keep 1 in every pr_sample PRs (see utils/approximate.py)
+
+    Returns
+    -------
+    pull_requestsDF : dataframe
+    """
+    import datetime
+    import pandas as pd
+    import sqlalchemy as s
+    from utils.approximate import pr_sample_sql
+    from utils.date_calcs import convert_dates
+    from utils.fetch import fetch_df
+
+    # The monthly PR counts include the whole last day
+    start_dt, end_dt = convert_dates(start_date, end_date)
+    next_day = "'" + str((end_dt + datetime.timedelta(days=1)).date()) + "'"
+
+    pull_requestsDF = pd.DataFrame()
+
+    pr_query = s.sql.text(f"""
+                    SELECT
+                        pull_request_id, pr_src_id, pr_src_state, pr_created_at, pr_merged_at, pr_closed_at
+                    FROM
+                        pull_requests
+                    WHERE
+                        repo_id = {repo_id}
+                        AND pr_created_at >= {start_date}
+                        AND pr_created_at < {next_day}{pr_sample_sql(pr_sample)}
+                    """)
+    pull_requestsDF = fetch_df(pr_query, engine, parse_dates=['pr_created_at', 'pr_merged_at', 'pr_closed_at'])
+
+    return pull_requestsDF
+
+def pr_activity_data(repo_id, start_date, end_date, engine, pr_sample=1):
+    """ Gets the first comment by each commenter and the first review on each
+    pull request, with one query
+
+    Parameters
+    ----------
+    repo_id : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy object
+    pr_sample : int
+        keep 1 in every pr_sample PRs, the same ones as pull_request_data
+
+    Returns
+    -------
+    pr_activityDF : dataframe
+        with an activity column that is 'comment' or 'review', and the
+        cntrb_id of the commenter for comments
+    """
+    import pandas as pd
+    import sqlalchemy as s
+    from utils.approximate import pr_sample_sql
+    from utils.fetch import fetch_df
+
+    pr_activityDF = pd.DataFrame()
+
+    activity_query = s.sql.text(f"""
+                    SELECT
+                        pull_requests.pull_request_id, 'comment' AS activity, message.cntrb_id,
+                        MIN(message.msg_timestamp) AS first_time
+                    FROM
+                        pull_requests, pull_request_message_ref, message
+                    WHERE
+                        pull_requests.repo_id = {repo_id}
+                        AND pull_requests.pull_request_id = pull_request_message_ref.pull_request_id
+                        AND pull_request_message_ref.pr_message_ref_src_comment_id = message.platform_msg_id
+                        AND pull_requests.pr_created_at > {start_date}
+                        AND pull_requests.pr_created_at <= {end_date}{pr_sample_sql(pr_sample)}
+                    GROUP BY
+                        pull_requests.pull_request_id, message.cntrb_id
+                    UNION ALL
+                    SELECT
+                        pull_requests.pull_request_id, 'review' AS activity, NULL AS cntrb_id,
+                        MIN(pull_request_reviews.pr_review_submitted_at) AS first_time
+                    FROM
+                        pull_requests, pull_request_reviews
+                    WHERE
+                        pull_requests.repo_id = {repo_id}
+                        AND pull_request_reviews.pull_request_id = pull_requests.pull_request_id
+                        AND pull_requests.pr_created_at > {start_date}
+                        AND pull_requests.pr_created_at <= {end_date}{pr_sample_sql(pr_sample)}
+                    GROUP BY
+                        pull_requests.pull_request_id
+                    """)
+    pr_activityDF = fetch_df(activity_query, engine, parse_dates=['first_time'])
+
+    return pr_activityDF
+
+def bot_contributor_data(engine):
+    """ Gets the contributors that are bots, whose comments are not counted as
+    a response. This is the same for every repo, so it is fetched once for
+    an org.
+
+    Parameters
+    ----------
+    engine : sqlalchemy object
+
+    Returns
+    -------
+    botsDF : dataframe
+    """
+    import sqlalchemy as s
+    from utils.fetch import fetch_df
+
+    bots_query = s.sql.text("""
+                    SELECT
+                        cntrb_id
+                    FROM
+                        contributors
+                    WHERE
+                        cntrb_login LIKE '%[bot]'
+                    """)
+    botsDF = fetch_df(bots_query, engine)
+
+    return botsDF
@@ -0,0 +1,215 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" The registry of the metrics in the model and of the datasets they are
+computed from.
+
+Each metric module declares the datasets it needs in its DATASETS list, and
+each dataset is described here: either a query, or data derived from other
+datasets. plan_datasets works out every dataset needed by the selected
+metrics, so that the planner in utils/gather.py fetches each one once for a
+repo and hands it to every metric that needs it. For example, the pull
+requests of a repo are fetched once, and both the monthly PR counts for the
+Change Request Closure Ratio and the first responses for the Time to First
+Response are derived from them. Datasets with the 'org' scope, like the bot
+accounts, are the same for every repo and are fetched once for an org.
+
+To add a metric, add a module to metrics/ with a DATASETS list, *_data,
+*_template, *_update and *_graph functions (see utils/render.py), and add it
+to METRICS. A new metric that needs pull
+requests, commits or releases reuses the datasets that are already fetched
+instead of adding another query.
+"""
+
+# Each metric: the module it is in, and the names of the values returned by
+# its *_data function
+METRICS = {
+    'release': {
+        'module': 'metrics.release_frequency',
+        'fields': ['error_num', 'error_text', 'releases', 'start_date', 'end_date', 'title', 'interpretation', 'release_num'],
+    },
+    'closure_ratio': {
+        'module': 'metrics.closure_ratio',
+        'fields': ['error_num', 'error_text', 'prs_by_month', 'title', 'interpretation', 'month_num'],
+    },
+    'bus_factor': {
+        'module': 'metrics.bus_factor',
+        'fields': ['error_num', 'error_text', 'names', 'percents', 'commits', 'title', 'interpretation', 'num_people'],
+    },
+    'first_response': {
+        'module': 'metrics.first_response',
+        'fields': ['error_num', 'error_text', 'prs_by_month', 'title', 'interpretation', 'month_num'],
+    },
+}
+
+# Each dataset:
+# * function: the function that fetches or derives it, as module.function
+# * args: the names of its arguments, which are the repo and window
+#   (repo_id, repo_name, org_name, start_date, end_date, engine), the
+#   sampling of PRs and commits (pr_sample, commit_sample, see
+#   utils/approximate.py) or the names of the datasets it is derived from
+# * metric: the metric its timings are tagged with ('shared' for datasets
+#   used by several metrics)
+# * scope: 'org' for datasets that are the same for every repo (default
+#   to 'repo')
+# * summary: what is used instead when the summary tables can be used (see
+#   utils/summary_tables.py), or None if the dataset is left out
+# * counted: True if it is left out when the commits are counted in the
+#   database instead of fetched
+DATASETS = {
+    'fork_archive': {
+        'function': 'utils.repo_info.fork_archive',
+        'args': ['repo_name', 'org_name', 'engine'],
+        'metric': 'repo_info',
+    },
+    'releases': {
+        'function': 'metrics.release_frequency.get_release_data',
+        'args': ['repo_id', 'start_date', 'end_date', 'engine'],
+        'metric': 'release',
+    },
+    'commits': {
+        'function': 'metrics.bus_factor.commit_data',
+        'args': ['repo_id', 'start_date', 'end_date', 'engine', 'commit_sample'],
+        'metric': 'bus_factor',
+        'summary': None,
+        'counted': True,
+    },
+    'pull_requests': {
+        'function': 'metrics.pull_requests.pull_request_data',
+        'args': ['repo_id', 'start_date', 'end_date', 'engine', 'pr_sample'],
+        'metric': 'shared',
+    },
+    'pr_activity': {
+        'function': 'metrics.pull_requests.pr_activity_data',
+        'args': ['repo_id', 'start_date', 'end_date', 'engine', 'pr_sample'],
+        'metric': 'first_response',
+    },
+    'bot_contributors': {
+        'function': 'metrics.pull_requests.bot_contributor_data',
+        'args': ['engine'],
+        'metric': 'first_response',
+        'scope': 'org',
+    },
+    'prs_all': {
+        'function': 'metrics.closure_ratio.monthly_prs_from_rows',
+        'args': ['pull_requests', 'repo_id', 'repo_name', 'start_date', 'end_date'],
+        'metric': 'closure_ratio',
+        'summary': {
+            'function': 'metrics.closure_ratio.monthly_prs_all',
+            'args': ['repo_id', 'repo_name', 'start_date', 'end_date', 'engine'],
+        },
+    },
+    'prs_closed': {
+        'function': 'metrics.closure_ratio.monthly_prs_from_rows',
+        'args': ['pull_requests', 'repo_id', 'repo_name', 'start_date', 'end_date', True],
+        'metric': 'closure_ratio',
+        'summary': {
+            'function': 'metrics.closure_ratio.monthly_prs_closed',
+            'args': ['repo_id', 'repo_name', 'start_date', 'end_date', 'engine'],
+        },
+    },
+    'pr_response': {
+        'function': 'metrics.first_response.first_comments_from_rows',
+        'args': ['pull_requests', 'pr_activity', 'bot_contributors', 'start_date', 'end_date'],
+        'metric': 'first_response',
+        'summary': {
+            'function': 'metrics.first_response.first_comment_db',
+            'args': ['repo_id', 'start_date', 'end_date', 'engine'],
+        },
+    },
+    'pr_first_review': {
+        'function': 'metrics.first_response.first_reviews_from_activity',
+        'args': ['pr_activity'],
+        'metric': 'first_response',
+        'summary': {
+            'function': 'metrics.first_response.first_review_db',
+            'args': ['repo_id', 'start_date', 'end_date', 'engine'],
+        },
+    },
+}
+
+def load_function(path):
+    """ Imports a function from its module.function path
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    function : function
+    """
+    import importlib
+
+    module_name, function_name = path.rsplit('.', 1)
+
+    return getattr(importlib.import_module(module_name), function_name)
+
+def metric_datasets(metrics=None):
+    """ Gets the datasets declared by each metric
+
+    Parameters
+    ----------
+    metrics : list
+        names of metrics in METRICS (default to every metric)
+
+    Returns
+    -------
+    datasets : list
+        the names of the datasets, without duplicates
+    """
+    import importlib
+
+    datasets = []
+    for metric in metrics or METRICS:
+        for name in importlib.import_module(METRICS[metric]['module']).DATASETS:
+            if name not in datasets:
+                datasets.append(name)
+
+    return datasets
+
+def plan_datasets(metrics=None, use_summary=False, aggregate_commits=False):
+    """ Works out every dataset needed by the metrics, including the datasets
+    they are derived from, in an order where each dataset comes after the
+    ones it is derived from
+
+    Parameters
+    ----------
+    metrics : list
+        names of metrics in METRICS (default to every metric)
+    use_summary : bool
+        if True, the summary tables can be used
+    aggregate_commits : bool
+        if True, the commits are counted in the database instead of fetched
+
+    Returns
+    -------
+    plan : list
+        (name, spec) tuples, where spec has the function, args, metric and
+        scope of the dataset, and requires, the datasets it is derived from
+    """
+    plan = []
+    planned = set()
+
+    def visit(name):
+        if name in planned:
+            return
+        planned.add(name)
+
+        spec = DATASETS[name]
+        if (use_summary and 'summary' in spec and spec['summary'] == None) or (aggregate_commits and spec.get('counted')):
+            return
+        if use_summary and spec.get('summary') != None:
+            spec = dict(spec, **spec['summary'])
+
+        requires = [arg for arg in spec['args'] if isinstance(arg, str) and arg in DATASETS]
+        for required in requires:
+            visit(required)
+
+        plan.append((name, {'function': spec['function'], 'args': spec['args'], 'metric': spec['metric'],
+            'scope': spec.get('scope', 'repo'), 'requires': requires}))
+
+    for name in ['fork_archive'] + metric_datasets(metrics):
+        visit(name)
+
+    return plan
@@ -4,6 +4,9 @@
 """ Contains functions used to gather data and graph the Release Frequency metric
 """
 
+# The datasets this metric is computed from (see metrics/registry.py)
+DATASETS = ['releases']
+
 def get_release_data(repo_id, start_date, end_date, engine):
     """ Get release data from the Augur database
 
@@ -19,10 +22,12 @@ def get_release_data(repo_id, start_date, end_date, engine):
     releases_df : dataframe
     """
     import pandas as pd
+    import sqlalchemy as s
+    from utils.fetch import fetch_df
 
     releases_df = pd.DataFrame()
 
-    release_query = f"""
+    release_query = s.sql.text(f"""
                     SELECT
                         release_published_at as date
                     FROM
@@ -31,12 +36,12 @@ def get_release_data(repo_id, start_date, end_date, engine):
                         repo_id = {repo_id}
                         AND release_published_at > {start_date}
                         AND release_published_at <= {end_date}
-                        """
-    releases_df = pd.read_sql_query(release_query, con=engine)
+                        """)
+    releases_df = fetch_df(release_query, engine, parse_dates=['date'])
 
     return releases_df
 
-def activity_release_data(repo_id, repo_name, org_name, start_date, end_date, engine):
+def activity_release_data(repo_id, repo_name, org_name, start_date, end_date, engine, releases_df=None):
     """ Takes release data and does some reformatting before graphing
 
     Parameters
@@ -47,6 +52,8 @@ def activity_release_data(repo_id, repo_name, org_name, start_date, end_date, en
     start_date : str
     end_date : str
     engine : sqlalchemy object
+    releases_df : dataframe
+        data from get_release_data if it has already been gathered (optional)
 
     Returns
     -------
@@ -62,16 +69,18 @@ def activity_release_data(repo_id, repo_name, org_name, start_date, end_date, en
 
     import datetime
     from utils.date_calcs import convert_dates
+    from metrics.thresholds import RELEASE_DAYS
 
     try:
-        releases_df = get_release_data(repo_id, start_date, end_date, engine)
+        if releases_df is None:
+            releases_df = get_release_data(repo_id, start_date, end_date, engine)
         error_num = 0
         error_text = None
     except:
         return -1, 'NO DATA', None, None, None, None, None, None
 
     start_dt, end_dt = convert_dates(start_date, end_date)
-    six_mos_dt = end_dt - datetime.timedelta(days=180)
+    six_mos_dt = end_dt - datetime.timedelta(days=RELEASE_DAYS)
 
     release_num = 0
     for release in releases_df['date']:
@@ -88,7 +97,75 @@ def activity_release_data(repo_id, repo_name, org_name, start_date, end_date, en
 
     return error_num, error_text, releases_df, start_dt, end_dt, title, interpretation, release_num
 
-def activity_release_graph(repo_id, repo_name, org_name, start_date, end_date, engine, years):
+def activity_release_template(ax, title_size=30):
+    """ Sets up the parts of a release graph that are the same for every repo
+    on a set of axes (see utils/render.py)
+
+    Parameters
+    ----------
+    ax : matplotlib axes
+    title_size : int
+        font size of the title
+
+    Returns
+    -------
+    template : dict
+        for activity_release_update
+    """
+    import matplotlib.ticker as ticker
+
+    ax.set_ylim(0,2)
+    ax.yaxis.set_major_locator(ticker.MultipleLocator(1))
+    ax.set(yticklabels=[])
+
+    return {'ax': ax, 'line': None, 'title_size': title_size}
+
+def activity_release_update(template, data):
+    """ Puts the release data returned from the activity_release_data
+    function into a graph from activity_release_template
+
+    Parameters
+    ----------
+    template : dict
+    data : tuple
+        results of activity_release_data, without an error
+    """
+    import numpy as np
+
+    error_num, error_text, releases_df, start_dt, end_dt, title, interpretation, release_num = data
+
+    ax = template['ax']
+
+    # The limits are set first, so that the axis converts the dates
+    ax.set_xlim(start_dt, end_dt)
+
+    dates = releases_df['date'].sort_values()
+    if template['line'] is None:
+        template['line'], = ax.plot(dates, np.ones(len(dates)), marker="X", linewidth=0, markersize=20, markeredgewidth=.75, markeredgecolor='w')
+    else:
+        template['line'].set_data(dates, np.ones(len(dates)))
+
+    ax.set_title(title, fontsize=template['title_size'])
+    xlabel_str = 'Year Month\n\n' + interpretation
+    ax.set_xlabel(xlabel_str)
+
+def activity_release_plot(ax, data, title_size=30):
+    """ Draws the release data returned from the activity_release_data function
+    on a set of axes, which can be a whole graph or one part of a dashboard
+    (see utils/dashboard.py)
+
+    Parameters
+    ----------
+    ax : matplotlib axes
+    data : tuple
+        results of activity_release_data, without an error
+    title_size : int
+        font size of the title
+    """
+
+    activity_release_update(activity_release_template(ax, title_size), data)
+
+def activity_release_graph(repo_id, repo_name, org_name, start_date, end_date, engine, years, data=None):
     """ Graphs the release data returned from the activity_release_data function
 
     Parameters
@@ -99,45 +176,40 @@ def activity_release_graph(repo_id, repo_name, org_name, start_date, end_date, e
     start_date : str
     end_date : str
     engine : sqlalchemy object
+    years : int
+    data : tuple
+        results of activity_release_data if they have already been gathered (optional)
 
     Output
     ------
     Saves a png file in the location defined in the output_filename function.
 
     """
-    import seaborn as sns
-    import matplotlib
-    import matplotlib.pyplot as plt
-    import matplotlib.ticker as ticker
-    from utils.file_operations import output_filename
+    from utils.file_operations import output_filename, chart_hash, chart_up_to_date, save_chart
+    from utils.render import metric_template
+
+    if data is None:
+        data = activity_release_data(repo_id, repo_name, org_name, start_date, end_date, engine)
 
-    error_num, error_text, releases_df, start_dt, end_dt, title, interpretation, release_num = activity_release_data(repo_id, repo_name, org_name, start_date, end_date, engine)
+    error_num, error_text, releases_df, start_dt, end_dt, title, interpretation, release_num = data
 
     if error_num == -1:
         return "0"
 
-    matplotlib.use('Agg') #prevents from tying to send plot to screen
-    sns.set(style="whitegrid", font_scale=2)
-
-    fig, ax = plt.subplots()
-
-    # the size of A4 paper
-    fig.set_size_inches(24, 8)
-
-    ax.set_xlim(start_dt, end_dt)
-    ax.set_ylim(0,2)
-    ax.yaxis.set_major_locator(ticker.MultipleLocator(1))
-    ax.set(yticklabels=[])
-
-    plottermonth = sns.lineplot(y=1, x='date', data=releases_df, marker="X", linewidth=0, markersize=20).set_title(title, fontsize=30)
-    xlabel_str = 'Year Month\n\n' + interpretation
-    plottermonthlabels = ax.set_xlabel(xlabel_str)
-
     filename_str = 'release_frequency_y' + str(years)
     filename = output_filename(repo_name, org_name, filename_str)
 
-    fig.savefig(filename, bbox_inches='tight', dpi=500)
-    plt.close(fig)
+    # Don't draw the graph again if the data and settings haven't changed
+    content_hash = chart_hash(data, metric=filename_str, size=(24, 8), font_scale=2, dpi=500)
+    if chart_up_to_date(filename, content_hash):
+        print('Release Frequency for', org_name, '/', repo_name, 'is unchanged in', filename)
+        return str(release_num)
+
+    # The figure is kept and drawn again for the next repo
+    template = metric_template('release_frequency', activity_release_template)
+    activity_release_update(template, data)
+
+    save_chart(template['fig'], filename, content_hash, bbox_inches='tight', dpi=500)
 
     print('Release Frequency for', org_name, '/', repo_name, 'from', start_date, 'to', end_date, '\nsaved as', filename)
     print(release_num, 'releases in the past 6 months')
@@ -0,0 +1,110 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains the thresholds of the metrics and the functions that classify a
+repo with them. These are shared by the *_data functions of the metrics and
+by the backfill (see utils/backfill.py), which computes the same metrics as
+of each month-end, so that changing a threshold here changes both.
+"""
+
+# The fewest PRs in the window for the Change Request Closure Ratio and the
+# Time to First Response
+MIN_PRS = 24
+
+# Releases are counted over this many days before the end of the window
+RELEASE_DAYS = 180
+
+# A month needs attention when more than this share of its PRs were not
+# closed, or did not get a response within the business days
+GAP_SHARE = 0.15
+
+# The months at the start of the window that are not counted for the
+# Change Request Closure Ratio
+CLOSURE_SKIP_MONTHS = 6
+
+# The last months of the window that are counted for the Time to First
+# Response
+RESPONSE_MONTHS = 6
+
+# A gap that changed by this share or less has a neutral trend
+NEUTRAL_MAGNITUDE = .1
+
+# The bus factor is the fewest authors with more than this share of the
+# commits, counting up to BUS_FACTOR_PEOPLE authors
+BUS_FACTOR_SHARE = .70
+BUS_FACTOR_PEOPLE = 8
+
+def gap_trend(recent, prev):
+    """ Gets the trend of the gap for the Change Request Closure Ratio or the
+    Time to First Response
+
+    Parameters
+    ----------
+    recent : float
+        the gap for the last 3 months
+    prev : float
+        the gap for the 3 months before those
+
+    Returns
+    -------
+    trend : str
+        'Positive', 'Negative' or 'Neutral'
+    """
+    magnitude = abs(prev - recent) / (prev + recent) if prev + recent != 0 else float('nan')
+
+    if magnitude <= NEUTRAL_MAGNITUDE or recent == prev:
+        return 'Neutral'
+    elif recent < prev:
+        return 'Positive'
+    elif recent > prev:
+        return 'Negative'
+    return ''
+
+def trend_text(trend, recent_yearmonth, prev_yearmonth):
+    """ Describes the trend of a gap for the title of a graph
+
+    Parameters
+    ----------
+    trend : str
+        from gap_trend
+    recent_yearmonth : str
+        like '2024-01 - 2024-03'
+    prev_yearmonth : str
+
+    Returns
+    -------
+    text : str
+    """
+
+    if trend == 'Neutral':
+        return '\nTrend: Neutral - the ' + recent_yearmonth + ' gap is similar to the ' + prev_yearmonth + ' gap.'
+    elif trend == 'Positive':
+        return '\nTrend: Positive - the ' + recent_yearmonth + ' gap is smaller than the ' + prev_yearmonth + ' gap.'
+    elif trend == 'Negative':
+        return '\nTrend: Negative - the ' + recent_yearmonth + ' gap is larger than the ' + prev_yearmonth + ' gap.'
+    return ''
+
+def bus_factor_people(percents):
+    """ Gets the bus factor from the share of commits of each author
+
+    Parameters
+    ----------
+    percents : list
+        the share of commits of each author, largest first
+
+    Returns
+    -------
+    num_people : int
+        0 if there are fewer than BUS_FACTOR_PEOPLE authors and they don't
+        have more than BUS_FACTOR_SHARE of the commits
+    """
+
+    cum_percent = 0
+    for i, percent in enumerate(percents[:BUS_FACTOR_PEOPLE]):
+        cum_percent += percent
+        if cum_percent > BUS_FACTOR_SHARE:
+            return i + 1
+
+    if len(percents) >= BUS_FACTOR_PEOPLE:
+        return BUS_FACTOR_PEOPLE
+    return 0
@@ -0,0 +1,96 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Serves the Starter Project Health Metrics Model data for single repos
+This script runs a small HTTP server that keeps the libraries imported and
+the connections to the Augur database open, so that tools like a web portal
+can ask for the metrics of one repo many times a day without starting a
+new run of health_by_repo.py each time.
+
+The data for each repo, window and number of business days is kept in
+memory for --ttl seconds, so repeated requests are answered without
+querying the database (see utils/service.py).
+
+Endpoints (METRIC is release, closure_ratio, bus_factor or first_response):
+
+GET /health
+    {"status": "ok", "cached": number of cached entries}
+GET /repos?org=ORG
+    the repo_id and repo_name of every repo in the org
+GET /metrics?org=ORG&repo=REPO&years=1&bus_days=2
+    the data for every metric (years and bus_days are optional)
+GET /metrics/METRIC?org=ORG&repo=REPO&years=1&bus_days=2
+    the data for one metric: the values returned by activity_release_data,
+    sustain_prs_by_repo_data, contributor_risk_data or response_time_data
+GET /charts/METRIC?org=ORG&repo=REPO&years=1&bus_days=2
+    the graph for one metric as a png
+
+Requirements
+------------
+
+The same config.json file used by health_by_repo.py
+
+Usage
+-----
+
+usage: metrics_service.py [-h] -c AUGUR_CONFIG [--host HOST] [-p PORT] [--socket SOCKET_PATH] [--ttl TTL] [--cache-size CACHE_SIZE]
+
+  -h, --help            show this help message and exit
+  -c AUGUR_CONFIG, --configfile AUGUR_CONFIG
+                        The full file path to an Augur config.json file (required)
+  --host HOST           The address to listen on (default to 127.0.0.1)
+  -p PORT, --port PORT  The port to listen on (default to 8000)
+  --socket SOCKET_PATH  Listen on this Unix socket instead of a TCP port
+  --ttl TTL             Seconds to keep the data for a repo in memory (default to 3600)
+  --cache-size CACHE_SIZE
+                        The most repos and windows to keep in memory (default to 256)
+
+Output
+------
+
+* JSON responses, or png images for the charts endpoints
+* Graphs are also stored as png files in the output folder, like the ones
+  created by health_by_repo.py
+* One line is printed for each request
+
+"""
+import argparse
+import matplotlib
+from utils.augur_connect import augur_db_connect
+from utils.service import make_handler, make_server
+
+# Gather options from command line arguments and store them in variables
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-c", "--configfile", required=True, dest = "augur_config", help="The full file path to an Augur config.json file (required)")
+parser.add_argument("--host", required=False, dest = "host", default='127.0.0.1', help="The address to listen on (default to 127.0.0.1)")
+parser.add_argument("-p", "--port", required=False, dest = "port", type=int, default=8000, help="The port to listen on (default to 8000)")
+parser.add_argument("--socket", required=False, dest = "socket_path", default=None, help="Listen on this Unix socket instead of a TCP port")
+parser.add_argument("--ttl", required=False, dest = "ttl", type=float, default=3600, help="Seconds to keep the data for a repo in memory (default to 3600)")
+parser.add_argument("--cache-size", required=False, dest = "cache_size", type=int, default=256, help="The most repos and windows to keep in memory (default to 256)")
+
+args = parser.parse_args()
+
+# Import everything used to answer requests up front, so that the first
+# request doesn't pay for it
+matplotlib.use('Agg') #prevents from tying to send plot to screen
+import seaborn
+import utils.gather
+import metrics.release_frequency, metrics.closure_ratio, metrics.bus_factor, metrics.first_response
+
+# Create the connection to the Augur database, which is kept open
+engine = augur_db_connect(args.augur_config)
+
+server = make_server(make_handler(engine, args.ttl, args.cache_size), args.host, args.port, args.socket_path)
+
+if args.socket_path == None:
+    print('Serving the metrics on http://' + args.host + ':' + str(args.port))
+else:
+    print('Serving the metrics on the Unix socket', args.socket_path)
+
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    print('Stopping')
+finally:
+    server.server_close()
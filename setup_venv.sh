@@ -5,3 +5,5 @@ python3 -m venv .venv
 
 echo "To activate virtual env: \"source .venv/bin/activate\""
 echo "To install dependencies: \"pip install -r requirements.txt\""
+echo "pyarrow, duckdb and duckdb-engine in requirements.txt are only needed for Parquet summaries,"
+echo "the snapshot and the duckdb backends and the Arrow fast path, and can be left out otherwise"
@@ -0,0 +1,107 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Installs and refreshes optional summary tables in the Augur database
+This script creates small pre-computed tables in a separate schema
+(health_summary) of the Augur PostgreSQL database with the monthly PR
+counts, the first response times for each PR and the commits by each author
+each day (see utils/summary_tables.py).
+
+Once installed, health_by_repo.py reads from the summary tables instead of
+joining the raw Augur tables, as long as they were refreshed after the end
+date of the run (the last day of the previous month). Refresh them on a
+schedule, for example once a day or at the start of each month.
+
+A refresh only replaces the rows that can be changed by data newer than the
+last refresh, minus a few weeks of overlap to pick up data that was
+collected late. Use --full from time to time, and after adding repos to
+Augur, to rebuild the tables from all of the data.
+
+Requirements
+------------
+
+The same config.json file used by health_by_repo.py, for a user that can
+create a schema and tables in the Augur database.
+
+Usage
+-----
+
+usage: summary_tables.py [-h] -c AUGUR_CONFIG [--full] [--since SINCE] [--overlap OVERLAP_DAYS] {install,refresh,drop,status}
+
+  {install,refresh,drop,status}
+                        install: create and fill the summary tables
+                        refresh: update the summary tables
+                        drop: remove the summary tables
+                        status: print when the summary tables were last refreshed
+  -h, --help            show this help message and exit
+  -c AUGUR_CONFIG, --configfile AUGUR_CONFIG
+                        The full file path to an Augur config.json file (required)
+  --full                Rebuild the summary tables from all of the data when refreshing
+  --since SINCE         Replace the rows that can be changed by data since this date (YYYY-MM-DD)
+                        when refreshing (default to the last refresh minus the overlap)
+  --overlap OVERLAP_DAYS
+                        The number of days before the last refresh to start from (default to 31)
+"""
+import argparse
+import datetime
+import sys
+from utils.augur_connect import augur_db_connect
+from utils.sql_dialect import dialect_name
+from utils.summary_tables import SUMMARY_SCHEMA, install_summary_tables, refresh_summary_tables, drop_summary_tables, last_refresh
+
+# Gather options from command line arguments and store them in variables
+parser = argparse.ArgumentParser()
+
+parser.add_argument("action", choices=['install', 'refresh', 'drop', 'status'], help="install: create and fill the summary tables, refresh: update the summary tables, drop: remove the summary tables, status: print when the summary tables were last refreshed")
+parser.add_argument("-c", "--configfile", required=True, dest = "augur_config", help="The full file path to an Augur config.json file (required)")
+parser.add_argument("--full", required=False, dest = "full", action='store_true', help="Rebuild the summary tables from all of the data when refreshing")
+parser.add_argument("--since", required=False, dest = "since", default=None, help="Replace the rows that can be changed by data since this date (YYYY-MM-DD) when refreshing (default to the last refresh minus the overlap)")
+parser.add_argument("--overlap", required=False, dest = "overlap_days", type=int, default=31, help="The number of days before the last refresh to start from (default to 31)")
+
+args = parser.parse_args()
+action = args.action
+augur_config = args.augur_config
+full = args.full
+overlap_days = args.overlap_days
+
+since = None
+if args.since != None:
+    try:
+        since = datetime.datetime.strptime(args.since, '%Y-%m-%d')
+    except ValueError:
+        print('The since date must be formatted like YYYY-MM-DD. Exiting')
+        sys.exit(1)
+
+# Create the connection to the Augur database
+engine = augur_db_connect(augur_config)
+
+if dialect_name(engine) != 'postgresql':
+    print('Summary tables can only be created in a PostgreSQL database. Exiting')
+    sys.exit(1)
+
+if action == 'install':
+    print('Creating and filling the summary tables in the', SUMMARY_SCHEMA, 'schema')
+    install_summary_tables(engine)
+    print('Summary tables installed')
+
+elif action == 'refresh':
+    if last_refresh(engine) == None:
+        print('The summary tables are not installed. Run this script with install first. Exiting')
+        sys.exit(1)
+
+    since = refresh_summary_tables(engine, full=full, since=since, overlap_days=overlap_days)
+    if since == None:
+        print('Summary tables rebuilt from all of the data')
+    else:
+        print('Summary tables refreshed with the data since', since)
+
+elif action == 'drop':
+    drop_summary_tables(engine)
+    print('Summary tables removed')
+
+elif action == 'status':
+    refreshed_at = last_refresh(engine)
+    if refreshed_at == None:
+        print('The summary tables are not installed')
+    else:
+        print('The summary tables in the', SUMMARY_SCHEMA, 'schema were last refreshed at', refreshed_at)
@@ -0,0 +1,272 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains the functions for the approximate option of health_by_repo.py,
+which samples the pull requests and commits of very large repos to get a
+quick estimate of the metrics for a whole Augur instance.
+
+A repo with more rows than the threshold keeps 1 in every k of its PRs and
+commits, with k chosen so that about threshold rows are left. The sample is
+deterministic, so the same repo gives the same estimate every run, and it
+is taken in the database with portable SQL:
+
+* PRs are kept when pull_request_id is a multiple of k, along with their
+  comments and reviews, so the first response of each PR is still exact
+* commits are kept by the last 4 hex digits of the commit hash, which is
+  a hash already, so every row of a commit is kept or left out together
+
+The metrics in the summary CSVs are counts of months over a threshold, or
+the number of people making up 70% of the commits, which only depend on
+the proportions in each month or for each author. The proportions from the
+sample are estimates of the real ones, so each value is also given as a
+95% confidence interval from Wilson score intervals on the proportions,
+with the finite population correction for sampling 1 in k. The counts in
+the graphs are scaled back up by k.
+"""
+
+# The 95% quantile of the normal distribution used for the intervals
+Z = 1.96
+
+def sample_rates(num_commits, num_prs, threshold):
+    """ Works out how much of the commits and PRs to keep
+
+    Parameters
+    ----------
+    num_commits : int
+    num_prs : int
+    threshold : int
+        the most rows to fetch of each without sampling
+
+    Returns
+    -------
+    sample : dict
+        'prs' and 'commits' -> k, where 1 in every k rows is kept (1 for
+        all of them)
+    """
+    import math
+
+    return {'prs': max(1, math.ceil(num_prs / threshold)), 'commits': max(1, math.ceil(num_commits / threshold))}
+
+def sample_plan(repo_id, start_date, end_date, engine, threshold):
+    """ Counts the rows for a repo to decide how much of them to sample
+
+    Parameters
+    ----------
+    repo_id : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    threshold : int
+
+    Returns
+    -------
+    sample : dict
+        from sample_rates
+    """
+    from utils.memory import repo_row_counts
+
+    num_commits, num_prs = repo_row_counts(repo_id, start_date, end_date, engine)
+
+    return sample_rates(num_commits, num_prs, threshold)
+
+def pr_sample_sql(rate):
+    """ Builds the condition that keeps 1 in every rate PRs
+
+    Parameters
+    ----------
+    rate : int
+
+    Returns
+    -------
+    sql : str
+        to add to a WHERE clause on the pull_requests table, or an empty
+        string to keep every PR
+    """
+    if rate <= 1:
+        return ''
+
+    return f"""
+                        AND pull_requests.pull_request_id % {rate} = 0"""
+
+def commit_sample_sql(rate):
+    """ Builds the condition that keeps about 1 in every rate commits, by the
+    last 4 hex digits of their hashes
+
+    Parameters
+    ----------
+    rate : int
+
+    Returns
+    -------
+    sql : str
+        to add to a WHERE clause on the commits table, or an empty string
+        to keep every commit
+    """
+    if rate <= 1:
+        return ''
+
+    limit = '{:04x}'.format(65536 // rate)
+
+    return f"""
+                        AND LOWER(SUBSTR(commits.cmt_commit_hash, LENGTH(commits.cmt_commit_hash) - 3, 4)) < '{limit}'"""
+
+def wilson_interval(successes, n, rate):
+    """ Gets the 95% confidence interval of a proportion from a sample
+
+    Parameters
+    ----------
+    successes : float
+    n : float
+        size of the sample
+    rate : int
+        1 in every rate rows were sampled
+
+    Returns
+    -------
+    low : float
+    high : float
+    """
+    import math
+
+    p = successes / n
+    if rate <= 1:
+        return p, p
+
+    # The finite population correction: sampling 1 in rate rows without
+    # replacement narrows the interval like a larger sample would
+    n = n / (1 - 1 / rate)
+
+    center = (p + Z * Z / (2 * n)) / (1 + Z * Z / n)
+    half = Z * math.sqrt(p * (1 - p) / n + Z * Z / (4 * n * n)) / (1 + Z * Z / n)
+
+    return max(0, center - half), min(1, center + half)
+
+def month_count_interval(totals, misses, rate, limit):
+    """ Gets the interval of the number of months with more than limit of the
+    PRs missed (not closed, or not responded to in time)
+
+    Parameters
+    ----------
+    totals : list
+        number of sampled PRs in each month counted by the metric
+    misses : list
+        number of those PRs that were missed
+    rate : int
+    limit : float
+
+    Returns
+    -------
+    interval : str
+        like '1-3'
+    """
+    low = 0
+    high = 0
+    for total, missed in zip(totals, misses):
+        if total > 0:
+            p_low, p_high = wilson_interval(missed, total, rate)
+            low += p_low > limit
+            high += p_high > limit
+
+    return str(low) + '-' + str(high)
+
+def bus_factor_interval(percents, commits, rate):
+    """ Gets the interval of the number of people making up more than 70% of
+    the commits, counted the same way as contributor_risk_data
+
+    Parameters
+    ----------
+    percents : list
+        share of the commits of each of the top authors
+    commits : list
+        sampled commits of each of the top authors
+    rate : int
+
+    Returns
+    -------
+    interval : str
+        like '2-4'
+    """
+    total = round(commits[0] / percents[0])
+
+    low = None
+    high = None
+    cum_commits = 0
+    for i, author_commits in enumerate(commits[:8]):
+        cum_commits += author_commits
+        p_low, p_high = wilson_interval(cum_commits, total, rate)
+        if low == None and p_high > .70:
+            low = i + 1
+        if high == None and p_low > .70:
+            high = i + 1
+
+    return str(low or 8) + '-' + str(high or 8)
+
+def approximate_metric_data(repo_data, sample, bus_days_list):
+    """ Gets the confidence intervals for the metrics computed from samples,
+    then scales the counts in the data for the graphs back up
+
+    Parameters
+    ----------
+    repo_data : dict
+        from repo_metric_data in utils/gather.py, which is changed to
+        scale the counts
+    sample : dict
+        from sample_plan, for the datasets that were sampled
+    bus_days_list : list
+
+    Returns
+    -------
+    intervals : dict
+        bus_days -> {'approximate', 'first_resp_mos_ci', 'closure_ratio_mos_ci',
+        'bus_factor_ci'}, with the names of the approximate values in the
+        summary CSVs and their intervals as strings, which are empty for
+        exact values
+    """
+    import datetime
+    from dateutil.relativedelta import relativedelta
+
+    pr_rate = sample.get('prs', 1)
+    commit_rate = sample.get('commits', 1)
+
+    approximate = []
+    closure_ratio_ci = ''
+    bus_factor_ci = ''
+
+    closure_ratio = repo_data.get('closure_ratio')
+    if pr_rate > 1 and closure_ratio != None and closure_ratio[0] != -1:
+        pr_sustainDF = closure_ratio[2]
+        # The same months as sustain_prs_by_repo_data: the last 6
+        closure_ratio_ci = month_count_interval(list(pr_sustainDF['all_total'][6:]), list(pr_sustainDF['diff'][6:]), pr_rate, 0.15)
+        approximate.append('closure_ratio_mos')
+        for column in ['closed_total', 'all_total', 'diff']:
+            pr_sustainDF[column] = pr_sustainDF[column] * pr_rate
+
+    bus_factor = repo_data.get('bus_factor')
+    if commit_rate > 1 and bus_factor != None and bus_factor[0] != -1:
+        error_num, error_text, names, percents, commits, title, interpretation, num_people = bus_factor
+        bus_factor_ci = bus_factor_interval(percents, commits, commit_rate)
+        approximate.append('bus_factor')
+        repo_data['bus_factor'] = (error_num, error_text, names, percents, [x * commit_rate for x in commits], title, interpretation, num_people)
+
+    # The same months as response_time_data
+    six_months = str(datetime.date.today() + relativedelta(months=-7))
+
+    intervals = {}
+    for bus_days in bus_days_list:
+        first_resp_ci = ''
+        first_response = repo_data.get('first_response', {}).get(bus_days)
+        if pr_rate > 1 and first_response != None and first_response[0] != -1:
+            first_responseDF = first_response[2]
+            recent = first_responseDF[first_responseDF['yearmonth'] >= six_months]
+            first_resp_ci = month_count_interval(list(recent['total_prs']), list(recent['out_guidelines']), pr_rate, 0.15)
+            for column in ['in_guidelines', 'total_prs', 'out_guidelines']:
+                first_responseDF[column] = first_responseDF[column] * pr_rate
+
+        intervals[bus_days] = {
+            'approximate': ';'.join((['first_resp_mos'] if first_resp_ci else []) + approximate),
+            'first_resp_mos_ci': first_resp_ci,
+            'closure_ratio_mos_ci': closure_ratio_ci,
+            'bus_factor_ci': bus_factor_ci,
+        }
+
+    return intervals
@@ -0,0 +1,227 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains functions that gather the data for the metrics with asyncio, so
+that every independent query for a repo is issued at the same time and
+several repos are gathered at once instead of running every query one after
+another. The queries run on a thread pool, since the database drivers are
+not async.
+
+Only the data gathering is concurrent. The graphs are still drawn one at a
+time in the main thread, because matplotlib is not thread safe.
+"""
+
+# Threads used to run the queries. SQLAlchemy's default connection pool
+# allows 15 connections per engine, so this stays below that.
+MAX_WORKERS = 10
+
+async def gather_repo_queries(repo_id, repo_name, org_name, start_date, end_date, engine, executor, memory_budget=None, metrics=None, org_results=None, approximate=None):
+    """ Runs all of the queries for a repo concurrently, then derives the other
+    datasets from them. With a memory budget, the rows are counted first to
+    decide how to gather them (see utils/memory.py).
+
+    Parameters
+    ----------
+    repo_id : str
+    repo_name : str
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    executor : concurrent.futures.ThreadPoolExecutor
+    memory_budget : float
+        memory budget for each repo in MB (optional)
+    metrics : list
+        names of the metrics to compute (default to every metric)
+    org_results : dict
+        from run_org_queries in utils/gather.py
+    approximate : int
+        sample the PRs and commits of repos with more rows than this
+        (optional, see utils/approximate.py)
+
+    Returns
+    -------
+    query_results : dict
+        dataset name -> result (see utils/gather.py)
+    """
+    import asyncio
+    from utils.gather import repo_queries, query_tags, derive_datasets, sampled_rates
+    from utils.timing import run_tagged
+    from utils.memory import memory_plan
+    from utils.approximate import sample_plan
+
+    loop = asyncio.get_running_loop()
+
+    plan_results = {}
+    plan = 'full'
+    if memory_budget != None:
+        plan_results['memory_plan'] = await loop.run_in_executor(executor, run_tagged, query_tags('memory_plan', repo_name, org_name),
+            memory_plan, repo_id, start_date, end_date, engine, memory_budget)
+        plan, estimate = plan_results['memory_plan']
+
+    sample = None
+    if approximate != None and plan != 'skip':
+        sample = await loop.run_in_executor(executor, run_tagged, query_tags('sample', repo_name, org_name),
+            sample_plan, repo_id, start_date, end_date, engine, approximate)
+
+    queries = repo_queries(repo_id, repo_name, org_name, start_date, end_date, engine, aggregate_commits=(plan == 'aggregate'), metrics=metrics, sample=sample)
+    if sample != None:
+        plan_results['sample'] = sampled_rates(sample, queries)
+    if plan == 'skip':
+        queries = {'fork_archive': queries['fork_archive']}
+
+    results = await asyncio.gather(*[loop.run_in_executor(executor, run_tagged, query_tags(name, repo_name, org_name), function, *args)
+        for name, (function, args) in queries.items()])
+    query_results = dict(zip(queries.keys(), results))
+    query_results.update(plan_results)
+
+    if plan != 'skip':
+        query_results = await loop.run_in_executor(executor, derive_datasets, query_results, org_results or {}, repo_id, repo_name, org_name,
+            start_date, end_date, engine, metrics)
+
+    return query_results
+
+async def wait_repo_queries(task):
+    """ Waits for the queries of a repo to finish, catching any error so
+    that one repo doesn't stop the others
+
+    Parameters
+    ----------
+    task : asyncio task
+        running gather_repo_queries
+
+    Returns
+    -------
+    query_results : dict
+        query name -> result, or 'error' -> the exception if a query failed
+    """
+    try:
+        return await task
+    except Exception as e:
+        return {'error': e}
+
+async def gather_org_queries(repos, org_name, start_date, end_date, engine, in_flight, results, memory_budget=None, ordered=True, metrics=None, org_results=None, approximate=None):
+    """ Runs the queries for a list of repos, with up to in_flight repos being
+    gathered at once, and puts (repo_id, repo_name, query_results) on the
+    results queue in the same order as the list of repos, or as soon as each
+    repo is ready when ordered is False
+
+    Parameters
+    ----------
+    repos : list
+        (repo_id, repo_name) tuples
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    in_flight : int
+    results : queue.Queue
+    memory_budget : float
+        memory budget for each repo in MB (optional)
+    ordered : bool
+        if False, a repo that is ready is not held back by a slower repo
+        ahead of it in the list, so its slot is given to the next repo
+    metrics : list
+        names of the metrics to compute (default to every metric)
+    org_results : dict
+        from run_org_queries in utils/gather.py
+    approximate : int
+        sample the PRs and commits of repos with more rows than this
+        (optional)
+    """
+    import asyncio
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    loop = asyncio.get_running_loop()
+    pending = deque()
+
+    async def next_ready():
+        # The first repo in the list, or the first one to finish
+        if ordered:
+            return pending.popleft()
+        await asyncio.wait([task for repo_id, repo_name, task in pending], return_when=asyncio.FIRST_COMPLETED)
+        for item in pending:
+            if item[2].done():
+                pending.remove(item)
+                return item
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        try:
+            for repo_id, repo_name in repos:
+                task = asyncio.ensure_future(gather_repo_queries(repo_id, repo_name, org_name, start_date, end_date, engine, executor, memory_budget, metrics, org_results, approximate))
+                pending.append((repo_id, repo_name, task))
+
+                if len(pending) >= in_flight:
+                    repo_id, repo_name, task = await next_ready()
+                    query_results = await wait_repo_queries(task)
+                    # Waits (without blocking the other repos) while the
+                    # results queue is full, so finished repos don't pile up
+                    # in memory when graphing is slower than gathering
+                    await loop.run_in_executor(None, results.put, (repo_id, repo_name, query_results))
+
+            while pending:
+                repo_id, repo_name, task = await next_ready()
+                query_results = await wait_repo_queries(task)
+                await loop.run_in_executor(None, results.put, (repo_id, repo_name, query_results))
+        finally:
+            for repo_id, repo_name, task in pending:
+                task.cancel()
+
+def iter_org_queries(repos, org_name, start_date, end_date, engine, in_flight, memory_budget=None, ordered=True, metrics=None, org_results=None, approximate=None):
+    """ Runs the queries for a list of repos in a background thread and yields
+    the results one repo at a time, in the same order as the list of repos
+    (or as each one is ready, when ordered is False), so the graphs can be
+    drawn in the main thread while the next repos are gathered.
+
+    Parameters
+    ----------
+    repos : list
+        (repo_id, repo_name) tuples
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    in_flight : int
+        the maximum number of repos being gathered at once
+    memory_budget : float
+        memory budget for each repo in MB (optional)
+    ordered : bool
+        whether to yield the repos in the same order as the list
+    metrics : list
+        names of the metrics to compute (default to every metric)
+    org_results : dict
+        from run_org_queries in utils/gather.py
+    approximate : int
+        sample the PRs and commits of repos with more rows than this
+        (optional)
+
+    Yields
+    ------
+    repo_id : str
+    repo_name : str
+    query_results : dict
+        dataset name -> result (see utils/gather.py)
+    """
+    import asyncio
+    import queue
+    import threading
+
+    results = queue.Queue(maxsize=in_flight)
+
+    def gather():
+        try:
+            asyncio.run(gather_org_queries(repos, org_name, start_date, end_date, engine, in_flight, results, memory_budget, ordered, metrics, org_results, approximate))
+            results.put(None)
+        except Exception as e:
+            results.put(e)
+
+    threading.Thread(target=gather, daemon=True).start()
+
+    while True:
+        item = results.get()
+        if item is None:
+            break
+        elif isinstance(item, Exception):
+            raise item
+        yield item
@@ -2,7 +2,7 @@
 # MIT License
 
 def augur_db_connect(file_path):
-    """ Connects to the Augur database using the configuration from 
+    """ Connects to the Augur database using the configuration from
         config.json
             {
                 "connection_string": "sqlite:///:memory:",
@@ -14,22 +14,67 @@ def augur_db_connect(file_path):
                 "user": "xxxx",
                 "user_type": "read_only"
             }
+
+        The optional "backend" key selects the type of database. It defaults
+        to "postgresql" (a live Augur database). Local extracts of the Augur
+        tables can be used with "sqlite" or "duckdb", in which case "database"
+        is the path to the database file and the other keys are ignored:
+            {
+                "backend": "duckdb",
+                "database": "/path/to/augur_extract.duckdb"
+            }
+        The duckdb backend requires the duckdb-engine package.
+
+        A Parquet snapshot written by export_snapshot.py is used with the
+        "snapshot" backend, with "database" set to the snapshot directory.
+        It is read through an in-memory DuckDB database (see utils/snapshot.py).
+
         Returns
         -------
         engine : sqlalchemy database object
     """
-    import psycopg2
+    import sys
     import sqlalchemy as s
     import json
 
     with open(file_path) as config_file:
         config = json.load(config_file)
 
-    database_connection_string = 'postgresql+psycopg2://{}:{}@{}:{}/{}'.format(config['user'], config['password'], config['host'], config['port'], config['database'])
+    backend = config.get('backend', 'postgresql')
+
+    if backend == 'postgresql':
+        import psycopg2
+
+        database_connection_string = 'postgresql+psycopg2://{}:{}@{}:{}/{}'.format(config['user'], config['password'], config['host'], config['port'], config['database'])
+
+        dbschema='augur_data'
+        engine = s.create_engine(
+            database_connection_string,
+            connect_args={'options': '-csearch_path={}'.format(dbschema)})
+
+    elif backend == 'sqlite':
+        engine = s.create_engine('sqlite:///{}'.format(config['database']))
+
+    elif backend == 'duckdb':
+        try:
+            engine = s.create_engine(
+                'duckdb:///{}'.format(config['database']),
+                connect_args={'read_only': True})
+        except s.exc.NoSuchModuleError:
+            print('The duckdb backend requires the duckdb-engine package. Exiting')
+            sys.exit(1)
+
+    elif backend == 'snapshot':
+        from utils.snapshot import snapshot_engine
+
+        try:
+            engine = snapshot_engine(config['database'])
+        except s.exc.NoSuchModuleError:
+            print('The snapshot backend requires the duckdb-engine package. Exiting')
+            sys.exit(1)
 
-    dbschema='augur_data'
-    engine = s.create_engine(
-        database_connection_string,
-        connect_args={'options': '-csearch_path={}'.format(dbschema)})
+    else:
+        print('Unknown backend in config file:', backend, '- use postgresql, sqlite, duckdb or snapshot. Exiting')
+        sys.exit(1)
 
-    return engine
\ No newline at end of file
+    return engine
@@ -0,0 +1,445 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains functions that compute the metrics for a repo as of each of the
+last month-ends (see the backfill option of health_by_repo.py), to show how
+the health of a repo changed over time without running the script again for
+every past month.
+
+The queries for a repo are run once for the union of all of the windows,
+from the start of the window for the oldest month-end to the last complete
+month. The rows are sorted by date once, and the window for each month-end
+is found with a binary search on the dates, so each metric only counts the
+rows in its window:
+
+* Release Frequency: releases in the 6 months before each month-end
+* Change Request Closure Ratio: the months in the window with more than 15%
+  of PRs not closed, and the trend of the gap over the last 6 months, from
+  running sums over the monthly PR counts
+* Time to First Response: the same for the PRs out of guidelines, with the
+  response of each PR checked against the business days only once
+* Bus Factor: the commits by each author in the window
+
+The thresholds and the classification of each metric are the ones in
+metrics/thresholds.py, shared with the *_data functions of the metrics. The
+results are the same as a run of health_by_repo.py in the month after each
+month-end, except that the past 6 months for the time to first response are
+counted back from the month-end instead of from today. benchmark/regress.py
+checks that the last month-end matches a normal run.
+"""
+
+def backfill_windows(months, years):
+    """ Gets the window for each of the last month-ends
+
+    Parameters
+    ----------
+    months : int
+        the number of month-ends
+    years : int
+
+    Returns
+    -------
+    windows : list
+        (start_date, end_date) tuples, from the oldest month-end to the last
+        complete month
+    """
+    from utils.date_calcs import get_month_ends, get_dates
+
+    windows = [get_dates(365 * years, month_end) for month_end in get_month_ends(months)]
+
+    return windows
+
+def window_bounds(times, windows, start_inclusive=True, end_inclusive=True):
+    """ Finds the rows in each window with a binary search on sorted times
+
+    Parameters
+    ----------
+    times : numpy array
+        sorted datetime64 values
+    windows : list
+        (start, end) tuples of datetime values
+    start_inclusive : bool
+        if True, rows at exactly the start are in the window
+    end_inclusive : bool
+        if True, rows at exactly the end are in the window
+
+    Returns
+    -------
+    lo : numpy array
+    hi : numpy array
+        the rows in window i are times[lo[i]:hi[i]]
+    """
+    import numpy as np
+
+    starts = np.array([start for start, end in windows], dtype='datetime64[ns]')
+    ends = np.array([end for start, end in windows], dtype='datetime64[ns]')
+
+    lo = np.searchsorted(times, starts, side='left' if start_inclusive else 'right')
+    hi = np.searchsorted(times, ends, side='right' if end_inclusive else 'left')
+
+    return lo, hi
+
+def sort_by_time(df, column):
+    """ Sorts a dataframe by a datetime column, leaving out rows without one
+
+    Parameters
+    ----------
+    df : dataframe
+    column : str
+
+    Returns
+    -------
+    df : dataframe
+    times : numpy array
+        the datetime64 values of the column, sorted
+    """
+    df = df[df[column].notna()].sort_values(column, kind='stable').reset_index(drop=True)
+
+    return df, df[column].values.astype('datetime64[ns]')
+
+def month_codes(times):
+    """ Numbers the months of datetime values, so that consecutive months
+    have consecutive numbers
+
+    Parameters
+    ----------
+    times : numpy array or datetime
+
+    Returns
+    -------
+    codes : numpy array or int
+    """
+    import numpy as np
+
+    return np.asarray(times, dtype='datetime64[M]').astype('int64')
+
+def release_series(releases_df, windows):
+    """ Counts the releases in the RELEASE_DAYS before each month-end
+
+    Parameters
+    ----------
+    releases_df : dataframe
+        from get_release_data for the union of the windows
+    windows : list
+        (start_dt, end_dt) tuples
+
+    Returns
+    -------
+    releases : list
+        the number of releases as a str, like activity_release_graph
+    """
+    import datetime
+    from metrics.thresholds import RELEASE_DAYS
+
+    releases_df, times = sort_by_time(releases_df, 'date')
+    lo, hi = window_bounds(times, [(end_dt - datetime.timedelta(days=RELEASE_DAYS), end_dt) for start_dt, end_dt in windows])
+
+    return [str(count) for count in hi - lo]
+
+def closure_ratio_series(all_prsDF, closed_prsDF, windows):
+    """ Gets the Change Request Closure Ratio as of each month-end from the
+    monthly PR counts, with running sums over the months
+
+    Parameters
+    ----------
+    all_prsDF : dataframe
+        from monthly_prs_all for the union of the windows
+    closed_prsDF : dataframe
+        from monthly_prs_closed for the union of the windows
+    windows : list
+        (start_dt, end_dt) tuples
+
+    Returns
+    -------
+    closure_ratio_mos : list
+        like sustain_prs_by_repo_graph
+    trends : list
+    """
+    import numpy as np
+    from metrics.thresholds import MIN_PRS, GAP_SHARE, CLOSURE_SKIP_MONTHS, gap_trend
+
+    first_code = int(month_codes(windows[0][0]))
+    num_months = int(month_codes(windows[-1][1])) - first_code + 1
+
+    def month_counts(pr_monthDF):
+        codes = (pr_monthDF['year'].astype(int) - 1970) * 12 + pr_monthDF['month'].astype(int) - 1 - first_code
+        keep = (codes >= 0) & (codes < num_months)
+        return np.bincount(codes[keep], weights=pr_monthDF['total_prs_open_closed'][keep], minlength=num_months)
+
+    all_total = month_counts(all_prsDF)
+    diff = all_total - month_counts(closed_prsDF)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        over = (diff / all_total > GAP_SHARE).astype(int)
+
+    # Running sums, so that the sum over any months is a subtraction
+    all_cum = np.concatenate([[0], np.cumsum(all_total)])
+    diff_cum = np.concatenate([[0], np.cumsum(diff)])
+    over_cum = np.concatenate([[0], np.cumsum(over)])
+
+    closure_ratio_mos = []
+    trends = []
+    for start_dt, end_dt in windows:
+        first = int(month_codes(start_dt)) - first_code
+        last = int(month_codes(end_dt)) - first_code + 1
+
+        if all_cum[last] - all_cum[first] < MIN_PRS:
+            closure_ratio_mos.append('Too Few PRs')
+            trends.append('')
+            continue
+
+        # The months after the first CLOSURE_SKIP_MONTHS of the window
+        closure_ratio_mos.append(str(int(over_cum[last] - over_cum[first + CLOSURE_SKIP_MONTHS])))
+        trends.append(gap_trend(diff_cum[first + 12] - diff_cum[first + 9], diff_cum[first + 9] - diff_cum[first + 6]))
+
+    return closure_ratio_mos, trends
+
+def first_response_series(pr_all, windows, bus_days):
+    """ Gets the Time to First Response as of each month-end
+
+    Parameters
+    ----------
+    pr_all : dataframe
+        from combine_response_times for the union of the windows
+    windows : list
+        (start_dt, end_dt) tuples
+    bus_days : int
+
+    Returns
+    -------
+    first_resp_mos : list
+        like response_time_graph
+    trends : list
+    """
+    import numpy as np
+    import pandas as pd
+    from metrics.thresholds import MIN_PRS, GAP_SHARE, RESPONSE_MONTHS, gap_trend
+
+    pr_all, times = sort_by_time(pr_all, 'pr_created_at')
+
+    # Whether each PR had a response in time is the same in every window
+    bd = pd.tseries.offsets.BusinessDay(n = bus_days)
+    in_guidelines = np.where(pr_all.pr_created_at + bd < pr_all['first_response_time'], 0, 1)
+    responses_cum = np.concatenate([[0], np.cumsum(pr_all['first_response_time'].notna().values)])
+    codes = month_codes(times)
+
+    lo, hi = window_bounds(times, windows, start_inclusive=False)
+
+    first_resp_mos = []
+    trends = []
+    for (start_dt, end_dt), start, end in zip(windows, lo, hi):
+        if end - start < MIN_PRS or responses_cum[end] - responses_cum[start] == 0:
+            first_resp_mos.append('Too Few PRs')
+            trends.append('')
+            continue
+
+        first = int(month_codes(start_dt))
+        num_months = int(month_codes(end_dt)) - first + 1
+
+        total_prs = np.bincount(codes[start:end] - first, minlength=num_months)
+        out_guidelines = total_prs - np.bincount(codes[start:end] - first, weights=in_guidelines[start:end], minlength=num_months)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out_percent = out_guidelines / total_prs
+
+        first_resp_mos.append(str(int((out_percent[-RESPONSE_MONTHS:] > GAP_SHARE).sum())))
+
+        # Months without PRs are only filled in when there are fewer than 12
+        # months with PRs, like in response_time_data
+        months = np.flatnonzero(total_prs)
+        if len(months) < 12:
+            months = np.arange(num_months)
+        trends.append(gap_trend(out_guidelines[months[9:12]].sum(), out_guidelines[months[6:9]].sum()))
+
+    return first_resp_mos, trends
+
+def bus_factor_values(percents):
+    """ Gets the bus factor from the share of commits of each author, with
+    bus_factor_people like contributor_risk_data
+
+    Parameters
+    ----------
+    percents : numpy array
+        the share of commits of each author, largest first
+
+    Returns
+    -------
+    bus_factor : str
+    bus_factor_percents : str
+        like contributor_risk_graph
+    """
+    from metrics.thresholds import BUS_FACTOR_PEOPLE, bus_factor_people
+
+    percents = percents[:BUS_FACTOR_PEOPLE]
+    num_people = bus_factor_people(list(percents))
+    if num_people == 0:
+        return 'Error', 'Error'
+
+    return str(num_people), '--'.join(str(x) for x in percents)
+
+def bus_factor_series(commitsDF, windows):
+    """ Gets the Bus Factor as of each month-end from the commits
+
+    Parameters
+    ----------
+    commitsDF : dataframe
+        from commit_data for the union of the windows
+    windows : list
+        (start_dt, end_dt) tuples
+
+    Returns
+    -------
+    bus_factors : list
+    bus_factor_percents : list
+    """
+    import numpy as np
+    import pandas as pd
+
+    commitsDF, times = sort_by_time(commitsDF, 'cmt_author_timestamp')
+    authors = pd.factorize(commitsDF['cntrb_login'])[0]
+    hashes = pd.factorize(commitsDF['cmt_commit_hash'])[0]
+
+    lo, hi = window_bounds(times, windows)
+
+    bus_factors = []
+    bus_factor_percents = []
+    for start, end in zip(lo, hi):
+        window_authors = authors[start:end]
+        counts = np.bincount(window_authors[window_authors >= 0])
+        total_commits = len(np.unique(hashes[start:end]))
+
+        percents = np.sort(counts[counts > 0])[::-1] / total_commits if total_commits > 0 else np.array([])
+        bus_factor, percent_str = bus_factor_values(percents)
+        bus_factors.append(bus_factor)
+        bus_factor_percents.append(percent_str)
+
+    return bus_factors, bus_factor_percents
+
+def counted_bus_factor_series(repo_id, window_dates, engine):
+    """ Gets the Bus Factor as of each month-end with the commits counted by
+    author in the database for each window, for repos whose commits were not
+    fetched (see commit_author_counts)
+
+    Parameters
+    ----------
+    repo_id : str
+    window_dates : list
+        (start_date, end_date) tuples of str
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    bus_factors : list
+    bus_factor_percents : list
+    """
+    import numpy as np
+    from metrics.bus_factor import commit_author_counts
+
+    bus_factors = []
+    bus_factor_percents = []
+    for start_date, end_date in window_dates:
+        authorDF = commit_author_counts(repo_id, start_date, end_date, engine)
+        bus_factor, percent_str = bus_factor_values(np.sort(authorDF['percent'].values.astype(float))[::-1])
+        bus_factors.append(bus_factor)
+        bus_factor_percents.append(percent_str)
+
+    return bus_factors, bus_factor_percents
+
+def backfill_repo_data(query_results, repo_id, repo_name, window_dates, engine, bus_days_list, metrics=None):
+    """ Computes the metrics for a repo as of each month-end from the datasets
+    gathered for the union of the windows
+
+    Parameters
+    ----------
+    query_results : dict
+        dataset name -> result, from iter_repo_queries in utils/gather.py
+    repo_id : str
+    repo_name : str
+    window_dates : list
+        (start_date, end_date) tuples, from backfill_windows
+    engine : sqlalchemy database object
+    bus_days_list : list
+        numbers of business days (int) for the time to first response
+    metrics : list
+        names of the metrics to compute (default to every metric). The
+        columns of the other metrics are left empty.
+
+    Returns
+    -------
+    series : dict
+        bus_days -> dataframe with one row for each month-end
+    """
+    import pandas as pd
+    from utils.date_calcs import convert_dates
+    from utils.timing import tagged, stage
+    from metrics.first_response import combine_response_times
+    from metrics.registry import METRICS
+
+    metrics = metrics or list(METRICS)
+    windows = [convert_dates(start_date, end_date) for start_date, end_date in window_dates]
+    empty = [''] * len(windows)
+
+    releases = empty
+    if 'release' in metrics:
+        with stage('transform', metric='release'):
+            releases = release_series(query_results['releases'], windows)
+
+    closure_ratio_mos, closure_trends = empty, empty
+    if 'closure_ratio' in metrics:
+        with stage('transform', metric='closure_ratio'):
+            closure_ratio_mos, closure_trends = closure_ratio_series(query_results['prs_all'], query_results['prs_closed'], windows)
+
+    bus_factors, bus_factor_percents = empty, empty
+    if 'bus_factor' in metrics:
+        with tagged(metric='bus_factor'), stage('transform'):
+            if query_results.get('commits') is None:
+                bus_factors, bus_factor_percents = counted_bus_factor_series(repo_id, window_dates, engine)
+            else:
+                bus_factors, bus_factor_percents = bus_factor_series(query_results['commits'], windows)
+
+    series = {}
+    with stage('transform', metric='first_response'):
+        if 'first_response' in metrics:
+            pr_all = combine_response_times(query_results['pr_response'], query_results['pr_first_review'], repo_name)
+
+        for bus_days in bus_days_list:
+            first_resp_mos, first_resp_trends = empty, empty
+            if 'first_response' in metrics:
+                first_resp_mos, first_resp_trends = first_response_series(pr_all, windows, bus_days)
+
+            series[bus_days] = pd.DataFrame({
+                'as_of': [end_date.strip("'") for start_date, end_date in window_dates],
+                'releases': releases,
+                'first_resp_mos': first_resp_mos,
+                'first_resp_trend': first_resp_trends,
+                'closure_ratio_mos': closure_ratio_mos,
+                'closure_ratio_trend': closure_trends,
+                'bus_factor': bus_factors,
+                'bus_factor_percents': bus_factor_percents,
+            })
+
+    return series
+
+def write_backfill(series, repo_name, org_name, years):
+    """ Saves the metrics as of each month-end for a repo as CSV files next
+    to its graphs
+
+    Parameters
+    ----------
+    series : dict
+        from backfill_repo_data
+    repo_name : str
+    org_name : str
+    years : int
+
+    Returns
+    -------
+    filenames : list
+    """
+    from utils.file_operations import output_path, write_atomic
+
+    filenames = []
+    for bus_days, seriesDF in series.items():
+        filename = output_path(repo_name, org_name) + '/' + repo_name + '_backfill_y' + str(years) + '_bd_' + str(bus_days) + '.csv'
+        write_atomic(filename, lambda tmp_filename: seriesDF.to_csv(tmp_filename, index=False))
+        filenames.append(filename)
+
+    return filenames
@@ -0,0 +1,183 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains functions for the checkpoint manifest of an org run, so that a
+run that dies part way through an org can be resumed with --resume instead
+of starting over.
+
+The manifest is a JSON lines file next to the summaries. The first line
+holds the parameters of the run, and a line is added for each repo as soon
+as it finishes, with its status ('done' or 'failed') and its row for each
+summary (see utils/summary_writer.py). When a run is resumed, the summaries
+are rewritten from the manifest, so they match it even if the last run died
+while writing them or before writing its last batch, and the repos that are
+done are skipped. Failed repos are tried again. The manifest is read one
+line at a time, so that only the ids of the repos that are done are kept in
+memory.
+"""
+
+def checkpoint_filename(path, org_name):
+    """ Creates the filename of the checkpoint manifest for an org
+
+    Parameters
+    ----------
+    path : str
+        from create_path_str
+    org_name : str
+
+    Returns
+    -------
+    filename : str
+    """
+
+    return path + '/_' + org_name + '_checkpoint.jsonl'
+
+def csv_key(years, bus_days):
+    """ Creates the key used for a summary in the manifest
+
+    Parameters
+    ----------
+    years : int
+    bus_days : int
+
+    Returns
+    -------
+    key : str
+    """
+
+    return 'yr_' + str(years) + '_bdays_' + str(bus_days)
+
+def read_checkpoint(filename, params):
+    """ Reads the repos that are done from a checkpoint manifest, one line at
+    a time, so that only their ids are kept in memory
+
+    Parameters
+    ----------
+    filename : str
+    params : dict
+        the parameters of this run, which must match the ones in the manifest
+
+    Returns
+    -------
+    completed : set
+        repo_id (str) of each repo that is done, or None if the manifest was
+        made with other parameters
+    """
+    import json
+    from os.path import exists
+
+    completed = set()
+
+    if not exists(filename):
+        return completed
+
+    with open(filename) as f:
+        for i, line in enumerate(f):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line is cut short if the run died while writing it
+                continue
+
+            if i == 0:
+                if entry.get('params') != params:
+                    return None
+                continue
+
+            if entry['status'] == 'done':
+                completed.add(str(entry['repo_id']))
+            else:
+                completed.discard(str(entry['repo_id']))
+
+    return completed
+
+def iter_checkpoint(filename, completed=None):
+    """ Reads the entries of the repos that are done from a checkpoint
+    manifest, one line at a time
+
+    Parameters
+    ----------
+    filename : str
+    completed : set
+        from read_checkpoint, to leave out the repos that failed after they
+        were done (optional)
+
+    Yields
+    ------
+    entry : dict
+        in the order the repos finished
+    """
+    import json
+    from os.path import exists
+
+    if not exists(filename):
+        return
+
+    with open(filename) as f:
+        for i, line in enumerate(f):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+
+            if i > 0 and entry['status'] == 'done' and (completed == None or str(entry['repo_id']) in completed):
+                yield entry
+
+def start_checkpoint(filename, params, completed):
+    """ Writes a new checkpoint manifest with the repos that are already done,
+    copied from the last manifest one line at a time and leaving out the
+    failed ones, and opens it to add the next repos
+
+    Parameters
+    ----------
+    filename : str
+    params : dict
+        the parameters of this run
+    completed : set
+        from read_checkpoint, or an empty set to start over
+
+    Returns
+    -------
+    manifest : file object
+    """
+    import json
+    import os
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        f.write(json.dumps({'params': params}) + '\n')
+        if completed:
+            for entry in iter_checkpoint(filename, completed):
+                f.write(json.dumps(entry) + '\n')
+    os.replace(tmp_filename, filename)
+
+    return open(filename, 'a')
+
+def checkpoint_repo(manifest, repo_id, repo_name, status, summary_rows=None, error=None):
+    """ Adds a repo to the checkpoint manifest and makes sure it is written to
+    disk
+
+    Parameters
+    ----------
+    manifest : file object
+        from start_checkpoint
+    repo_id : str
+    repo_name : str
+    status : str
+        'done' or 'failed'
+    summary_rows : dict
+        csv_key -> the repo's row for that summary, from summary_row in
+        utils/summary_writer.py
+    error : str
+        what went wrong, for failed repos
+    """
+    import json
+    import os
+
+    entry = {'repo_id': str(repo_id), 'repo_name': repo_name, 'status': status, 'summary_rows': summary_rows or {}}
+    if error != None:
+        entry['error'] = error
+
+    manifest.write(json.dumps(entry) + '\n')
+    manifest.flush()
+    os.fsync(manifest.fileno())
@@ -0,0 +1,180 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains the functions that draw every metric for a repo as one
+dashboard graph, instead of a separate graph for each metric.
+
+Each metric is drawn on its own part of a single figure by the same
+*_template and *_update functions used for its separate graph, so the layout
+is worked out and the png is encoded once for each repo instead of four
+times. The figure is kept for the next repo with the same layout (see
+utils/render.py).
+A metric that couldn't be calculated, like one with too few PRs, shows why
+in its part of the dashboard.
+"""
+
+# Size in inches of each row of two metrics and resolution of the dashboard.
+# Each part is about the size of a separate graph on screen, at a lower
+# resolution, so the png is still quick to encode with all of the metrics
+# on it.
+ROW_SIZE = (32, 9)
+DASHBOARD_DPI = 200
+TITLE_SIZE = 24
+# Longest line of the interpretation under each part, in characters
+LABEL_WIDTH = 90
+
+def summary_values(repo_data, bus_days):
+    """ Gets the values for the summary CSVs from the data for each metric,
+    which are the same values returned by the *_graph functions
+
+    Parameters
+    ----------
+    repo_data : dict
+        from repo_metric_data in utils/gather.py
+    bus_days : int
+
+    Returns
+    -------
+    values : dict
+        releases, first_resp_mos, closure_ratio_mos, bus_factor and
+        bus_factor_percents as strings, which are empty for the metrics
+        that were not computed
+    """
+
+    values = {'releases': '', 'first_resp_mos': '', 'closure_ratio_mos': '', 'bus_factor': '', 'bus_factor_percents': ''}
+
+    if 'release' in repo_data:
+        data = repo_data['release']
+        values['releases'] = "0" if data[0] == -1 else str(data[7])
+
+    if 'closure_ratio' in repo_data:
+        data = repo_data['closure_ratio']
+        values['closure_ratio_mos'] = "Too Few PRs" if data[0] == -1 else str(data[5])
+
+    if 'bus_factor' in repo_data:
+        data = repo_data['bus_factor']
+        if data[0] == -1:
+            values['bus_factor'], values['bus_factor_percents'] = "Error", "Error"
+        else:
+            values['bus_factor'] = str(data[7])
+            values['bus_factor_percents'] = '--'.join(str(x) for x in data[3])
+
+    if 'first_response' in repo_data:
+        data = repo_data['first_response'][bus_days]
+        values['first_resp_mos'] = "Too Few PRs" if data[0] == -1 else str(data[5])
+
+    return values
+
+def dashboard_graph(repo_name, org_name, start_date, end_date, years, bus_days, repo_data):
+    """ Draws every metric in repo_data for a repo as one graph
+
+    Parameters
+    ----------
+    repo_name : str
+    org_name : str
+    start_date : str
+    end_date : str
+    years : int
+    bus_days : int
+    repo_data : dict
+        from repo_metric_data in utils/gather.py
+
+    Returns
+    -------
+    values : dict
+        from summary_values
+
+    Output
+    ------
+    Saves a png file in the location defined in the output_filename function.
+    """
+    import math
+    import textwrap
+    import warnings
+    import matplotlib.pyplot as plt
+    from metrics.release_frequency import activity_release_template, activity_release_update
+    from metrics.closure_ratio import sustain_prs_by_repo_template, sustain_prs_by_repo_update
+    from metrics.bus_factor import contributor_risk_template, contributor_risk_update
+    from metrics.first_response import response_time_template, response_time_update
+    from utils.file_operations import output_filename, chart_hash, chart_up_to_date, save_chart
+    from utils.render import figure_template
+
+    warnings.simplefilter("ignore") # Ignore fixed formatter warning.
+
+    values = summary_values(repo_data, bus_days)
+
+    # Each metric's data, with the functions that set up and draw its part
+    # and the message shown when it couldn't be calculated
+    panels = []
+    if 'release' in repo_data:
+        panels.append(('release', repo_data['release'], activity_release_template, activity_release_update, {}, 'Release Frequency: no releases in the past 6 months'))
+    if 'closure_ratio' in repo_data:
+        panels.append(('closure_ratio', repo_data['closure_ratio'], sustain_prs_by_repo_template, sustain_prs_by_repo_update, {}, 'Change Request Closure Ratio: too few PRs to calculate'))
+    if 'bus_factor' in repo_data:
+        panels.append(('bus_factor', repo_data['bus_factor'], contributor_risk_template, contributor_risk_update, {}, 'Bus Factor: not enough commits to calculate'))
+    if 'first_response' in repo_data:
+        panels.append(('first_response', repo_data['first_response'][bus_days], response_time_template, response_time_update, {'bus_days': bus_days}, 'Time to First Response: too few PRs to calculate'))
+
+    if not panels:
+        return values
+
+    filename_str = 'dashboard_y' + str(years) + '_bd_' + str(bus_days)
+    filename = output_filename(repo_name, org_name, filename_str)
+
+    # Don't draw the graph again if the data and settings haven't changed
+    content_hash = chart_hash(tuple(panel[1] for panel in panels), metric=filename_str,
+        size=ROW_SIZE, font_scale=2, dpi=DASHBOARD_DPI, title_size=TITLE_SIZE, label_width=LABEL_WIDTH)
+    if chart_up_to_date(filename, content_hash):
+        print('Dashboard for', org_name, '/', repo_name, 'is unchanged in', filename)
+        return values
+
+    # A template figure is kept for each layout: the metrics shown and which
+    # of them couldn't be calculated
+    layout = tuple((name, data[0] == -1) for name, data, template_function, update, kwargs, message in panels)
+
+    def create():
+        ncols = min(len(panels), 2)
+        nrows = math.ceil(len(panels) / ncols)
+        fig, axes = plt.subplots(nrows, ncols, squeeze=False, constrained_layout=True)
+        fig.set_size_inches(ROW_SIZE[0], ROW_SIZE[1] * nrows)
+
+        axes = axes.flatten()
+        templates = []
+        for ax, (name, data, template_function, update, kwargs, message) in zip(axes, panels):
+            if data[0] == -1:
+                ax.set_axis_off()
+                ax.text(0.5, 0.5, message, ha='center', va='center', transform=ax.transAxes)
+                templates.append(None)
+            else:
+                templates.append(template_function(ax, title_size=TITLE_SIZE))
+
+                # Each part is narrower than a separate graph, so the release
+                # dates are turned like the months of the other graphs so
+                # they don't overlap
+                if name == 'release':
+                    ax.tick_params(axis='x', labelrotation=45)
+
+        # With an odd number of metrics, the last part is left blank
+        for ax in axes[len(panels):]:
+            ax.set_axis_off()
+
+        return {'fig': fig, 'templates': templates}
+
+    dashboard = figure_template(('dashboard', layout), create)
+    fig = dashboard['fig']
+    fig.suptitle(org_name + ' / ' + repo_name + ' from ' + start_date.strip("'") + ' to ' + end_date.strip("'"), fontsize=30)
+
+    for template, (name, data, template_function, update, kwargs, message) in zip(dashboard['templates'], panels):
+        if template != None:
+            update(template, data, **kwargs)
+
+            # The interpretation is wrapped to fit the narrower part
+            ax = template['ax']
+            xlabel = '\n'.join(textwrap.fill(line, LABEL_WIDTH) for line in ax.get_xlabel().split('\n'))
+            ax.set_xlabel(xlabel)
+
+    save_chart(fig, filename, content_hash, dpi=DASHBOARD_DPI)
+
+    print('Dashboard for', org_name, '/', repo_name, 'from', start_date, 'to', end_date, '\nsaved as', filename)
+
+    return values
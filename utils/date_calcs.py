@@ -21,13 +21,16 @@ def get_last_month():
 
     return(last_month)
 
-def get_dates(days):
+def get_dates(days, last_month=None):
     """ Gets the start and end date for the analysis based on the number
     of years to be analyzed (converted to days)"
     
     Parameters
     ----------
     days : int
+    last_month : date
+        the last day of the last month to analyze (default to the last
+        complete month, from get_last_month)
 
     Returns
     -------
@@ -36,7 +39,8 @@ def get_dates(days):
     """
     import datetime 
 
-    last_month = get_last_month()
+    if last_month == None:
+        last_month = get_last_month()
     end_date = "'" + str(last_month) + "'"
 
     start_month = last_month - datetime.timedelta(days=days)
@@ -45,6 +49,44 @@ def get_dates(days):
 
     return start_date, end_date
 
+def get_month_ends(months):
+    """ Gets the last day of each of the last complete months
+
+    Parameters
+    ----------
+    months : int
+        the number of months
+
+    Returns
+    -------
+    month_ends : list
+        date objects, from the oldest month to the last complete month
+    """
+    import datetime
+
+    month_ends = [get_last_month()]
+    while len(month_ends) < months:
+        month_ends.append(month_ends[-1].replace(day=1) - datetime.timedelta(days=1))
+
+    return month_ends[::-1]
+
+def parse_date(date):
+    """ Converts a date, quoted for SQL like the ones from get_dates, to a
+    datetime object.
+
+    Parameters
+    ----------
+    date : str
+        like "'2024-01-31'"
+
+    Returns
+    -------
+    dt : datetime
+    """
+    import datetime
+
+    return datetime.datetime.strptime(date[1:11], '%Y-%m-%d')
+
 def convert_dates(start_date, end_date):
     """ Converts start and end dates to datetime objects.
 
@@ -59,9 +101,53 @@ def convert_dates(start_date, end_date):
     end_dt : datetime
     
     """
-    import datetime
+    start_dt = parse_date(start_date)
+    end_dt = parse_date(end_date)
 
-    start_dt = datetime.datetime.strptime(start_date[1:11], '%Y-%m-%d')
-    end_dt = datetime.datetime.strptime(end_date[1:11], '%Y-%m-%d')
+    return start_dt, end_dt 
+
+def get_months(start_date, end_date):
+    """ Gets the year and month of every month from the start date through
+    the end date. This replaces the PostgreSQL-only generate_series in the
+    monthly queries so that months without any activity are still reported.
+
+    Parameters
+    ----------
+    start_date : str
+    end_date : str
+
+    Returns
+    -------
+    monthsDF : dataframe
+        with integer year and month columns
+    """
+    import pandas as pd
+
+    start_dt, end_dt = convert_dates(start_date, end_date)
+    months = pd.date_range(start_dt, end_dt, freq='MS')
+
+    monthsDF = pd.DataFrame({'year': months.year, 'month': months.month})
+
+    return monthsDF
+
+def get_windows(years_list):
+    """ Gets the start and end date of the analysis for each number of years.
+    All of the windows end with the last complete month.
+
+    Parameters
+    ----------
+    years_list : list
+        numbers of years (int)
+
+    Returns
+    -------
+    windows : list
+        (years, start_date, end_date) tuples, from the widest window to the
+        narrowest
+    """
+    windows = []
+    for years in sorted(set(years_list), reverse=True):
+        start_date, end_date = get_dates(365 * years)
+        windows.append((years, start_date, end_date))
 
-    return start_dt, end_dt 
\ No newline at end of file
+    return windows
@@ -0,0 +1,376 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains functions used to capture the PostgreSQL query plans of the
+metric queries and suggest indexes for them (see explain_queries.py).
+
+The SQL for each metric is captured from fetch_df while the query functions
+run as usual (see capture_queries in utils/fetch.py), and each query is then
+run again with EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON).
+
+A sequential scan is flagged when the table has at least min_rows rows. The
+index suggested for it is made from the columns the scan filters on
+(equality first, then one range column), or else from the columns used to
+join the table to the rest of the query. Suggestions matching the leading
+columns of an existing index are reported without DDL, since the planner
+chose not to use that index.
+"""
+
+# Comparisons in a plan's Filter, like (repo_id = 1) or
+# ((cmt_author_timestamp)::timestamp ... >= '2025-10-01'::date)
+FILTER_PATTERN = r"(?:\b(\w+)\.)?\(?\b([a-z_]\w*)\)?(?:::[\w ]+)?\s*(=|>=|<=|>|<)\s*(?=\(?['\d$-])"
+
+# Join conditions, like (message.msg_id = pull_request_message_ref.msg_id)
+JOIN_PATTERN = r"\b(\w+)\.(\w+)\s*=\s*\(?(\w+)\.(\w+)"
+
+def metric_queries(repo_id, repo_name, org_name, start_date, end_date, engine):
+    """ Captures the SQL of every metric query for a repo
+
+    Parameters
+    ----------
+    repo_id : str
+    repo_name : str
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    queries : list
+        (query name, SQL) tuples
+    """
+    from utils.fetch import capture_queries
+    from utils.gather import repo_queries, org_queries
+    from utils.memory import repo_row_counts
+    from metrics.bus_factor import commit_author_counts
+
+    functions = repo_queries(repo_id, repo_name, org_name, start_date, end_date, engine)
+    functions.update(org_queries(org_name, start_date, end_date, engine))
+    functions['commit_author_counts'] = (commit_author_counts, (repo_id, start_date, end_date, engine))
+    functions['row_counts'] = (repo_row_counts, (repo_id, start_date, end_date, engine))
+
+    queries = []
+    for name, (function, args) in functions.items():
+        with capture_queries() as captured:
+            function(*args)
+
+        for i, sql in enumerate(captured):
+            queries.append((name if len(captured) == 1 else name + '_' + str(i + 1), sql))
+
+    return queries
+
+def explain_query(sql, engine):
+    """ Runs a query with EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+
+    Parameters
+    ----------
+    sql : str
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    plan : dict
+        the plan, with 'Plan', 'Planning Time' and 'Execution Time'
+    """
+    import json
+    import sqlalchemy as s
+
+    result = engine.execute(s.sql.text('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql)).scalar()
+
+    # psycopg2 parses the json, but other drivers return it as text
+    if isinstance(result, str):
+        result = json.loads(result)
+
+    return result[0]
+
+def plan_nodes(node, parents=()):
+    """ Walks the nodes of a plan
+
+    Parameters
+    ----------
+    node : dict
+        a plan node, like plan['Plan']
+    parents : tuple
+        the nodes above this one
+
+    Yields
+    ------
+    node : dict
+    parents : tuple
+        the nodes above the node, nearest last
+    """
+    yield node, parents
+
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child, parents + (node,))
+
+def table_info(table, engine, cache):
+    """ Gets the schema, size and existing indexes of a table
+
+    Parameters
+    ----------
+    table : str
+    engine : sqlalchemy database object
+    cache : dict
+        table -> info, so each table is looked up once
+
+    Returns
+    -------
+    info : dict
+        'schema', 'rows' and 'indexes' (lists of column names)
+    """
+    import re
+    import sqlalchemy as s
+
+    if table in cache:
+        return cache[table]
+
+    schema, rows = engine.execute(s.sql.text("""
+                    SELECT n.nspname, c.reltuples
+                    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE c.oid = to_regclass(:table)
+                    """), table=table).fetchone()
+
+    # reltuples is -1 for tables that have never been analyzed
+    if rows < 0:
+        rows = engine.execute(s.sql.text(f'SELECT COUNT(*) FROM {schema}.{table}')).scalar()
+
+    indexdefs = engine.execute(s.sql.text("""
+                    SELECT indexdef FROM pg_indexes
+                    WHERE schemaname = :schema AND tablename = :table
+                    """), schema=schema, table=table).fetchall()
+
+    indexes = []
+    for (indexdef,) in indexdefs:
+        match = re.search(r'\((.*)\)', indexdef)
+        if match:
+            indexes.append([column.strip().strip('"') for column in match.group(1).split(',')])
+
+    cache[table] = {'schema': schema, 'rows': int(rows), 'indexes': indexes}
+
+    return cache[table]
+
+def filter_columns(filter_str, alias):
+    """ Finds the columns of a table compared to values in a plan's Filter
+
+    Parameters
+    ----------
+    filter_str : str
+    alias : str
+        the name or alias of the table in the plan
+
+    Returns
+    -------
+    equal_columns : list
+    range_columns : list
+    """
+    import re
+
+    equal_columns = []
+    range_columns = []
+
+    for qualifier, column, operator in re.findall(FILTER_PATTERN, filter_str or ''):
+        if qualifier not in ['', alias]:
+            continue
+        columns = equal_columns if operator == '=' else range_columns
+        if column not in equal_columns + range_columns:
+            columns.append(column)
+
+    return equal_columns, range_columns
+
+def join_columns(parents, alias):
+    """ Finds the columns of a table used to join it in the nodes above it
+
+    Parameters
+    ----------
+    parents : tuple
+        plan nodes
+    alias : str
+        the name or alias of the table in the plan
+
+    Returns
+    -------
+    columns : list
+    """
+    import re
+
+    columns = []
+    for parent in reversed(parents):
+        for key in ['Hash Cond', 'Merge Cond', 'Join Filter']:
+            for left_alias, left_column, right_alias, right_column in re.findall(JOIN_PATTERN, parent.get(key, '')):
+                if left_alias == alias and left_column not in columns:
+                    columns.append(left_column)
+                if right_alias == alias and right_column not in columns:
+                    columns.append(right_column)
+        if columns:
+            break
+
+    return columns
+
+def seq_scans(plan, engine, min_rows, cache):
+    """ Finds the sequential scans on large tables in a plan and suggests an
+    index for each one
+
+    Parameters
+    ----------
+    plan : dict
+        from explain_query
+    engine : sqlalchemy database object
+    min_rows : int
+        tables with fewer rows are not flagged
+    cache : dict
+        for table_info
+
+    Returns
+    -------
+    scans : list
+        one dict for each flagged scan
+    """
+    scans = []
+
+    for node, parents in plan_nodes(plan['Plan']):
+        if node['Node Type'] != 'Seq Scan':
+            continue
+
+        table = node['Relation Name']
+        alias = node.get('Alias', table)
+        info = table_info(table, engine, cache)
+        if info['rows'] < min_rows:
+            continue
+
+        equal_columns, range_columns = filter_columns(node.get('Filter'), alias)
+        if equal_columns or range_columns:
+            columns = equal_columns + range_columns[:1]
+        else:
+            columns = join_columns(parents, alias)
+
+        indexed = any(index[:len(columns)] == columns for index in info['indexes']) if columns else False
+
+        scans.append({
+            'schema': info['schema'],
+            'table': table,
+            'table_rows': info['rows'],
+            'rows_returned': node.get('Actual Rows', 0) * node.get('Actual Loops', 1),
+            'rows_removed': node.get('Rows Removed by Filter', 0) * node.get('Actual Loops', 1),
+            'columns': columns,
+            'indexed': indexed,
+        })
+
+    return scans
+
+def index_ddl(schema, table, columns):
+    """ Builds the CREATE INDEX statement for a suggested index
+
+    Parameters
+    ----------
+    schema : str
+    table : str
+    columns : list
+
+    Returns
+    -------
+    ddl : str
+    """
+    index_name = ('idx_' + table + '_' + '_'.join(columns))[:63]
+
+    ddl = f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {schema}.{table} ({", ".join(columns)});'
+
+    return ddl
+
+def sample_repos(repoDF, start_date, end_date, engine, sample):
+    """ Picks the repos with the most commits and PRs, since their plans are
+    the ones that matter most
+
+    Parameters
+    ----------
+    repoDF : dataframe
+        from get_org_repos
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    sample : int
+        the number of repos to pick
+
+    Returns
+    -------
+    repos : list
+        (repo_id, repo_name) tuples
+    """
+    from utils.memory import repo_row_counts
+
+    sizes = []
+    for repo_id, repo_name in zip(repoDF['repo_id'], repoDF['repo_name']):
+        num_commits, num_prs = repo_row_counts(repo_id, start_date, end_date, engine)
+        sizes.append((num_commits + num_prs, repo_id, repo_name))
+
+    sizes.sort(key=lambda size: size[0], reverse=True)
+
+    return [(repo_id, repo_name) for size, repo_id, repo_name in sizes[:sample]]
+
+def explain_repos(repos, org_name, start_date, end_date, engine, min_rows, output_dir):
+    """ Saves the plan of every metric query for each repo, along with a CSV
+    report of the flagged sequential scans and the suggested indexes as SQL
+
+    Parameters
+    ----------
+    repos : list
+        (repo_id, repo_name) tuples
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    min_rows : int
+        tables with fewer rows are not flagged
+    output_dir : str
+
+    Returns
+    -------
+    suggestions : dict
+        (schema, table, columns tuple) -> list of 'repo_name/query name'
+        where the scan was flagged, for the indexes that don't exist yet
+    """
+    import json
+    from os.path import join
+    from pathlib import Path
+
+    Path(join(output_dir, 'plans')).mkdir(parents=True, exist_ok=True)
+
+    cache = {}
+    suggestions = {}
+
+    with open(join(output_dir, 'explain_report.csv'), 'w') as report:
+        report.write('repo_name,query,execution_ms,shared_hit_blocks,shared_read_blocks,seq_scan_table,table_rows,rows_returned,rows_removed,suggested_columns,already_indexed\n')
+
+        for repo_id, repo_name in repos:
+            print('Explaining the queries for', org_name, '/', repo_name)
+
+            for name, sql in metric_queries(repo_id, repo_name, org_name, start_date, end_date, engine):
+                plan = explain_query(sql, engine)
+
+                with open(join(output_dir, 'plans', repo_name + '__' + name + '.json'), 'w') as f:
+                    json.dump({'query': sql, 'plan': plan}, f, indent=2)
+
+                line_start = ','.join([repo_name, name, str(round(plan['Execution Time'], 3)),
+                    str(plan['Plan'].get('Shared Hit Blocks', 0)), str(plan['Plan'].get('Shared Read Blocks', 0))])
+
+                scans = seq_scans(plan, engine, min_rows, cache)
+                if not scans:
+                    report.write(line_start + ',,,,,,\n')
+
+                for scan in scans:
+                    report.write(line_start + ',' + ','.join([scan['table'], str(scan['table_rows']), str(scan['rows_returned']),
+                        str(scan['rows_removed']), ' '.join(scan['columns']), str(scan['indexed'])]) + '\n')
+
+                    if scan['columns'] and not scan['indexed']:
+                        key = (scan['schema'], scan['table'], tuple(scan['columns']))
+                        suggestions.setdefault(key, []).append(repo_name + '/' + name)
+
+    with open(join(output_dir, 'suggested_indexes.sql'), 'w') as f:
+        f.write('-- Indexes suggested for the sequential scans flagged in explain_report.csv\n')
+        f.write('-- CONCURRENTLY avoids locking the table, but cannot run inside a transaction\n\n')
+        for (schema, table, columns), flagged in sorted(suggestions.items()):
+            f.write('-- ' + ', '.join(sorted(set(flagged))) + '\n')
+            f.write(index_ddl(schema, table, list(columns)) + '\n\n')
+
+    return suggestions
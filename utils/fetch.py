@@ -0,0 +1,303 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains the functions that every metric and repo_info query goes through
+to fetch its results from the database.
+
+Where a columnar driver is available, the results are fetched as an Arrow
+table instead of being built row by row by pd.read_sql:
+* PostgreSQL: ADBC (adbc-driver-postgresql) if it is installed, otherwise
+  COPY ... TO STDOUT parsed by pyarrow's CSV reader
+* DuckDB: the Arrow result of the DuckDB cursor
+Everything else (SQLite, or any of the above without pyarrow) uses pd.read_sql.
+"""
+import threading
+from contextlib import contextmanager
+
+# ADBC connections are not thread safe, so each thread keeps its own
+# connection for each database URL.
+_adbc_connections = threading.local()
+
+# Lists of the queries captured by capture_queries, for each thread
+_captured = threading.local()
+
+@contextmanager
+def capture_queries():
+    """ Collects the SQL of every query fetched with fetch_df inside the with
+    statement, in the current thread. The queries still run as usual. This is
+    used to find the queries behind each metric (see utils/explain.py).
+
+    Yields
+    ------
+    queries : list
+        SQL strings, in the order they were run
+    """
+    _captured.queries = []
+    try:
+        yield _captured.queries
+    finally:
+        del _captured.queries
+
+def query_string(query):
+    """ Gets the SQL string for a query passed as a string or sqlalchemy text.
+    Any trailing semicolon is removed, since the query may be wrapped in
+    another statement like COPY (...) TO STDOUT.
+
+    Parameters
+    ----------
+    query : str or sqlalchemy text object
+
+    Returns
+    -------
+    sql : str
+    """
+    return str(query).strip().rstrip(';')
+
+def postgres_uri(engine):
+    """ Builds a libpq connection URI (without the +psycopg2 driver name)
+    from the sqlalchemy engine URL
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    uri : str
+    """
+    import copy
+
+    url = copy.copy(engine.url)
+
+    if hasattr(url, 'set'):
+        # sqlalchemy 1.4+ URLs are immutable and mask the password by default
+        url = url.set(drivername='postgresql')
+        uri = url.render_as_string(hide_password=False)
+    else:
+        url.drivername = 'postgresql'
+        uri = url.__to_string__(hide_password=False)
+
+    return uri
+
+def adbc_connection(engine):
+    """ Gets this thread's ADBC connection for a PostgreSQL engine, creating it
+    with the same search_path as the engine the first time.
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    connection : adbc_driver_postgresql dbapi connection
+    """
+    import adbc_driver_postgresql.dbapi
+
+    uri = postgres_uri(engine)
+
+    if not hasattr(_adbc_connections, 'by_uri'):
+        _adbc_connections.by_uri = {}
+
+    if uri not in _adbc_connections.by_uri:
+        search_path = engine.execute('SHOW search_path').scalar()
+        connection = adbc_driver_postgresql.dbapi.connect(uri, autocommit=True)
+        cursor = connection.cursor()
+        cursor.execute('SET search_path TO ' + search_path)
+        cursor.close()
+        _adbc_connections.by_uri[uri] = connection
+
+    return _adbc_connections.by_uri[uri]
+
+def copy_to_arrow(query, engine):
+    """ Fetches the results of a query from PostgreSQL with one COPY ... TO
+    STDOUT transfer and parses them with pyarrow
+
+    Parameters
+    ----------
+    query : str or sqlalchemy text object
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    table : pyarrow Table
+    """
+    import tempfile
+    import pyarrow.csv as pa_csv
+
+    connection = engine.raw_connection()
+    try:
+        with tempfile.TemporaryFile() as csv_file:
+            cursor = connection.cursor()
+            cursor.copy_expert('COPY (' + query_string(query) + ') TO STDOUT WITH (FORMAT csv, HEADER)', csv_file)
+            cursor.close()
+            csv_file.seek(0)
+            table = pa_csv.read_csv(csv_file, convert_options=pa_csv.ConvertOptions(strings_can_be_null=True))
+    finally:
+        connection.close()
+
+    return table
+
+def duckdb_to_arrow(query, engine):
+    """ Fetches the results of a query from DuckDB as an Arrow table
+
+    Parameters
+    ----------
+    query : str or sqlalchemy text object
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    table : pyarrow Table
+    """
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(query_string(query))
+        if hasattr(cursor, 'to_arrow_table'):
+            table = cursor.to_arrow_table()
+        else:
+            table = cursor.fetch_arrow_table()
+        cursor.close()
+    finally:
+        connection.close()
+
+    return table
+
+def postgres_to_arrow(query, engine):
+    """ Fetches the results of a query from PostgreSQL as an Arrow table, using
+    ADBC when it is installed and COPY ... TO STDOUT otherwise
+
+    Parameters
+    ----------
+    query : str or sqlalchemy text object
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    table : pyarrow Table
+    """
+    try:
+        connection = adbc_connection(engine)
+    except ImportError:
+        return copy_to_arrow(query, engine)
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query_string(query))
+        table = cursor.fetch_arrow_table()
+    finally:
+        cursor.close()
+
+    return table
+
+def fetch_arrow(query, engine):
+    """ Fetches the results of a query as an Arrow table using the best
+    columnar driver available for the database
+
+    Parameters
+    ----------
+    query : str or sqlalchemy text object
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    table : pyarrow Table, or None if no columnar driver is available
+    """
+    from utils.sql_dialect import dialect_name
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return None
+
+    dialect = dialect_name(engine)
+
+    try:
+        if dialect == 'postgresql':
+            table = postgres_to_arrow(query, engine)
+        elif dialect == 'duckdb':
+            table = duckdb_to_arrow(query, engine)
+        else:
+            table = None
+    except pa.ArrowException:
+        # e.g. a column type that pyarrow can't parse from the COPY output
+        table = None
+
+    return table
+
+def fetch_df(query, engine, parse_dates=None):
+    """ Fetches the results of a query as a dataframe. This is used for every
+    query so that the fastest available driver is used everywhere. The time
+    and the number of rows are recorded as a 'query' stage (see
+    utils/timing.py).
+
+    Parameters
+    ----------
+    query : str or sqlalchemy text object
+    engine : sqlalchemy database object
+    parse_dates : list
+        columns to convert to datetimes (for databases like SQLite that
+        return timestamps as text)
+
+    Returns
+    -------
+    df : dataframe
+    """
+    import pandas as pd
+    import sqlalchemy as s
+    from utils.timing import stage
+
+    if hasattr(_captured, 'queries'):
+        _captured.queries.append(query_string(query))
+
+    with stage('query') as record:
+        table = fetch_arrow(query, engine)
+
+        if table is None:
+            if isinstance(query, str):
+                query = s.sql.text(query)
+            df = pd.read_sql(query, con=engine, parse_dates=parse_dates)
+        else:
+            df = table.to_pandas()
+
+            for column in parse_dates or []:
+                if not pd.api.types.is_datetime64_any_dtype(df[column]):
+                    df[column] = pd.to_datetime(df[column])
+
+        record['rows'] = len(df)
+
+    return df
+
+def fetch_rows(query, engine):
+    """ Fetches the results of a small query as a list of rows, without
+    loading pandas or pyarrow. This is used for the queries made before any
+    data is gathered, like looking up the repos, so that a run that stops at
+    them (an invalid org or repo) starts quickly. The time and the number of
+    rows are recorded as a 'query' stage, like fetch_df.
+
+    Parameters
+    ----------
+    query : str or sqlalchemy text object
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    rows : list
+        tuples of the values in each row
+    """
+    import sqlalchemy as s
+    from utils.timing import stage
+
+    if hasattr(_captured, 'queries'):
+        _captured.queries.append(query_string(query))
+
+    if isinstance(query, str):
+        query = s.sql.text(query)
+
+    with stage('query') as record:
+        with engine.connect() as connection:
+            rows = [tuple(row) for row in connection.execute(query)]
+
+        record['rows'] = len(rows)
+
+    return rows
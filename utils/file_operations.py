@@ -77,3 +77,149 @@ def output_filename(repo_name, org_name, metric_string):
     filename = path + '/' + repo_name + '_' + metric_string + '.png'
 
     return filename
+
+def hash_value(value, digest):
+    """ Adds a value used to draw a graph to a hash, so that graphs can be
+    compared with the last run without drawing them
+
+    Parameters
+    ----------
+    value : dataframe, series, list, tuple, dict or any value with a stable repr
+    digest : hashlib object
+    """
+    import pandas as pd
+
+    digest.update(type(value).__name__.encode())
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode())
+        digest.update(repr(list(value.dtypes) if isinstance(value, pd.DataFrame) else value.dtype).encode())
+        try:
+            digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+        except TypeError:
+            # Columns holding unhashable values, like lists
+            digest.update(value.to_csv().encode())
+    elif isinstance(value, (list, tuple)):
+        digest.update(str(len(value)).encode())
+        for item in value:
+            hash_value(item, digest)
+    elif isinstance(value, dict):
+        for key in sorted(value, key=str):
+            hash_value(key, digest)
+            hash_value(value[key], digest)
+    else:
+        digest.update(repr(value).encode())
+
+def chart_hash(data, **settings):
+    """ Computes a hash of everything that goes into a graph: the data with
+    its title and interpretation, the render settings and the versions of
+    the plotting libraries
+
+    Parameters
+    ----------
+    data : tuple
+        results of a metric's *_data function
+    **settings : values that change the graph, like metric='bus_factor_y1', dpi=500
+
+    Returns
+    -------
+    content_hash : str
+    """
+    import hashlib
+    import matplotlib
+    import seaborn as sns
+
+    digest = hashlib.sha256()
+    hash_value(data, digest)
+    hash_value(settings, digest)
+    hash_value((matplotlib.__version__, sns.__version__), digest)
+
+    return digest.hexdigest()
+
+def hash_filename(filename):
+    """ Creates the filename of the file that stores the hash of a graph
+
+    Parameters
+    ----------
+    filename : str
+        the graph's filename from output_filename
+
+    Returns
+    -------
+    hash_file : str
+    """
+
+    return filename + '.sha256'
+
+def chart_up_to_date(filename, content_hash):
+    """ Checks whether a graph was already saved from the same data and settings
+
+    Parameters
+    ----------
+    filename : str
+        the graph's filename from output_filename
+    content_hash : str
+        from chart_hash
+
+    Returns
+    -------
+    up_to_date : bool
+    """
+    from os.path import exists
+
+    if not exists(filename):
+        return False
+
+    try:
+        with open(hash_filename(filename)) as f:
+            return f.read().strip() == content_hash
+    except OSError:
+        return False
+
+def write_atomic(filename, write_function):
+    """ Writes a file to a temporary file in the same directory and renames it,
+    so that a run that is interrupted, or another run writing the same file,
+    never leaves a half written file behind
+
+    Parameters
+    ----------
+    filename : str
+    write_function : function
+        called with the temporary filename to write the contents
+    """
+    import os
+    import tempfile
+    from os.path import basename, dirname, splitext
+
+    fd, tmp_filename = tempfile.mkstemp(dir=dirname(filename), prefix='.' + basename(filename) + '.', suffix=splitext(filename)[1])
+    os.close(fd)
+
+    try:
+        write_function(tmp_filename)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+def save_chart(fig, filename, content_hash, **kwargs):
+    """ Saves a graph and the hash of its contents, each written atomically.
+    The hash is written after the image, so an interrupted run only means the
+    graph is drawn again.
+
+    Parameters
+    ----------
+    fig : matplotlib figure
+    filename : str
+        the graph's filename from output_filename
+    content_hash : str
+        from chart_hash
+    **kwargs : arguments for fig.savefig, like dpi=500
+    """
+
+    def write_hash(tmp_filename):
+        with open(tmp_filename, 'w') as f:
+            f.write(content_hash + '\n')
+
+    write_atomic(filename, lambda tmp_filename: fig.savefig(tmp_filename, **kwargs))
+    write_atomic(hash_filename(filename), write_hash)
@@ -0,0 +1,488 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains functions that gather the data for all of the metrics for a repo.
+
+The queries for a repo are run once, for the widest time window needed, and
+the data for each metric is then computed from slices of those query results
+for each window and number of business days. This means that several windows
+(-y) and business day thresholds (-b) can be computed from a single fetch.
+
+Only the datasets needed by the selected metrics are gathered (see
+metrics/registry.py). Each dataset is queried once for a repo, even when
+several metrics need it, and the datasets derived from it, like the monthly
+PR counts, are computed from the query results instead of querying again.
+Datasets that are the same for every repo are queried once for an org.
+"""
+
+def dataset_args(spec, values):
+    """ Gets the arguments for the function of a dataset
+
+    Parameters
+    ----------
+    spec : dict
+        from plan_datasets in metrics/registry.py
+    values : dict
+        the repo and window (repo_id, repo_name, org_name, start_date,
+        end_date, engine), the sampling (pr_sample, commit_sample) and the
+        datasets already fetched, by name
+
+    Returns
+    -------
+    args : tuple
+    """
+
+    return tuple(values[arg] if isinstance(arg, str) and arg in values else arg for arg in spec['args'])
+
+def repo_plan(end_date, engine, aggregate_commits=False, metrics=None):
+    """ Plans the datasets needed for the metrics (see plan_datasets in
+    metrics/registry.py)
+
+    Parameters
+    ----------
+    end_date : str
+    engine : sqlalchemy database object
+    aggregate_commits : bool
+        if True, the commits are not fetched, and they are counted by author
+        in the database for each window instead (see repo_metric_data). This
+        is always done when the summary tables can be used.
+    metrics : list
+        names of the metrics to compute (default to every metric)
+
+    Returns
+    -------
+    plan : list
+        (name, spec) tuples
+    """
+    from metrics.registry import plan_datasets
+    from utils.summary_tables import summary_schema
+
+    return plan_datasets(metrics, summary_schema(engine, end_date) != None, aggregate_commits)
+
+def repo_queries(repo_id, repo_name, org_name, start_date, end_date, engine, aggregate_commits=False, metrics=None, sample=None):
+    """ Lists the independent queries needed to compute the metrics for a repo.
+    Each dataset that several metrics need is only queried once, and the
+    datasets derived from them are computed afterwards by derive_datasets.
+
+    Parameters
+    ----------
+    repo_id : str
+    repo_name : str
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    aggregate_commits : bool
+        if True, the commits are not fetched, and they are counted by author
+        in the database for each window instead (see repo_metric_data). This
+        is always done when the summary tables can be used.
+    metrics : list
+        names of the metrics to compute (default to every metric)
+    sample : dict
+        from sample_plan in utils/approximate.py, to fetch a sample of the
+        PRs and commits (optional)
+
+    Returns
+    -------
+    queries : dict
+        query name -> (function, arguments)
+    """
+    from metrics.registry import load_function
+
+    sample = sample or {}
+    window = {'repo_id': repo_id, 'repo_name': repo_name, 'org_name': org_name, 'start_date': start_date, 'end_date': end_date, 'engine': engine,
+        'pr_sample': sample.get('prs', 1), 'commit_sample': sample.get('commits', 1)}
+
+    queries = {}
+    for name, spec in repo_plan(end_date, engine, aggregate_commits, metrics):
+        if spec['scope'] == 'repo' and not spec['requires']:
+            queries[name] = (load_function(spec['function']), dataset_args(spec, window))
+
+    return queries
+
+def org_queries(org_name, start_date, end_date, engine, metrics=None):
+    """ Lists the queries for the datasets that are the same for every repo in
+    an org, which are run once for all of the repos
+
+    Parameters
+    ----------
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    metrics : list
+        names of the metrics to compute (default to every metric)
+
+    Returns
+    -------
+    queries : dict
+        query name -> (function, arguments)
+    """
+    from metrics.registry import load_function
+
+    window = {'org_name': org_name, 'start_date': start_date, 'end_date': end_date, 'engine': engine}
+
+    queries = {}
+    for name, spec in repo_plan(end_date, engine, metrics=metrics):
+        if spec['scope'] == 'org':
+            queries[name] = (load_function(spec['function']), dataset_args(spec, window))
+
+    return queries
+
+def run_org_queries(org_name, start_date, end_date, engine, metrics=None):
+    """ Runs the queries listed in org_queries
+
+    Parameters
+    ----------
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    metrics : list
+        names of the metrics to compute (default to every metric)
+
+    Returns
+    -------
+    org_results : dict
+        query name -> result
+    """
+    from utils.timing import run_tagged
+
+    org_results = {}
+    for name, (function, args) in org_queries(org_name, start_date, end_date, engine, metrics).items():
+        org_results[name] = run_tagged(query_tags(name, None, org_name), function, *args)
+
+    return org_results
+
+def derive_datasets(query_results, org_results, repo_id, repo_name, org_name, start_date, end_date, engine, metrics=None):
+    """ Computes the datasets that are derived from the results of the queries,
+    and leaves out the datasets that the metrics don't use directly
+
+    Parameters
+    ----------
+    query_results : dict
+        query name -> result, from the queries in repo_queries
+    org_results : dict
+        query name -> result, from run_org_queries
+    repo_id : str
+    repo_name : str
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    metrics : list
+        names of the metrics to compute (default to every metric)
+
+    Returns
+    -------
+    query_results : dict
+        dataset name -> result, for the datasets of the metrics
+    """
+    from metrics.registry import load_function, metric_datasets
+    from utils.timing import tagged, stage
+
+    values = {'repo_id': repo_id, 'repo_name': repo_name, 'org_name': org_name, 'start_date': start_date, 'end_date': end_date, 'engine': engine}
+    values.update(org_results)
+    values.update(query_results)
+
+    with tagged(org=org_name, repo=repo_name):
+        for name, spec in repo_plan(end_date, engine, metrics=metrics):
+            if spec['requires'] and name not in values:
+                with stage('transform', metric=spec['metric']):
+                    values[name] = load_function(spec['function'])(*dataset_args(spec, values))
+
+    keep = ['fork_archive', 'memory_plan', 'sample'] + metric_datasets(metrics)
+
+    return {name: values[name] for name in keep if name in values}
+
+def query_tags(name, repo_name, org_name):
+    """ Gets the timing tags for a query listed in repo_queries or org_queries
+
+    Parameters
+    ----------
+    name : str
+        the name of the query in repo_queries
+    repo_name : str
+        or None for a query in org_queries
+    org_name : str
+
+    Returns
+    -------
+    tags : dict
+    """
+    from metrics.registry import DATASETS
+
+    tags = {'org': org_name, 'metric': 'repo_info' if name in ['memory_plan', 'sample'] else DATASETS[name]['metric'], 'query': name}
+    if repo_name != None:
+        tags['repo'] = repo_name
+
+    return tags
+
+def run_repo_queries(repo_id, repo_name, org_name, start_date, end_date, engine, memory_budget=None, metrics=None, org_results=None, approximate=None):
+    """ Runs the queries listed in repo_queries one after another, and derives
+    the other datasets from them. The other queries are skipped for archived
+    repos, since no metrics are computed for them.
+
+    Parameters
+    ----------
+    repo_id : str
+    repo_name : str
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    memory_budget : float
+        memory budget for each repo in MB (optional, see utils/memory.py)
+    metrics : list
+        names of the metrics to compute (default to every metric)
+    org_results : dict
+        from run_org_queries, if they have already been run for the org
+        (optional)
+    approximate : int
+        sample the PRs and commits of repos with more rows than this
+        (optional, see utils/approximate.py)
+
+    Returns
+    -------
+    query_results : dict
+        dataset name -> result, with 'memory_plan' -> (plan, estimated bytes)
+        when there is a memory budget, and 'sample' -> the sampling of the
+        datasets that were sampled when approximate is given
+    """
+    from utils.timing import run_tagged
+    from utils.memory import memory_plan
+    from utils.approximate import sample_plan
+
+    queries = repo_queries(repo_id, repo_name, org_name, start_date, end_date, engine, metrics=metrics)
+
+    function, args = queries.pop('fork_archive')
+    query_results = {'fork_archive': run_tagged(query_tags('fork_archive', repo_name, org_name), function, *args)}
+
+    is_forked, is_archived = query_results['fork_archive']
+    if is_archived == True:
+        return query_results
+
+    plan = 'full'
+    if memory_budget != None:
+        query_results['memory_plan'] = run_tagged(query_tags('memory_plan', repo_name, org_name), memory_plan, repo_id, start_date, end_date, engine, memory_budget)
+        plan, estimate = query_results['memory_plan']
+
+    if plan == 'aggregate':
+        queries.pop('commits', None)
+
+    if approximate != None and plan != 'skip':
+        sample = run_tagged(query_tags('sample', repo_name, org_name), sample_plan, repo_id, start_date, end_date, engine, approximate)
+        query_results['sample'] = sampled_rates(sample, queries)
+        sampled = repo_queries(repo_id, repo_name, org_name, start_date, end_date, engine, metrics=metrics, sample=sample)
+        queries = {name: sampled[name] for name in queries}
+
+    if plan != 'skip':
+        for name, (function, args) in queries.items():
+            query_results[name] = run_tagged(query_tags(name, repo_name, org_name), function, *args)
+
+        if org_results == None:
+            org_results = run_org_queries(org_name, start_date, end_date, engine, metrics)
+        query_results = derive_datasets(query_results, org_results, repo_id, repo_name, org_name, start_date, end_date, engine, metrics)
+
+    return query_results
+
+def sampled_rates(sample, queries):
+    """ Keeps the sampling of the datasets that are fetched, since the PRs are
+    not sampled when the summary tables are used, and the commits are not
+    sampled when they are counted in the database
+
+    Parameters
+    ----------
+    sample : dict
+        from sample_plan in utils/approximate.py
+    queries : dict
+        from repo_queries
+
+    Returns
+    -------
+    sample : dict
+    """
+
+    return {'prs': sample['prs'] if 'pull_requests' in queries else 1, 'commits': sample['commits'] if 'commits' in queries else 1}
+
+def iter_repo_queries(repos, org_name, start_date, end_date, engine, in_flight=0, memory_budget=None, ordered=True, metrics=None, approximate=None):
+    """ Runs the queries for each repo in a list, yielding the results one repo
+    at a time in the same order as the list of repos
+
+    Parameters
+    ----------
+    repos : list
+        (repo_id, repo_name) tuples
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    in_flight : int
+        if greater than 0, the queries are run concurrently for up to this
+        many repos at once (see utils/async_gather.py)
+    memory_budget : float
+        memory budget for each repo in MB (optional, see utils/memory.py)
+    ordered : bool
+        if False, with in_flight, each repo is yielded as soon as its
+        queries finish instead of in the order of the list
+    metrics : list
+        names of the metrics to compute (default to every metric)
+    approximate : int
+        sample the PRs and commits of repos with more rows than this
+        (optional, see utils/approximate.py)
+
+    Yields
+    ------
+    repo_id : str
+    repo_name : str
+    query_results : dict
+        query name -> result, or 'error' -> the exception if the queries
+        for the repo failed, so that one repo doesn't stop the others
+    """
+    # The datasets that are the same for every repo are queried once
+    org_results = run_org_queries(org_name, start_date, end_date, engine, metrics)
+
+    if in_flight > 0:
+        from utils.async_gather import iter_org_queries
+        yield from iter_org_queries(repos, org_name, start_date, end_date, engine, in_flight, memory_budget, ordered, metrics, org_results, approximate)
+    else:
+        for repo_id, repo_name in repos:
+            try:
+                query_results = run_repo_queries(repo_id, repo_name, org_name, start_date, end_date, engine, memory_budget, metrics, org_results, approximate)
+            except Exception as e:
+                query_results = {'error': e}
+            yield repo_id, repo_name, query_results
+
+def slice_query_results(query_results, start_date, end_date):
+    """ Narrows the query results for a wider window down to the rows that
+    the queries would have returned for the start date. All windows share
+    the same end date. Only the datasets in query_results are sliced, so the
+    commits are left out if they were counted in the database instead of
+    fetched, along with the datasets of metrics that were not selected.
+
+    Parameters
+    ----------
+    query_results : dict
+        query name -> result, from repo_queries
+    start_date : str
+    end_date : str
+
+    Returns
+    -------
+    window_results : dict
+        query name -> result
+    """
+    from utils.date_calcs import convert_dates
+    from utils.timing import stage
+
+    start_dt, end_dt = convert_dates(start_date, end_date)
+
+    with stage('transform', metric='slice'):
+        window_results = {'fork_archive': query_results['fork_archive']}
+        if 'sample' in query_results:
+            window_results['sample'] = query_results['sample']
+
+        if 'releases' in query_results:
+            releases_df = query_results['releases']
+            window_results['releases'] = releases_df[releases_df['date'] > start_dt].reset_index(drop=True)
+
+        for name in ['prs_all', 'prs_closed']:
+            if name in query_results:
+                window_results[name] = slice_months(query_results[name], start_dt)
+
+        if 'commits' in query_results:
+            commitsDF = query_results['commits']
+            window_results['commits'] = commitsDF[commitsDF['cmt_author_timestamp'] >= start_dt].reset_index(drop=True)
+
+        if 'pr_response' in query_results:
+            pr_response = query_results['pr_response']
+            pr_first_review = query_results['pr_first_review']
+
+            # The reviews are limited to the PRs that are left in pr_response
+            pr_response = pr_response[pr_response['pr_created_at'] > start_dt].reset_index(drop=True)
+            window_results['pr_response'] = pr_response
+            window_results['pr_first_review'] = pr_first_review[pr_first_review['pull_request_id'].isin(pr_response['pull_request_id'])].reset_index(drop=True)
+
+    return window_results
+
+def slice_months(pr_monthDF, start_dt):
+    """ Keeps the months of the monthly_prs_all or monthly_prs_closed data
+    starting with the month of the start date
+
+    Parameters
+    ----------
+    pr_monthDF : dataframe
+    start_dt : datetime
+
+    Returns
+    -------
+    pr_monthDF : dataframe
+    """
+    month_num = pr_monthDF['year'].astype(int) * 12 + pr_monthDF['month'].astype(int)
+
+    return pr_monthDF[month_num >= start_dt.year * 12 + start_dt.month].reset_index(drop=True)
+
+def repo_metric_data(query_results, repo_id, repo_name, org_name, start_date, end_date, engine, bus_days_list, metrics=None):
+    """ Computes the data for the metrics from the datasets gathered for them.
+    If the commits were not fetched, they are counted by author in the
+    database for the window.
+
+    Parameters
+    ----------
+    query_results : dict
+        query name -> result
+    repo_id : str
+    repo_name : str
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    bus_days_list : list
+        numbers of business days (int) for the time to first response
+    metrics : list
+        names of the metrics to compute (default to every metric)
+
+    Returns
+    -------
+    repo_data : dict
+        the results of the *_data function of each metric under 'release',
+        'closure_ratio' and 'bus_factor', and 'first_response' -> dict of
+        bus_days -> results of response_time_data, for the metrics that
+        were computed
+    """
+    from metrics.release_frequency import activity_release_data
+    from metrics.closure_ratio import sustain_prs_by_repo_data
+    from metrics.bus_factor import commit_author_data, commit_author_counts, contributor_risk_data
+    from metrics.first_response import response_time_data, combine_response_times
+    from metrics.registry import METRICS
+    from utils.timing import tagged, stage
+
+    metrics = metrics or list(METRICS)
+    repo_data = {}
+
+    if 'release' in metrics:
+        with stage('transform', metric='release'):
+            repo_data['release'] = activity_release_data(repo_id, repo_name, org_name, start_date, end_date, engine, releases_df=query_results['releases'])
+
+    if 'closure_ratio' in metrics:
+        with stage('transform', metric='closure_ratio'):
+            repo_data['closure_ratio'] = sustain_prs_by_repo_data(repo_id, repo_name, org_name, start_date, end_date, engine, all_prsDF=query_results['prs_all'], closed_prsDF=query_results['prs_closed'])
+
+    if 'bus_factor' in metrics:
+        with tagged(metric='bus_factor'), stage('transform'):
+            if query_results.get('commits') is None:
+                authorDF = commit_author_counts(repo_id, start_date, end_date, engine)
+            else:
+                authorDF = commit_author_data(repo_id, start_date, end_date, engine, commitsDF=query_results['commits'])
+            repo_data['bus_factor'] = contributor_risk_data(repo_id, repo_name, org_name, start_date, end_date, engine, authorDF=authorDF)
+
+    if 'first_response' in metrics:
+        repo_data['first_response'] = {}
+        with stage('transform', metric='first_response'):
+            pr_all = combine_response_times(query_results['pr_response'], query_results['pr_first_review'], repo_name)
+
+            # response_time_data adds columns to pr_all, so each one gets a copy
+            for bus_days in bus_days_list:
+                repo_data['first_response'][bus_days] = response_time_data(repo_id, repo_name, org_name, start_date, end_date, engine, bus_days, pr_all=pr_all.copy())
+
+    return repo_data
@@ -0,0 +1,141 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains functions used to profile and limit the memory used for each
+repo, since a few very large repos can use enough memory to get a run killed.
+
+With memory profiling turned on, tracemalloc records the peak memory of each
+query, transform and render stage along with the timings (see
+utils/timing.py). Memory allocated by Arrow outside of Python, before the
+results are converted to pandas, is not included.
+
+With a memory budget, the number of rows that a repo would fetch is counted
+first, and the memory needed is estimated from it:
+* 'full': the data is fetched as usual
+* 'aggregate': the commits are counted by author in the database instead of
+  fetching every commit (see commit_author_counts in metrics/bus_factor.py)
+* 'skip': no metrics are gathered for the repo, and this is recorded
+"""
+
+# Approximate peak memory needed for each row fetched, in bytes, including
+# the copies made while the data is transformed. These were measured with
+# tracemalloc on data from benchmark/generate.py, rounded up. The process
+# uses more than this (the Arrow buffers, the figures and memory that is
+# freed but not returned), so the budget should leave some room.
+COMMIT_ROW_BYTES = 200
+PR_ROW_BYTES = 250
+
+# Memory needed for a repo in addition to the rows fetched
+REPO_BASE_BYTES = 1024 * 1024
+
+def start_profiling():
+    """ Starts tracing memory allocations with tracemalloc, so that the memory
+    peak of each stage is recorded
+    """
+    import tracemalloc
+
+    tracemalloc.start()
+
+def repo_row_counts(repo_id, start_date, end_date, engine):
+    """ Counts the commits and PRs for a repo that the queries would fetch
+
+    Parameters
+    ----------
+    repo_id : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    num_commits : int
+    num_prs : int
+    """
+    import sqlalchemy as s
+    from utils.fetch import fetch_df
+
+    count_query = s.sql.text(f"""
+                    SELECT
+                        (SELECT COUNT(*) FROM commits
+                            WHERE commits.repo_id = {repo_id}
+                            AND commits.cmt_author_timestamp >= {start_date}
+                            AND commits.cmt_author_timestamp <= {end_date}) AS num_commits,
+                        (SELECT COUNT(*) FROM pull_requests
+                            WHERE pull_requests.repo_id = {repo_id}
+                            AND pull_requests.pr_created_at >= {start_date}) AS num_prs
+                    """)
+
+    countDF = fetch_df(count_query, engine)
+
+    num_commits = int(countDF['num_commits'].iloc[0])
+    num_prs = int(countDF['num_prs'].iloc[0])
+
+    return num_commits, num_prs
+
+def memory_plan(repo_id, start_date, end_date, engine, budget_mb):
+    """ Decides how to gather the data for a repo within a memory budget
+
+    Parameters
+    ----------
+    repo_id : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    budget_mb : float
+        memory budget for each repo in MB
+
+    Returns
+    -------
+    plan : str
+        'full', 'aggregate' or 'skip'
+    estimate : int
+        estimated bytes needed for the plan, or for the 'aggregate' plan if
+        the repo is skipped
+    """
+    num_commits, num_prs = repo_row_counts(repo_id, start_date, end_date, engine)
+
+    budget = budget_mb * 1024 * 1024
+    aggregate_estimate = REPO_BASE_BYTES + num_prs * PR_ROW_BYTES
+    full_estimate = aggregate_estimate + num_commits * COMMIT_ROW_BYTES
+
+    if full_estimate <= budget:
+        return 'full', full_estimate
+    elif aggregate_estimate <= budget:
+        return 'aggregate', aggregate_estimate
+    else:
+        return 'skip', aggregate_estimate
+
+def print_memory_summary(budget_mb=None, top=5):
+    """ Prints the repos and stages with the highest memory peaks, and the
+    repos that were over the memory budget or skipped, from the records
+    folded so far (see fold_records in utils/timing.py)
+
+    Parameters
+    ----------
+    budget_mb : float
+        memory budget for each repo in MB (optional), which the repos over
+        it were found with when they were folded
+    top : int
+        the number of repos and stages to print
+    """
+    from utils.timing import get_totals
+
+    mb = 1024 * 1024
+    totals = get_totals()
+    stage_peaks = {' / '.join(key): stage_totals['memory_peak_bytes'] for key, stage_totals in totals['stages'].items() if 'memory_peak_bytes' in stage_totals}
+
+    if stage_peaks:
+        print('\nHighest memory peaks (stage / metric):')
+        for key in sorted(stage_peaks, key=stage_peaks.get, reverse=True)[:top]:
+            print('  {:<32} {:>9.1f} MB'.format(key, stage_peaks[key] / mb))
+
+    if totals['highest']:
+        print('Highest memory peaks (repo):')
+        for peak, repo in totals['highest'][:top]:
+            print('  {:<32} {:>9.1f} MB'.format(repo, peak / mb))
+
+        if budget_mb != None and totals['over_budget']:
+            print('Over the memory budget of', budget_mb, 'MB:', ', '.join(totals['over_budget']))
+
+    if totals['skipped']:
+        print('Skipped to stay within the memory budget:', ', '.join(totals['skipped']))
@@ -0,0 +1,161 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains the functions that keep a template figure for each kind of
+graph, so that the plotting style is set up and each figure is built once in
+a run instead of for every repo.
+
+Each metric has a *_template function that sets up the parts of its graph
+that are the same for every repo on a set of axes, like the locators, the
+axis labels and the lines with their legend, and an *_update function that
+puts the data for a repo into them: the data of the lines or bars, the
+ticks, the limits, the title and the interpretation. The figure is kept and
+drawn again with the next repo's data, which takes a fraction of the time of
+building a new figure and drawing it with seaborn, and the graphs look the
+same (see benchmark/charts.py).
+
+The template figures are not thread safe, so graphs are drawn in one thread
+at a time. The service holds a lock while it draws them.
+"""
+
+# The figures kept for each kind of graph, by name
+_templates = {}
+
+_style_set = False
+
+def setup_style():
+    """ Sets up matplotlib and the seaborn style used by every graph, the
+    first time it is called in a process
+    """
+    global _style_set
+    import matplotlib
+    import seaborn as sns
+
+    if _style_set:
+        return
+
+    matplotlib.use('Agg') #prevents from tying to send plot to screen
+    sns.set(style="whitegrid", font_scale=2)
+    _style_set = True
+
+def figure_template(name, create):
+    """ Gets the template figure for a kind of graph, building it the first
+    time
+
+    Parameters
+    ----------
+    name : str or tuple
+        the kind of graph, like 'release_frequency'
+    create : function
+        builds the figure and returns the template, a dict with the figure
+        as 'fig' and whatever the *_update functions need
+
+    Returns
+    -------
+    template : dict
+    """
+    setup_style()
+
+    if name not in _templates:
+        _templates[name] = create()
+
+    return _templates[name]
+
+def metric_template(name, template_function, size=(24, 8)):
+    """ Gets the template figure for a graph of one metric
+
+    Parameters
+    ----------
+    name : str
+    template_function : function
+        the metric's *_template function
+    size : tuple
+        width and height of the figure in inches (default to the size of A4
+        paper)
+
+    Returns
+    -------
+    template : dict
+        from the *_template function, with the figure as 'fig'
+    """
+    import matplotlib.pyplot as plt
+
+    def create():
+        fig, ax = plt.subplots()
+        fig.set_size_inches(*size)
+        return dict(template_function(ax), fig=fig)
+
+    return figure_template(name, create)
+
+def clear_templates():
+    """ Closes every template figure, so that the next graphs are drawn on
+    new ones
+    """
+    import matplotlib.pyplot as plt
+
+    for template in _templates.values():
+        plt.close(template['fig'])
+    _templates.clear()
+
+def line_chart_template(ax, labels, title_size=30):
+    """ Sets up a graph of the total PRs for each month, with a second line
+    for the PRs that were closed or responded to, like the graphs drawn by
+    sns.lineplot
+
+    Parameters
+    ----------
+    ax : matplotlib axes
+    labels : list
+        legend labels of the two lines
+    title_size : int
+        font size of the title
+
+    Returns
+    -------
+    template : dict
+    """
+    from matplotlib.ticker import MaxNLocator
+
+    ax.yaxis.set_major_locator(MaxNLocator(integer=True))
+
+    total_line, = ax.plot([], [], color='black', label=labels[0], linewidth=2.5)
+    second_line, = ax.plot([], [], color='green', label=labels[1], linewidth=2.5, linestyle='dashed')
+    ax.legend()
+
+    ax.set_ylabel('Number of PRs')
+
+    return {'ax': ax, 'lines': [total_line, second_line], 'title_size': title_size}
+
+def line_chart_update(template, months, values, labels, title, xlabel):
+    """ Puts the monthly values for a repo into a graph from
+    line_chart_template
+
+    Parameters
+    ----------
+    template : dict
+    months : series
+        the yearmonth of each value
+    values : list
+        the series of values for each of the two lines
+    labels : list
+        legend labels of the two lines
+    title : str
+    xlabel : str
+    """
+    import numpy as np
+
+    ax = template['ax']
+    positions = np.arange(len(months))
+
+    for line, line_values, label, legend_text in zip(template['lines'], values, labels, ax.get_legend().get_texts()):
+        line.set_data(positions, list(line_values))
+        line.set_label(label)
+        legend_text.set_text(label)
+
+    ax.set_xticks(positions)
+    ax.set_xticklabels(list(months), rotation=45)
+    ax.relim()
+    ax.autoscale_view()
+
+    ax.set_title(title, fontsize=template['title_size'])
+    ax.set_xlabel(xlabel)
@@ -4,6 +4,9 @@
 """ Contains functions that gather basic information about repositories.
 """
 
+# Repos fetched at once by iter_org_repos
+REPO_BATCH_SIZE = 1000
+
 def get_repo_info(engine, repo_org, repo_name):
     """Retrieves the Augur repo_id (unique key) for a GitHub org/repo combination.
 
@@ -18,7 +21,7 @@ def get_repo_info(engine, repo_org, repo_name):
     repo_id : str
     """
     import sys
-    import pandas as pd
+    from utils.fetch import fetch_rows
 
     try:
         get_id_query = f"""
@@ -32,14 +35,14 @@ def get_repo_info(engine, repo_org, repo_name):
                 AND LOWER(repo_groups.rg_name) = LOWER('{repo_org}');
             """
 
-        repo_id_df = pd.read_sql_query(get_id_query, con=engine)
+        repo_id_rows = fetch_rows(get_id_query, engine)
 
     except:
         print("Missing or invalid GitHub organization and repository name combination.")
         sys.exit()
 
-    if len(repo_id_df) == 1:
-        repo_id = repo_id_df.repo_id[0]
+    if len(repo_id_rows) == 1:
+        repo_id = repo_id_rows[0][0]
     else:
         print("Missing or invalid GitHub organization and repository name combination.")
         sys.exit()
@@ -62,6 +65,7 @@ def fork_archive(repo_name_orig, org_name, engine):
     """
 
     import pandas as pd
+    from utils.fetch import fetch_df
 
     repo_git = "'" + 'https://github.com/' + org_name + '/' + repo_name_orig + "'"
     repo_name = "'" + repo_name_orig + "'"
@@ -72,7 +76,7 @@ def fork_archive(repo_name_orig, org_name, engine):
             WHERE repo_name = {repo_name}
             AND repo_git = {repo_git}
             """
-    repo_df = pd.read_sql_query(repo_df_query, con=engine)
+    repo_df = fetch_df(repo_df_query, engine)
     forked = repo_df.forked_from[0]
     archived = repo_df.repo_archived[0]
     
@@ -90,6 +94,67 @@ def fork_archive(repo_name_orig, org_name, engine):
 
     return is_forked, is_archived
 
+def iter_org_repos(org_name, engine, batch_size=REPO_BATCH_SIZE):
+    """Retrieves the Augur repo_id (unique key) and repo_name for all repos in
+       a GitHub org in batches, ordered by repo_id, without loading pandas.
+
+       Each batch is fetched with keyset pagination: it starts after the last
+       repo_id of the batch before, instead of using OFFSET, so every query
+       reads just its batch from the repo_id index and only one batch is held
+       in memory, however many repos there are.
+
+    Parameters
+    ----------
+    org_name : str
+    engine : sqlalchemy database object
+    batch_size : int
+        the number of repos in each batch
+
+    Yields
+    ------
+    batch : list
+        (repo_id, repo_name) tuples
+    """
+    from utils.fetch import fetch_rows
+
+    after = ''
+    while True:
+        repo_info_query = f"""
+            SELECT
+            repo.repo_id, repo.repo_name
+            FROM
+            repo, repo_groups
+            WHERE
+                repo_groups.repo_group_id = repo.repo_group_id AND
+                rg_name = '{org_name}'{after}
+            ORDER BY repo.repo_id
+            LIMIT {batch_size};
+                """
+        batch = fetch_rows(repo_info_query, engine)
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+        after = f""" AND
+                repo.repo_id > {batch[-1][0]}"""
+
+def get_org_repo_list(org_name, engine):
+    """Retrieves the Augur repo_id (unique key) and repo_name for all repos in
+       a GitHub org as a list, without loading pandas.
+
+    Parameters
+    ----------
+    org_name : str
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    repo_list : list
+        (repo_id, repo_name) tuples, ordered by repo_id
+    """
+
+    return [repo for batch in iter_org_repos(org_name, engine) for repo in batch]
+
 def get_org_repos(org_name, engine):
     """Retrieves the Augur repo_id (unique key) and repo_name for all repos in
        a GitHub org and stores them in a dataframe to return.
@@ -105,15 +170,6 @@ def get_org_repos(org_name, engine):
     """
     import pandas as pd
 
-    repo_info_query = f"""
-        SELECT
-        repo.repo_id, repo.repo_name
-        FROM
-        repo, repo_groups
-        WHERE
-            repo_groups.repo_group_id = repo.repo_group_id AND
-            rg_name = '{org_name}';
-            """
-    repoDF = pd.read_sql_query(repo_info_query, con=engine)
+    repoDF = pd.DataFrame(get_org_repo_list(org_name, engine), columns=['repo_id', 'repo_name'])
 
-    return repoDF
\ No newline at end of file
+    return repoDF
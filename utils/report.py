@@ -0,0 +1,426 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains the functions for the report output of health_by_repo.py
+(--charts report), which saves the data behind each graph instead of
+drawing the graphs as png files.
+
+The data for each repo is saved as a small JSON file in the repo folder,
+from the same *_data results used for the graphs. At the end of the run,
+the files for the repos in the org are combined into _org_name_report.json
+and a single static page, _org_name_report.html, that draws the graphs in
+the browser. The page holds the data and the few lines of JavaScript that
+draw the graphs as SVG, so it can be opened from disk or copied anywhere
+without a server or an internet connection.
+"""
+
+def release_report(data):
+    """ Gets the values needed to draw the release frequency graph
+
+    Parameters
+    ----------
+    data : tuple
+        results of activity_release_data
+
+    Returns
+    -------
+    report : dict
+    """
+    error_num, error_text, releases_df, start_dt, end_dt, title, interpretation, release_num = data
+
+    if error_num == -1:
+        return {'error': 'No releases in the past 6 months', 'value': '0'}
+
+    return {'title': title, 'interpretation': interpretation, 'value': str(release_num),
+        'start': str(start_dt.date()), 'end': str(end_dt.date()),
+        'dates': [str(date)[:10] for date in releases_df['date']]}
+
+def closure_ratio_report(data):
+    """ Gets the values needed to draw the change request closure ratio graph
+
+    Parameters
+    ----------
+    data : tuple
+        results of sustain_prs_by_repo_data
+
+    Returns
+    -------
+    report : dict
+    """
+    error_num, error_text, pr_sustainDF, title, interpretation, month_num = data
+
+    if error_num == -1:
+        return {'error': 'Too few PRs to calculate', 'value': 'Too Few PRs'}
+
+    return {'title': title, 'interpretation': interpretation, 'value': str(month_num),
+        'months': [str(month) for month in pr_sustainDF['yearmonth']],
+        'series': {'Total': [int(x) for x in pr_sustainDF['all_total']], 'Closed': [int(x) for x in pr_sustainDF['closed_total']]}}
+
+def bus_factor_report(data):
+    """ Gets the values needed to draw the bus factor graph
+
+    Parameters
+    ----------
+    data : tuple
+        results of contributor_risk_data
+
+    Returns
+    -------
+    report : dict
+    """
+    error_num, error_text, names, percents, commits, title, interpretation, num_people = data
+
+    if error_num == -1:
+        return {'error': 'Not enough commits to calculate', 'value': 'Error'}
+
+    return {'title': title, 'interpretation': interpretation, 'value': str(num_people),
+        'names': [name.replace('\n', '') for name in names], 'commits': [int(x) for x in commits],
+        'percents': [float(x) for x in percents]}
+
+def first_response_report(data, bus_days):
+    """ Gets the values needed to draw the time to first response graph
+
+    Parameters
+    ----------
+    data : tuple
+        results of response_time_data
+    bus_days : int
+
+    Returns
+    -------
+    report : dict
+    """
+    error_num, error_text, first_response, title, interpretation, month_num = data
+
+    if error_num == -1:
+        return {'error': 'Too few PRs to calculate', 'value': 'Too Few PRs'}
+
+    return {'title': title, 'interpretation': interpretation, 'value': str(month_num),
+        'months': [str(month) for month in first_response['yearmonth']],
+        'series': {'Total': [int(x) for x in first_response['total_prs']],
+            'Response < ' + str(bus_days) + ' bus days': [int(x) for x in first_response['in_guidelines']]}}
+
+def window_report(repo_data, years, start_date, end_date, bus_days_list):
+    """ Gets the values needed to draw every graph for one window
+
+    Parameters
+    ----------
+    repo_data : dict
+        from repo_metric_data in utils/gather.py
+    years : int
+    start_date : str
+    end_date : str
+    bus_days_list : list
+
+    Returns
+    -------
+    report : dict
+    """
+    metrics = {}
+
+    if 'release' in repo_data:
+        metrics['release'] = release_report(repo_data['release'])
+    if 'closure_ratio' in repo_data:
+        metrics['closure_ratio'] = closure_ratio_report(repo_data['closure_ratio'])
+    if 'bus_factor' in repo_data:
+        metrics['bus_factor'] = bus_factor_report(repo_data['bus_factor'])
+    if 'first_response' in repo_data:
+        metrics['first_response'] = {str(bus_days): first_response_report(repo_data['first_response'][bus_days], bus_days) for bus_days in bus_days_list}
+
+    return {'years': years, 'start_date': start_date.strip("'"), 'end_date': end_date.strip("'"), 'metrics': metrics}
+
+def report_filename(repo_name, org_name):
+    """ Creates the filename of the report data for a repo
+
+    Parameters
+    ----------
+    repo_name : str
+    org_name : str
+
+    Returns
+    -------
+    filename : str
+    """
+    from utils.file_operations import output_path
+
+    return output_path(repo_name, org_name) + '/' + repo_name + '_report.json'
+
+def write_repo_report(repo_name, org_name, is_forked, is_archived, windows):
+    """ Saves the report data for a repo
+
+    Parameters
+    ----------
+    repo_name : str
+    org_name : str
+    is_forked : bool
+    is_archived : bool
+    windows : list
+        from window_report, one for each window
+
+    Returns
+    -------
+    filename : str
+    """
+    import json
+    from utils.file_operations import write_atomic
+
+    report = {'repo': repo_name, 'forked': bool(is_forked), 'archived': bool(is_archived), 'windows': windows}
+
+    def write(tmp_filename):
+        with open(tmp_filename, 'w') as f:
+            json.dump(report, f, separators=(',', ':'))
+
+    filename = report_filename(repo_name, org_name)
+    write_atomic(filename, write)
+
+    return filename
+
+def write_org_report(org_name, repo_names):
+    """ Combines the report data for the repos in an org, including repos that
+    were finished by an earlier run that was resumed, and saves it with the
+    page that draws it
+
+    Parameters
+    ----------
+    org_name : str
+    repo_names : list
+        the repos in the org, in the order they are listed in the report
+
+    Returns
+    -------
+    json_filename : str
+    html_filename : str
+    """
+    import html
+    import json
+    import os
+    from utils.file_operations import create_path_str, write_atomic
+
+    repos = []
+    for repo_name in repo_names:
+        filename = report_filename(repo_name, org_name)
+        if os.path.exists(filename):
+            with open(filename) as f:
+                repos.append(json.load(f))
+
+    report_json = json.dumps({'org': org_name, 'repos': repos}, separators=(',', ':'))
+
+    path = create_path_str(org_name)
+    json_filename = path + '/_' + org_name + '_report.json'
+    html_filename = path + '/_' + org_name + '_report.html'
+
+    def write_json(tmp_filename):
+        with open(tmp_filename, 'w') as f:
+            f.write(report_json)
+
+    # The data is also put in the page, so that it can be opened from disk,
+    # where browsers don't let a page load other files. '</' is escaped so
+    # the data can't end the script element.
+    page = REPORT_PAGE.replace('{{title}}', html.escape(org_name)).replace('{{data}}', report_json.replace('</', '<\\/'))
+
+    def write_html(tmp_filename):
+        with open(tmp_filename, 'w') as f:
+            f.write(page)
+
+    write_atomic(json_filename, write_json)
+    write_atomic(html_filename, write_html)
+
+    return json_filename, html_filename
+
+# The page for the org report. It lists the repos with the values in the
+# summary CSVs, and draws the graphs for a repo as SVG when it is selected.
+REPORT_PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{{title}} - Starter Project Health Metrics</title>
+<style>
+body { font-family: sans-serif; margin: 0; display: flex; height: 100vh; color: #222; }
+#side { width: 22em; overflow-y: auto; border-right: 1px solid #ccc; padding: 0.5em; box-sizing: border-box; }
+#main { flex: 1; overflow-y: auto; padding: 1em; }
+#filter { width: 100%; box-sizing: border-box; margin-bottom: 0.5em; }
+table { border-collapse: collapse; width: 100%; font-size: 0.85em; }
+td, th { padding: 0.2em 0.3em; text-align: left; border-bottom: 1px solid #eee; }
+tr.repo { cursor: pointer; }
+tr.repo:hover, tr.selected { background: #e8f0fe; }
+.charts { display: grid; grid-template-columns: repeat(auto-fit, minmax(560px, 1fr)); gap: 1em; }
+.chart { border: 1px solid #ddd; padding: 0.5em; }
+.chart h3 { font-size: 0.95em; white-space: pre-line; text-align: center; margin: 0.3em 0; }
+.chart p { font-size: 0.85em; white-space: pre-line; text-align: center; color: #555; }
+.error { color: #888; text-align: center; padding: 3em 0; }
+svg text { font-size: 11px; fill: #333; }
+svg .grid { stroke: #ddd; }
+</style>
+</head>
+<body>
+<div id="side">
+<h2 id="org"></h2>
+<label>Years <select id="years"></select></label>
+<label>Business days <select id="bus_days"></select></label>
+<input id="filter" placeholder="Filter repos">
+<table><thead><tr><th>Repo</th><th title="Releases in the past 6 months">Rel</th><th title="Months with slow first responses">Resp</th><th title="Months with a closure ratio gap">Clos</th><th title="Bus factor">Bus</th></tr></thead><tbody id="repos"></tbody></table>
+</div>
+<div id="main"></div>
+<script id="report-data" type="application/json">{{data}}</script>
+<script>
+var report = JSON.parse(document.getElementById('report-data').textContent);
+var SVG = 'http://www.w3.org/2000/svg';
+var W = 560, H = 280, M = {left: 45, right: 10, top: 10, bottom: 55};
+var selected = null;
+
+function el(name, attrs, parent, text) {
+  var node = document.createElementNS(SVG, name);
+  for (var key in attrs) node.setAttribute(key, attrs[key]);
+  if (text !== undefined) node.textContent = text;
+  if (parent) parent.appendChild(node);
+  return node;
+}
+
+function niceMax(value) {
+  if (value <= 0) return 1;
+  var step = Math.pow(10, Math.floor(Math.log10(value)));
+  return Math.ceil(value / step) * step;
+}
+
+function yAxis(svg, max) {
+  for (var i = 0; i <= 4; i++) {
+    var y = H - M.bottom - (H - M.top - M.bottom) * i / 4;
+    el('line', {x1: M.left, x2: W - M.right, y1: y, y2: y, 'class': 'grid'}, svg);
+    el('text', {x: M.left - 5, y: y + 4, 'text-anchor': 'end'}, svg, Math.round(max * i / 4));
+  }
+}
+
+function xLabel(svg, x, text) {
+  el('text', {x: x, y: H - M.bottom + 12, transform: 'rotate(45 ' + x + ' ' + (H - M.bottom + 12) + ')'}, svg, text);
+}
+
+function lineChart(svg, chart) {
+  var names = Object.keys(chart.series), colors = ['black', 'green'];
+  var max = niceMax(Math.max.apply(null, [].concat.apply([], names.map(function (n) { return chart.series[n]; }))));
+  var n = chart.months.length, step = (W - M.left - M.right) / Math.max(n - 1, 1);
+  yAxis(svg, max);
+  chart.months.forEach(function (month, i) { xLabel(svg, M.left + i * step, month); });
+  names.forEach(function (name, s) {
+    var points = chart.series[name].map(function (v, i) {
+      return (M.left + i * step) + ',' + (H - M.bottom - (H - M.top - M.bottom) * v / max);
+    });
+    el('polyline', {points: points.join(' '), fill: 'none', stroke: colors[s], 'stroke-width': 2, 'stroke-dasharray': s ? '6 4' : ''}, svg);
+    el('line', {x1: W - 190, x2: W - 165, y1: M.top + 10 + s * 15, y2: M.top + 10 + s * 15, stroke: colors[s], 'stroke-width': 2, 'stroke-dasharray': s ? '6 4' : ''}, svg);
+    el('text', {x: W - 160, y: M.top + 14 + s * 15}, svg, name);
+  });
+}
+
+function barChart(svg, chart) {
+  var max = niceMax(Math.max.apply(null, chart.commits) * 1.1);
+  var n = chart.names.length, slot = (W - M.left - M.right) / n;
+  yAxis(svg, max);
+  chart.names.forEach(function (name, i) {
+    var h = (H - M.top - M.bottom) * chart.commits[i] / max, x = M.left + i * slot;
+    el('rect', {x: x + slot * 0.1, y: H - M.bottom - h, width: slot * 0.8, height: h, fill: 'hsl(' + (i * 47) + ',45%,55%)'}, svg);
+    el('text', {x: x + slot / 2, y: H - M.bottom - h - 4, 'text-anchor': 'middle'}, svg, Math.round(chart.percents[i] * 100) + '%');
+    xLabel(svg, x + slot * 0.3, name);
+  });
+}
+
+function releaseChart(svg, chart) {
+  var start = Date.parse(chart.start), end = Date.parse(chart.end), y = (H - M.bottom + M.top) / 2;
+  var scale = function (date) { return M.left + (W - M.left - M.right) * (Date.parse(date) - start) / (end - start); };
+  el('line', {x1: M.left, x2: W - M.right, y1: y, y2: y, 'class': 'grid'}, svg);
+  var month = new Date(start);
+  while (month.getTime() <= end) {
+    var label = month.toISOString().slice(0, 7), x = scale(label + '-01');
+    el('line', {x1: x, x2: x, y1: M.top, y2: H - M.bottom, 'class': 'grid'}, svg);
+    xLabel(svg, x, label);
+    month.setUTCMonth(month.getUTCMonth() + 1);
+  }
+  chart.dates.forEach(function (date) {
+    el('text', {x: scale(date), y: y + 5, 'text-anchor': 'middle', fill: '#4c72b0', style: 'font-size: 16px; font-weight: bold'}, svg, '\\u2716');
+  });
+}
+
+function drawChart(parent, chart, draw) {
+  var box = document.createElement('div');
+  box.className = 'chart';
+  parent.appendChild(box);
+  if (chart.error) {
+    box.innerHTML = '<div class="error"></div>';
+    box.firstChild.textContent = chart.error;
+    return;
+  }
+  var title = document.createElement('h3');
+  title.textContent = chart.title;
+  box.appendChild(title);
+  draw(el('svg', {viewBox: '0 0 ' + W + ' ' + H, width: '100%'}, box), chart);
+  var note = document.createElement('p');
+  note.textContent = chart.interpretation;
+  box.appendChild(note);
+}
+
+function currentWindow(repo) {
+  var years = document.getElementById('years').value;
+  return repo.windows.filter(function (w) { return String(w.years) === years; })[0];
+}
+
+function showRepo(repo) {
+  selected = repo;
+  var main = document.getElementById('main');
+  main.innerHTML = '';
+  var heading = document.createElement('h2');
+  heading.textContent = report.org + ' / ' + repo.repo + (repo.forked ? ' (forked)' : '') + (repo.archived ? ' (archived)' : '');
+  main.appendChild(heading);
+  var w = currentWindow(repo);
+  if (!w) {
+    main.appendChild(document.createTextNode(repo.archived ? 'The metrics are not computed for archived repos.' : 'No data for this window.'));
+    return;
+  }
+  var charts = document.createElement('div');
+  charts.className = 'charts';
+  main.appendChild(charts);
+  var m = w.metrics, bd = document.getElementById('bus_days').value;
+  if (m.release) drawChart(charts, m.release, releaseChart);
+  if (m.closure_ratio) drawChart(charts, m.closure_ratio, lineChart);
+  if (m.bus_factor) drawChart(charts, m.bus_factor, barChart);
+  if (m.first_response && m.first_response[bd]) drawChart(charts, m.first_response[bd], lineChart);
+  listRepos();
+}
+
+function listRepos() {
+  var tbody = document.getElementById('repos'), filter = document.getElementById('filter').value.toLowerCase();
+  var bd = document.getElementById('bus_days').value;
+  tbody.innerHTML = '';
+  report.repos.forEach(function (repo) {
+    if (repo.repo.toLowerCase().indexOf(filter) < 0) return;
+    var w = currentWindow(repo), m = w ? w.metrics : {};
+    var cells = [repo.repo, m.release ? m.release.value : '', m.first_response && m.first_response[bd] ? m.first_response[bd].value : '',
+      m.closure_ratio ? m.closure_ratio.value : '', m.bus_factor ? m.bus_factor.value : ''];
+    var row = document.createElement('tr');
+    row.className = 'repo' + (repo === selected ? ' selected' : '');
+    cells.forEach(function (text) { var td = document.createElement('td'); td.textContent = text; row.appendChild(td); });
+    row.onclick = function () { showRepo(repo); };
+    tbody.appendChild(row);
+  });
+}
+
+function fillSelect(id, values) {
+  var select = document.getElementById(id);
+  values.forEach(function (value) { var option = document.createElement('option'); option.textContent = value; select.appendChild(option); });
+  select.onchange = function () { if (selected) showRepo(selected); else listRepos(); };
+}
+
+var years = {}, busDays = {};
+report.repos.forEach(function (repo) {
+  repo.windows.forEach(function (w) {
+    years[w.years] = true;
+    Object.keys(w.metrics.first_response || {}).forEach(function (bd) { busDays[bd] = true; });
+  });
+});
+document.getElementById('org').textContent = report.org;
+fillSelect('years', Object.keys(years).sort(function (a, b) { return a - b; }));
+fillSelect('bus_days', Object.keys(busDays).sort(function (a, b) { return a - b; }));
+document.getElementById('filter').oninput = listRepos;
+listRepos();
+if (report.repos.length) showRepo(report.repos[0]);
+</script>
+</body>
+</html>
+"""
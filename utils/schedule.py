@@ -0,0 +1,298 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains functions that schedule the repos of an org run by cost, so that
+one very large repo picked up at the end of a run doesn't leave it waiting on
+that repo alone.
+
+The cost of each repo is estimated up front from the number of PRs, PR
+comments and commits in the window, counted for each batch of repos (see
+iter_org_repos in utils/repo_info.py) with one grouped query, or taken from
+the cost measured for the repo in earlier runs. The repos of each batch are
+dispatched largest first (longest processing time first) to the
+repos being gathered at once (see utils/async_gather.py), and each repo is
+handed to the main thread as soon as its data is ready, so a slot that frees
+up takes the next repo instead of waiting on a larger one.
+
+The measured cost of each repo, in seconds of work across all stages (see
+utils/timing.py), is saved in output/repo_costs/org_name.json as the repos
+of each batch finish.
+"""
+
+# Approximate seconds of work for a repo, and for each row counted, used
+# until there is a history of measured costs. These were fitted to timings
+# of data from benchmark/generate.py on SQLite. Drawing the graphs takes
+# about the same time for every repo, so it is part of the base.
+REPO_BASE_SECONDS = 11.0
+COMMIT_SECONDS = 0.000005
+PR_SECONDS = 0.00005
+MESSAGE_SECONDS = 0.00001
+
+def repo_costs_query(repo_ids, start_date, end_date):
+    """ Builds the query that counts the commits, PRs and PR comments in the
+    window for every repo at once
+
+    Parameters
+    ----------
+    repo_ids : list
+    start_date : str
+    end_date : str
+
+    Returns
+    -------
+    query : str
+    """
+    repo_list = ', '.join(str(repo_id) for repo_id in repo_ids)
+
+    query = f"""
+            SELECT repo.repo_id,
+                COALESCE(commit_counts.num_commits, 0) AS num_commits,
+                COALESCE(pr_counts.num_prs, 0) AS num_prs,
+                COALESCE(message_counts.num_messages, 0) AS num_messages
+            FROM repo
+            LEFT JOIN (
+                SELECT repo_id, COUNT(*) AS num_commits
+                FROM commits
+                WHERE repo_id IN ({repo_list})
+                AND cmt_author_timestamp >= {start_date}
+                AND cmt_author_timestamp <= {end_date}
+                GROUP BY repo_id
+            ) commit_counts ON commit_counts.repo_id = repo.repo_id
+            LEFT JOIN (
+                SELECT repo_id, COUNT(*) AS num_prs
+                FROM pull_requests
+                WHERE repo_id IN ({repo_list})
+                AND pr_created_at >= {start_date}
+                GROUP BY repo_id
+            ) pr_counts ON pr_counts.repo_id = repo.repo_id
+            LEFT JOIN (
+                SELECT pull_requests.repo_id, COUNT(*) AS num_messages
+                FROM pull_requests, pull_request_message_ref
+                WHERE pull_requests.pull_request_id = pull_request_message_ref.pull_request_id
+                AND pull_requests.repo_id IN ({repo_list})
+                AND pull_requests.pr_created_at >= {start_date}
+                GROUP BY pull_requests.repo_id
+            ) message_counts ON message_counts.repo_id = repo.repo_id
+            WHERE repo.repo_id IN ({repo_list})
+            """
+
+    return query
+
+def estimate_repo_costs(repos, start_date, end_date, engine):
+    """ Counts the rows for every repo with one query
+
+    Parameters
+    ----------
+    repos : list
+        (repo_id, repo_name) tuples
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    counts : dict
+        repo_id (str) -> {'commits', 'prs', 'messages'}
+    """
+    from utils.fetch import fetch_df
+    from utils.timing import tagged
+
+    if not repos:
+        return {}
+
+    with tagged(metric='schedule'):
+        countDF = fetch_df(repo_costs_query([repo_id for repo_id, repo_name in repos], start_date, end_date), engine)
+
+    counts = {}
+    for row in countDF.itertuples(index=False):
+        counts[str(row.repo_id)] = {'commits': int(row.num_commits), 'prs': int(row.num_prs), 'messages': int(row.num_messages)}
+
+    return counts
+
+def row_seconds(count):
+    """ Estimates the seconds of work for a repo from its row counts
+
+    Parameters
+    ----------
+    count : dict
+        {'commits', 'prs', 'messages'}
+
+    Returns
+    -------
+    seconds : float
+    """
+
+    return REPO_BASE_SECONDS + count['commits'] * COMMIT_SECONDS + count['prs'] * PR_SECONDS + count['messages'] * MESSAGE_SECONDS
+
+def history_filename(org_name):
+    """ Creates the filename where the measured costs of the repos in an org
+    are kept between runs
+
+    Parameters
+    ----------
+    org_name : str
+
+    Returns
+    -------
+    filename : str
+    """
+    from os.path import dirname, join
+    from pathlib import Path
+
+    current_dir = dirname(dirname(__file__)) # the double dirname is equivalent to ../
+    path = join(current_dir, 'output', 'repo_costs')
+    Path(path).mkdir(parents=True, exist_ok=True)
+
+    return join(path, org_name + '.json')
+
+def read_cost_history(org_name):
+    """ Reads the costs measured for the repos of an org in earlier runs
+
+    Parameters
+    ----------
+    org_name : str
+
+    Returns
+    -------
+    history : dict
+        repo_id (str) -> {'seconds', 'commits', 'prs', 'messages'}
+    """
+    import json
+    from os.path import exists
+
+    filename = history_filename(org_name)
+    if not exists(filename):
+        return {}
+
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+def schedule_repos(repos, org_name, start_date, end_date, engine):
+    """ Orders the repos largest first by their measured or estimated cost
+
+    The measured cost of a repo is scaled by how much its rows have changed
+    since it was measured. Repos without history are estimated from their
+    rows, with the seconds per row from the history of the other repos when
+    there is one, so that measured and estimated costs can be compared.
+
+    Parameters
+    ----------
+    repos : list
+        (repo_id, repo_name) tuples
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    scheduled : list
+        (repo_id, repo_name) tuples, largest first
+    costs : dict
+        repo_id (str) -> {'repo_name', 'seconds', 'commits', 'prs', 'messages',
+        'measured'} with the seconds predicted for the repo
+    """
+    counts = estimate_repo_costs(repos, start_date, end_date, engine)
+    history = read_cost_history(org_name)
+
+    # How far the measured costs are from the estimates, on average
+    measured = [repo_key for repo_key in history if repo_key in counts]
+    scale = 1.0
+    if measured:
+        scale = sum(history[repo_key]['seconds'] for repo_key in measured) / sum(row_seconds(history[repo_key]) for repo_key in measured)
+
+    costs = {}
+    for repo_id, repo_name in repos:
+        repo_key = str(repo_id)
+        count = counts.get(repo_key, {'commits': 0, 'prs': 0, 'messages': 0})
+
+        if repo_key in history:
+            seconds = history[repo_key]['seconds'] * row_seconds(count) / row_seconds(history[repo_key])
+        else:
+            seconds = row_seconds(count) * scale
+
+        costs[repo_key] = {'repo_name': repo_name, 'seconds': seconds, **count, 'measured': repo_key in history}
+
+    scheduled = sorted(repos, key=lambda repo: costs[str(repo[0])]['seconds'], reverse=True)
+
+    return scheduled, costs
+
+def schedule_batches(repo_batches, org_name, start_date, end_date, engine, costs):
+    """ Orders each batch of repos largest first, for runs that go through an
+    org in batches (see iter_org_repos in utils/repo_info.py), so that the
+    rows are counted for one batch at a time
+
+    Parameters
+    ----------
+    repo_batches : iterable
+        lists of (repo_id, repo_name) tuples
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    costs : dict
+        updated with the costs of the repos in each batch, from
+        schedule_repos, which are removed by the caller as the repos
+        finish (see record_costs)
+
+    Yields
+    ------
+    scheduled : list
+        the repos in a batch, largest first
+    """
+    for batch in repo_batches:
+        scheduled, batch_costs = schedule_repos(batch, org_name, start_date, end_date, engine)
+        print_schedule(scheduled, batch_costs)
+        costs.update(batch_costs)
+        yield scheduled
+
+def record_costs(org_name, measured):
+    """ Saves the cost measured for each repo, in seconds of work across all
+    stages, with its row counts. Repos that were not run keep their earlier
+    costs. This is called for each batch of repos as they finish, so that
+    the costs are not all kept until the end of the run.
+
+    Parameters
+    ----------
+    org_name : str
+    measured : dict
+        repo_id (str) -> the repo's cost from schedule_repos, with the
+        seconds measured for it
+    """
+    import json
+    import os
+
+    history = read_cost_history(org_name)
+    for repo_key, cost in measured.items():
+        history[repo_key] = {'repo_name': cost['repo_name'], 'seconds': round(cost['seconds'], 3),
+            'commits': cost['commits'], 'prs': cost['prs'], 'messages': cost['messages']}
+
+    filename = history_filename(org_name)
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(history, f, indent=2, sort_keys=True)
+    os.replace(tmp_filename, filename)
+
+def print_schedule(scheduled, costs, top=5):
+    """ Prints the largest repos and the expected run time
+
+    Parameters
+    ----------
+    scheduled : list
+        from schedule_repos
+    costs : dict
+        from schedule_repos
+    top : int
+        the number of repos to print
+    """
+    total = sum(cost['seconds'] for cost in costs.values())
+    measured = sum(1 for cost in costs.values() if cost['measured'])
+
+    print('Scheduled', len(scheduled), 'repos largest first,', measured, 'with measured costs from earlier runs')
+    for repo_id, repo_name in scheduled[:top]:
+        cost = costs[str(repo_id)]
+        print('  {:<32} {:>9.1f}s ({} commits, {} PRs, {} comments)'.format(repo_name, cost['seconds'], cost['commits'], cost['prs'], cost['messages']))
+    print('Expected total work: {:.1f}s'.format(total))
@@ -0,0 +1,450 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains the functions behind metrics_service.py, a long running HTTP
+server that answers requests for the metrics of one repo without paying for
+starting Python, importing pandas and seaborn and connecting to the database
+each time.
+
+The data for a repo is gathered once for each window and number of business
+days, with the same queries as health_by_repo.py, and kept in memory for
+a while (the time to live), so that repeated requests for the same repo
+are answered from memory. Graphs are drawn one at a time, since matplotlib
+is not thread safe, and are saved in the usual output folder, where an
+unchanged graph is not drawn again (see save_chart in
+utils/file_operations.py).
+"""
+import threading
+from metrics.registry import METRICS
+
+# Cached repo data: key -> (time it was gathered, data)
+_cache = {}
+_cache_lock = threading.Lock()
+
+# One lock for each key being gathered, so that requests for the same repo
+# that arrive together only gather it once
+_key_locks = {}
+
+# matplotlib is not thread safe, so graphs are drawn one at a time
+_render_lock = threading.Lock()
+
+def cache_get(key, ttl):
+    """ Gets a value from the cache if it is younger than the time to live
+
+    Parameters
+    ----------
+    key : tuple
+    ttl : float
+        time to live in seconds
+
+    Returns
+    -------
+    value : the cached value, or None
+    """
+    import time
+
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > ttl:
+            del _cache[key]
+            return None
+        return entry[1]
+
+def cache_put(key, value, max_entries):
+    """ Adds a value to the cache, removing the oldest values if there are
+    more than max_entries
+
+    Parameters
+    ----------
+    key : tuple
+    value : any value
+    max_entries : int
+    """
+    import time
+
+    with _cache_lock:
+        _cache[key] = (time.time(), value)
+        while len(_cache) > max_entries:
+            oldest = min(_cache, key=lambda cache_key: _cache[cache_key][0])
+            del _cache[oldest]
+
+def cached(key, ttl, max_entries, function, *args):
+    """ Gets a value from the cache, or computes it with function and caches
+    it. Only one thread computes the value for a key at a time.
+
+    Parameters
+    ----------
+    key : tuple
+    ttl : float
+        time to live in seconds
+    max_entries : int
+    function : function
+    *args : arguments for the function
+
+    Returns
+    -------
+    value : the cached or computed value
+    from_cache : bool
+    """
+    value = cache_get(key, ttl)
+    if value is not None:
+        return value, True
+
+    with _cache_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    # The lock for the key is removed however this ends, so that requests
+    # that fail don't leave their locks behind
+    try:
+        with key_lock:
+            # Another thread may have computed it while this one waited
+            value = cache_get(key, ttl)
+            if value is not None:
+                return value, True
+
+            value = function(*args)
+            cache_put(key, value, max_entries)
+    finally:
+        with _cache_lock:
+            _key_locks.pop(key, None)
+
+    return value, False
+
+def find_repo(org_name, repo_name, engine, ttl, max_entries):
+    """ Looks up the repo_id of a repo in an org, ignoring case
+
+    Parameters
+    ----------
+    org_name : str
+    repo_name : str
+    engine : sqlalchemy database object
+    ttl : float
+        time to live of the cached list of repos in the org
+    max_entries : int
+
+    Returns
+    -------
+    repo_id : str
+        or None if the org has no repo with that name
+    repo_name : str
+        the name of the repo in Augur
+    """
+    from utils.repo_info import get_org_repos
+
+    repoDF, from_cache = cached(('repos', org_name), ttl, max_entries, get_org_repos, org_name, engine)
+
+    matches = repoDF[repoDF['repo_name'].str.lower() == repo_name.lower()]
+    if len(matches) != 1:
+        return None, repo_name
+
+    return matches['repo_id'].iloc[0], matches['repo_name'].iloc[0]
+
+def gather_repo_data(repo_id, repo_name, org_name, start_date, end_date, engine, bus_days):
+    """ Runs the queries for a repo and computes the data for every metric
+
+    Parameters
+    ----------
+    repo_id : str
+    repo_name : str
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    bus_days : int
+
+    Returns
+    -------
+    repo_data : dict
+        'fork_archive' -> (is_forked, is_archived), and the results of the
+        *_data function of each metric under its name (see repo_metric_data
+        in utils/gather.py)
+    """
+    from utils.gather import repo_queries, run_org_queries, derive_datasets, repo_metric_data
+
+    queries = repo_queries(repo_id, repo_name, org_name, start_date, end_date, engine)
+    query_results = {name: function(*args) for name, (function, args) in queries.items()}
+    org_results = run_org_queries(org_name, start_date, end_date, engine)
+    query_results = derive_datasets(query_results, org_results, repo_id, repo_name, org_name, start_date, end_date, engine)
+
+    repo_data = repo_metric_data(query_results, repo_id, repo_name, org_name, start_date, end_date, engine, [bus_days])
+    repo_data['fork_archive'] = query_results['fork_archive']
+    repo_data['first_response'] = repo_data['first_response'][bus_days]
+
+    return repo_data
+
+def json_value(value):
+    """ Converts a value returned by a *_data function to something that can
+    be written as JSON
+
+    Parameters
+    ----------
+    value : dataframe, datetime, numpy value, list or any JSON value
+
+    Returns
+    -------
+    value : JSON value
+    """
+    import datetime
+    import json
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(value, pd.DataFrame):
+        return json.loads(value.to_json(orient='records', date_format='iso'))
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    elif isinstance(value, np.generic):
+        return value.item()
+    elif isinstance(value, (list, tuple)):
+        return [json_value(item) for item in value]
+    else:
+        return value
+
+def metric_json(metric, data):
+    """ Names the values returned by a metric's *_data function
+
+    Parameters
+    ----------
+    metric : str
+        a key of METRICS in metrics/registry.py
+    data : tuple
+
+    Returns
+    -------
+    values : dict
+    """
+
+    return {field: json_value(value) for field, value in zip(METRICS[metric]['fields'], data)}
+
+def render_chart(metric, repo_data, repo_id, repo_name, org_name, start_date, end_date, engine, years, bus_days):
+    """ Draws the graph for a metric from data that was already gathered
+
+    Parameters
+    ----------
+    metric : str
+        a key of METRICS in metrics/registry.py
+    repo_data : dict
+        from gather_repo_data
+    repo_id : str
+    repo_name : str
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    years : int
+    bus_days : int
+
+    Returns
+    -------
+    filename : str
+        the png file, or None if there was too little data for the graph
+    """
+    from os.path import exists
+    from utils.file_operations import output_filename
+    from metrics.release_frequency import activity_release_graph
+    from metrics.closure_ratio import sustain_prs_by_repo_graph
+    from metrics.bus_factor import contributor_risk_graph
+    from metrics.first_response import response_time_graph
+
+    if repo_data[metric][0] == -1:
+        return None
+
+    with _render_lock:
+        if metric == 'release':
+            activity_release_graph(repo_id, repo_name, org_name, start_date, end_date, engine, years, data=repo_data[metric])
+            filename_str = 'release_frequency_y' + str(years)
+        elif metric == 'closure_ratio':
+            sustain_prs_by_repo_graph(repo_id, repo_name, org_name, start_date, end_date, engine, years, data=repo_data[metric])
+            filename_str = 'change_request_closure_ratio_pr_y' + str(years)
+        elif metric == 'bus_factor':
+            contributor_risk_graph(repo_id, repo_name, org_name, start_date, end_date, engine, years, data=repo_data[metric])
+            filename_str = 'bus_factor_y' + str(years)
+        else:
+            response_time_graph(repo_id, repo_name, org_name, start_date, end_date, engine, bus_days, years, data=repo_data[metric])
+            filename_str = 'time_to_first_response_pr_y' + str(years) + '_bd_' + str(bus_days)
+
+    filename = output_filename(repo_name, org_name, filename_str)
+
+    return filename if exists(filename) else None
+
+def make_handler(engine, ttl, max_entries):
+    """ Creates the class that handles the HTTP requests
+
+    GET /health
+    GET /repos?org=ORG
+    GET /metrics?org=ORG&repo=REPO[&years=1][&bus_days=2]
+    GET /metrics/METRIC?org=ORG&repo=REPO[&years=1][&bus_days=2]
+    GET /charts/METRIC?org=ORG&repo=REPO[&years=1][&bus_days=2]
+
+    METRIC is one of release, closure_ratio, bus_factor or first_response
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+    ttl : float
+        time to live of the cached data in seconds
+    max_entries : int
+        the most repos and windows to keep in the cache
+
+    Returns
+    -------
+    handler : subclass of http.server.BaseHTTPRequestHandler
+    """
+    import json
+    import traceback
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+    from utils.date_calcs import get_windows
+    from utils.repo_info import get_org_repos
+    from utils.snapshot import check_snapshot
+    from utils.timing import set_recording
+
+    # The queries and graphs are timed like in health_by_repo.py, but the
+    # records are never read by the service, and would pile up for as long
+    # as it runs
+    set_recording(False)
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def send_json(self, status, body):
+            content = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def send_png(self, filename):
+            with open(filename, 'rb') as f:
+                content = f.read()
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def address_string(self):
+            # Unix sockets have no client address
+            return self.client_address[0] if self.client_address else 'unix'
+
+        def do_GET(self):
+            try:
+                self.handle_get()
+            except Exception as e:
+                traceback.print_exc()
+                self.send_json(500, {'error': repr(e)})
+
+        def handle_get(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            parts = [part for part in url.path.split('/') if part]
+
+            if parts == ['health']:
+                self.send_json(200, {'status': 'ok', 'cached': len(_cache)})
+                return
+
+            if 'org' not in params:
+                self.send_json(400, {'error': 'The org parameter is required'})
+                return
+            org_name = params['org']
+
+            if parts == ['repos']:
+                repoDF, from_cache = cached(('repos', org_name), ttl, max_entries, get_org_repos, org_name, engine)
+                self.send_json(200, {'org': org_name, 'repos': json_value(repoDF)})
+                return
+
+            if not parts or parts[0] not in ['metrics', 'charts'] or len(parts) > 2 or (len(parts) == 2 and parts[1] not in METRICS):
+                self.send_json(404, {'error': 'Unknown endpoint', 'metrics': list(METRICS)})
+                return
+            if parts[0] == 'charts' and len(parts) != 2:
+                self.send_json(404, {'error': 'Give the metric to draw, like /charts/bus_factor', 'metrics': list(METRICS)})
+                return
+
+            if 'repo' not in params:
+                self.send_json(400, {'error': 'The repo parameter is required'})
+                return
+
+            try:
+                years = int(params.get('years', 1))
+                bus_days = int(params.get('bus_days', 2))
+            except ValueError:
+                self.send_json(400, {'error': 'years and bus_days must be whole numbers'})
+                return
+            if years < 1 or bus_days < 1:
+                self.send_json(400, {'error': 'years and bus_days must be at least 1'})
+                return
+
+            repo_id, repo_name = find_repo(org_name, params['repo'], engine, ttl, max_entries)
+            if repo_id == None:
+                self.send_json(404, {'error': 'Missing or invalid GitHub organization and repository name combination.'})
+                return
+
+            years, start_date, end_date = get_windows([years])[0]
+            snapshot_error = check_snapshot(engine, org_name, start_date, end_date)
+            if snapshot_error != None:
+                self.send_json(400, {'error': snapshot_error})
+                return
+            key = ('data', org_name, repo_name, start_date, end_date, bus_days)
+            repo_data, from_cache = cached(key, ttl, max_entries, gather_repo_data, repo_id, repo_name, org_name, start_date, end_date, engine, bus_days)
+
+            body = {
+                'org': org_name,
+                'repo': repo_name,
+                'years': years,
+                'bus_days': bus_days,
+                'start_date': start_date.strip("'"),
+                'end_date': end_date.strip("'"),
+                'forked': json_value(repo_data['fork_archive'][0]),
+                'archived': json_value(repo_data['fork_archive'][1]),
+                'cached': from_cache,
+            }
+
+            if parts[0] == 'metrics' and len(parts) == 1:
+                body['metrics'] = {metric: metric_json(metric, repo_data[metric]) for metric in METRICS}
+                self.send_json(200, body)
+            elif parts[0] == 'metrics':
+                body['metric'] = parts[1]
+                body['data'] = metric_json(parts[1], repo_data[parts[1]])
+                self.send_json(200, body)
+            else:
+                filename = render_chart(parts[1], repo_data, repo_id, repo_name, org_name, start_date, end_date, engine, years, bus_days)
+                if filename == None:
+                    body['error'] = repo_data[parts[1]][1]
+                    self.send_json(404, body)
+                else:
+                    self.send_png(filename)
+
+    return MetricsHandler
+
+def make_server(handler, host='127.0.0.1', port=8000, socket_path=None):
+    """ Creates a threaded HTTP server on a TCP port or a Unix socket
+
+    Parameters
+    ----------
+    handler : class
+        from make_handler
+    host : str
+    port : int
+    socket_path : str
+        the path of a Unix socket to listen on instead of a TCP port
+
+    Returns
+    -------
+    server : socketserver.BaseServer
+    """
+    import os
+    import socketserver
+    from http.server import ThreadingHTTPServer
+
+    if socket_path == None:
+        return ThreadingHTTPServer((host, port), handler)
+
+    class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    return ThreadingUnixHTTPServer(socket_path, handler)
@@ -0,0 +1,244 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains functions that export the rows of the Augur tables needed by the
+metrics for one GitHub organization to a local Parquet snapshot, and that
+read the snapshot back so that the metrics can be computed from it.
+
+A snapshot is a directory with one Parquet file per table plus a
+snapshot.json file describing what was exported: the org, the window and
+the number of rows of each table. A run against a snapshot is checked
+against it with check_snapshot, since a snapshot for another org or a
+narrower window would quietly give metrics from missing rows.
+"""
+
+# Only the columns used by the metric and repo_info queries are exported.
+# message and commits in particular have very wide text columns that the
+# model never reads.
+SNAPSHOT_COLUMNS = {
+    'repo_groups': ['repo_group_id', 'rg_name'],
+    'repo': ['repo_id', 'repo_group_id', 'repo_name', 'repo_git', 'forked_from', 'repo_archived'],
+    'releases': ['repo_id', 'release_published_at'],
+    'pull_requests': ['pull_request_id', 'repo_id', 'pr_src_id', 'pr_src_state', 'pr_created_at', 'pr_closed_at', 'pr_merged_at'],
+    'pull_request_reviews': ['pull_request_id', 'pr_review_submitted_at'],
+    'pull_request_message_ref': ['pull_request_id', 'pr_message_ref_src_comment_id'],
+    'message': ['platform_msg_id', 'cntrb_id', 'msg_timestamp'],
+    'commits': ['repo_id', 'cmt_commit_hash', 'cmt_author_name', 'cmt_ght_author_id', 'cmt_author_timestamp'],
+    'contributors': ['cntrb_id', 'cntrb_login'],
+}
+
+# snapshot.json of the snapshot read by each engine from snapshot_engine, or
+# None if it has none
+_snapshot_info = {}
+
+SNAPSHOT_TIMESTAMPS = ['release_published_at', 'pr_created_at', 'pr_closed_at', 'pr_merged_at',
+    'pr_review_submitted_at', 'msg_timestamp', 'cmt_author_timestamp']
+
+def snapshot_queries(org_name, start_date):
+    """ Builds the query used to export each table for an org. Rows are limited
+    to the repos in the org and, for the activity tables, to the rows on or
+    after the start date.
+
+    Parameters
+    ----------
+    org_name : str
+    start_date : str
+
+    Returns
+    -------
+    queries : dict
+        table name -> SQL query
+    """
+    org_repos = f"""
+        SELECT repo.repo_id FROM repo, repo_groups
+        WHERE repo.repo_group_id = repo_groups.repo_group_id
+            AND repo_groups.rg_name = '{org_name}'"""
+
+    org_prs = f"""
+        SELECT pull_request_id FROM pull_requests
+        WHERE repo_id IN ({org_repos})
+            AND pr_created_at >= {start_date}"""
+
+    org_messages = f"""
+        SELECT pr_message_ref_src_comment_id FROM pull_request_message_ref
+        WHERE pull_request_id IN ({org_prs})"""
+
+    org_commits_filter = f"""
+        repo_id IN ({org_repos})
+            AND cmt_author_timestamp >= {start_date}"""
+
+    where = {
+        'repo_groups': f"rg_name = '{org_name}'",
+        'repo': f"repo_id IN ({org_repos})",
+        'releases': f"repo_id IN ({org_repos}) AND release_published_at >= {start_date}",
+        'pull_requests': f"pull_request_id IN ({org_prs})",
+        'pull_request_reviews': f"pull_request_id IN ({org_prs})",
+        'pull_request_message_ref': f"pull_request_id IN ({org_prs})",
+        'message': f"platform_msg_id IN ({org_messages})",
+        'commits': org_commits_filter,
+        'contributors': f"""cntrb_id IN (SELECT cmt_ght_author_id FROM commits WHERE {org_commits_filter})
+            OR cntrb_id IN (SELECT cntrb_id FROM message WHERE platform_msg_id IN ({org_messages}))""",
+    }
+
+    queries = {}
+    for table, columns in SNAPSHOT_COLUMNS.items():
+        queries[table] = 'SELECT ' + ', '.join(columns) + ' FROM ' + table + ' WHERE ' + where[table]
+
+    return queries
+
+def copy_query_to_parquet(query, engine, filename, parse_dates=None):
+    """ Runs one query and writes all of its rows to a Parquet file.
+    On PostgreSQL this uses a single COPY ... TO STDOUT transfer instead of
+    fetching the rows through the cursor, and falls back to fetch_df if
+    pyarrow can't parse the COPY output.
+
+    Parameters
+    ----------
+    query : str
+    engine : sqlalchemy database object
+    filename : str
+    parse_dates : list
+        timestamp columns, which SQLite returns as text
+
+    Returns
+    -------
+    num_rows : int
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from utils.fetch import copy_to_arrow, fetch_df
+    from utils.sql_dialect import dialect_name
+
+    table = None
+    if dialect_name(engine) == 'postgresql':
+        try:
+            table = copy_to_arrow(query, engine)
+        except pa.ArrowException:
+            # e.g. a column type that pyarrow can't parse from the COPY output
+            table = None
+
+    if table is None:
+        table = pa.Table.from_pandas(fetch_df(query, engine, parse_dates), preserve_index=False)
+
+    pq.write_table(table, filename)
+
+    return table.num_rows
+
+def export_snapshot(org_name, start_date, end_date, engine, snapshot_dir):
+    """ Exports the rows needed by the metrics for every repo in an org to a
+    Parquet snapshot
+
+    Parameters
+    ----------
+    org_name : str
+    start_date : str
+    end_date : str
+    engine : sqlalchemy database object
+    snapshot_dir : str
+
+    Returns
+    -------
+    row_counts : dict
+        table name -> number of rows exported
+    """
+    import json
+    import datetime
+    from os.path import join
+    from pathlib import Path
+
+    Path(snapshot_dir).mkdir(parents=True, exist_ok=True)
+
+    row_counts = {}
+    for table, query in snapshot_queries(org_name, start_date).items():
+        filename = join(snapshot_dir, table + '.parquet')
+        parse_dates = [column for column in SNAPSHOT_COLUMNS[table] if column in SNAPSHOT_TIMESTAMPS]
+        row_counts[table] = copy_query_to_parquet(query, engine, filename, parse_dates)
+        print('Exported', row_counts[table], 'rows from', table)
+
+    snapshot_info = {
+        'org_name': org_name,
+        'start_date': start_date.replace("'", ''),
+        'end_date': end_date.replace("'", ''),
+        'exported_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'row_counts': row_counts,
+    }
+    with open(join(snapshot_dir, 'snapshot.json'), 'w') as info_file:
+        json.dump(snapshot_info, info_file, indent=4)
+
+    return row_counts
+
+def snapshot_engine(snapshot_dir):
+    """ Creates an in-memory DuckDB database engine where each table of a
+    Parquet snapshot is available as a view with the Augur table name, so
+    the metric queries can run unchanged against the snapshot.
+
+    Parameters
+    ----------
+    snapshot_dir : str
+
+    Returns
+    -------
+    engine : sqlalchemy database object
+    """
+    import json
+    import sqlalchemy as s
+    from os.path import join, exists
+
+    view_sql = []
+    for table in SNAPSHOT_COLUMNS:
+        filename = join(snapshot_dir, table + '.parquet')
+        if exists(filename):
+            view_sql.append("CREATE VIEW " + table + " AS SELECT * FROM read_parquet('" + filename + "')")
+
+    engine = s.create_engine('duckdb:///:memory:')
+
+    info_filename = join(snapshot_dir, 'snapshot.json')
+    _snapshot_info[engine] = None
+    if exists(info_filename):
+        with open(info_filename) as info_file:
+            _snapshot_info[engine] = json.load(info_file)
+
+    # Every new in-memory connection is a separate database, so the views
+    # are created whenever the pool opens a connection.
+    @s.event.listens_for(engine, 'connect')
+    def create_views(dbapi_connection, connection_record):
+        for sql in view_sql:
+            dbapi_connection.execute(sql)
+
+    return engine
+
+def check_snapshot(engine, org_name, start_date, end_date):
+    """ Checks that the snapshot behind an engine was exported for an org and
+    covers a window
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+    org_name : str
+    start_date : str
+    end_date : str
+
+    Returns
+    -------
+    error : str
+        what doesn't match, or None if it matches or the engine is not for a
+        snapshot
+    """
+
+    if engine not in _snapshot_info:
+        return None
+
+    info = _snapshot_info[engine]
+    if info == None:
+        return 'The snapshot has no snapshot.json, so the org and dates it was exported for are unknown'
+
+    start = start_date.replace("'", '')
+    end = end_date.replace("'", '')
+
+    if info.get('org_name') != org_name:
+        return 'The snapshot was exported for the ' + str(info.get('org_name')) + ' org and not ' + org_name
+    if info.get('start_date', '9999') > start or info.get('end_date', '') < end:
+        return ('The snapshot covers ' + str(info.get('start_date')) + ' to ' + str(info.get('end_date')) +
+            ', which does not include ' + start + ' to ' + end + '. Export it again with export_snapshot.py for enough years')
+
+    return None
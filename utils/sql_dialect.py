@@ -0,0 +1,46 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains functions that build the small pieces of SQL that differ between
+the database backends supported by augur_db_connect (PostgreSQL, SQLite and
+DuckDB), so that the metric queries can be written once in a portable form.
+"""
+
+def dialect_name(engine):
+    """ Gets the name of the SQL dialect used by a database engine
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    name : str
+        'postgresql', 'sqlite' or 'duckdb'
+    """
+    return engine.dialect.name
+
+def date_part_sql(part, column, engine):
+    """ Builds an expression that extracts the year or month (as a number)
+    from a timestamp column
+
+    Parameters
+    ----------
+    part : str
+        'year' or 'month'
+    column : str
+    engine : sqlalchemy database object
+
+    Returns
+    -------
+    sql : str
+    """
+    if dialect_name(engine) == 'sqlite':
+        # SQLite stores timestamps as ISO 8601 text
+        formats = {'year': '%Y', 'month': '%m'}
+        sql = "CAST(strftime('" + formats[part] + "', " + column + ") AS INTEGER)"
+    else:
+        # PostgreSQL and DuckDB
+        sql = "date_part('" + part + "', " + column + ")"
+
+    return sql
@@ -0,0 +1,304 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains functions used to create, refresh and read optional summary
+tables in a separate schema of the Augur PostgreSQL database, so that the
+metrics can be read from small pre-computed tables with index lookups
+instead of joining the raw tables on every run (see summary_tables.py).
+
+The summary tables are:
+* pr_monthly_counts(repo_id, year, month, total, closed): the number of PRs
+  created each month, and how many of them are closed
+* pr_first_response(pull_request_id, repo_id, pr_created_at, pr_merged_at,
+  pr_closed_at, first_comment_time, first_review): the times used to find
+  the first response to each PR
+* author_commits(repo_id, commit_date, login, commits): the number of human
+  commits by each author each day
+* repo_commits(repo_id, commit_date, commits): the number of distinct human
+  commits each day
+* refresh_log(refreshed_at, since, full_refresh): when the tables were refreshed
+
+The metrics read from the summary tables only when they were refreshed after
+the end date of the run. The results are the same as from the raw tables,
+except that commits are counted by day, so commits made exactly at midnight
+at the end date are left out.
+"""
+
+SUMMARY_SCHEMA = 'health_summary'
+
+# The summary schema to use for each engine and end date, or None
+_summary_schemas = {}
+
+def summary_ddl(schema):
+    """ Builds the statements that create the summary tables and indexes
+
+    Parameters
+    ----------
+    schema : str
+
+    Returns
+    -------
+    statements : list
+        SQL strings
+    """
+    statements = [
+        f"CREATE SCHEMA IF NOT EXISTS {schema}",
+        f"""CREATE TABLE IF NOT EXISTS {schema}.pr_monthly_counts (
+                repo_id BIGINT NOT NULL,
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                total BIGINT NOT NULL,
+                closed BIGINT NOT NULL,
+                PRIMARY KEY (repo_id, year, month))""",
+        f"""CREATE TABLE IF NOT EXISTS {schema}.pr_first_response (
+                pull_request_id BIGINT PRIMARY KEY,
+                repo_id BIGINT NOT NULL,
+                pr_created_at TIMESTAMP,
+                pr_merged_at TIMESTAMP,
+                pr_closed_at TIMESTAMP,
+                first_comment_time TIMESTAMP,
+                first_review TIMESTAMP)""",
+        f"CREATE INDEX IF NOT EXISTS pr_first_response_repo_created ON {schema}.pr_first_response (repo_id, pr_created_at)",
+        f"""CREATE TABLE IF NOT EXISTS {schema}.author_commits (
+                repo_id BIGINT NOT NULL,
+                commit_date DATE NOT NULL,
+                login TEXT NOT NULL,
+                commits BIGINT NOT NULL,
+                PRIMARY KEY (repo_id, commit_date, login))""",
+        f"""CREATE TABLE IF NOT EXISTS {schema}.repo_commits (
+                repo_id BIGINT NOT NULL,
+                commit_date DATE NOT NULL,
+                commits BIGINT NOT NULL,
+                PRIMARY KEY (repo_id, commit_date))""",
+        f"""CREATE TABLE IF NOT EXISTS {schema}.refresh_log (
+                refreshed_at TIMESTAMP NOT NULL DEFAULT now(),
+                since TIMESTAMP,
+                full_refresh BOOLEAN NOT NULL)""",
+    ]
+
+    return statements
+
+def refresh_sql(schema, full):
+    """ Builds the statements that refresh the summary tables. For a full
+    refresh, the tables are emptied and filled again. Otherwise, only the rows
+    that can be changed by data newer than the :since parameter are replaced:
+    * the months and PRs of the PRs created, merged or closed since then, or
+      with comments or reviews since then
+    * the days of the commits since then
+
+    Parameters
+    ----------
+    schema : str
+    full : bool
+
+    Returns
+    -------
+    statements : list
+        SQL strings, which use the :since parameter unless full is True
+    """
+    from metrics.bus_factor import bot_commit_filter_sql
+
+    if full:
+        statements = [
+            f"TRUNCATE {schema}.pr_monthly_counts, {schema}.pr_first_response, {schema}.author_commits, {schema}.repo_commits",
+            "CREATE TEMP TABLE affected_prs ON COMMIT DROP AS SELECT pull_request_id FROM pull_requests",
+            "CREATE TEMP TABLE affected_months ON COMMIT DROP AS SELECT DISTINCT repo_id, date_part('year', pr_created_at)::int AS year, date_part('month', pr_created_at)::int AS month FROM pull_requests",
+        ]
+        commit_filter = ''
+    else:
+        statements = [
+            """CREATE TEMP TABLE affected_prs ON COMMIT DROP AS
+                SELECT pull_request_id FROM pull_requests
+                    WHERE pr_created_at >= :since OR pr_merged_at >= :since OR pr_closed_at >= :since
+                UNION
+                SELECT pull_request_message_ref.pull_request_id FROM pull_request_message_ref, message
+                    WHERE pull_request_message_ref.pr_message_ref_src_comment_id = message.platform_msg_id
+                    AND message.msg_timestamp >= :since
+                UNION
+                SELECT pull_request_id FROM pull_request_reviews
+                    WHERE pr_review_submitted_at >= :since""",
+            """CREATE TEMP TABLE affected_months ON COMMIT DROP AS
+                SELECT DISTINCT pull_requests.repo_id, date_part('year', pull_requests.pr_created_at)::int AS year, date_part('month', pull_requests.pr_created_at)::int AS month
+                FROM pull_requests, affected_prs
+                WHERE pull_requests.pull_request_id = affected_prs.pull_request_id""",
+            f"""DELETE FROM {schema}.pr_monthly_counts USING affected_months
+                WHERE pr_monthly_counts.repo_id = affected_months.repo_id
+                AND pr_monthly_counts.year = affected_months.year
+                AND pr_monthly_counts.month = affected_months.month""",
+            f"DELETE FROM {schema}.pr_first_response WHERE pull_request_id IN (SELECT pull_request_id FROM affected_prs)",
+            f"DELETE FROM {schema}.author_commits WHERE commit_date >= CAST(:since AS DATE)",
+            f"DELETE FROM {schema}.repo_commits WHERE commit_date >= CAST(:since AS DATE)",
+        ]
+        commit_filter = 'AND commits.cmt_author_timestamp >= CAST(:since AS DATE)'
+
+    human_commits = f"""
+                SELECT DISTINCT commits.repo_id, commits.cmt_commit_hash, commits.cmt_author_timestamp, contributors.cntrb_login
+                FROM commits, contributors
+                WHERE commits.cmt_ght_author_id = contributors.cntrb_id{bot_commit_filter_sql()}
+                {commit_filter}"""
+
+    statements += [
+        f"""INSERT INTO {schema}.pr_monthly_counts (repo_id, year, month, total, closed)
+            SELECT pull_requests.repo_id, affected_months.year, affected_months.month,
+                COUNT(pull_requests.pr_src_id),
+                COUNT(pull_requests.pr_src_id) FILTER (WHERE pull_requests.pr_src_state = 'closed')
+            FROM pull_requests, affected_months
+            WHERE pull_requests.repo_id = affected_months.repo_id
+                AND date_part('year', pull_requests.pr_created_at)::int = affected_months.year
+                AND date_part('month', pull_requests.pr_created_at)::int = affected_months.month
+            GROUP BY pull_requests.repo_id, affected_months.year, affected_months.month""",
+        f"""INSERT INTO {schema}.pr_first_response
+                (pull_request_id, repo_id, pr_created_at, pr_merged_at, pr_closed_at, first_comment_time, first_review)
+            SELECT pull_requests.pull_request_id, pull_requests.repo_id, pull_requests.pr_created_at,
+                pull_requests.pr_merged_at, pull_requests.pr_closed_at,
+                (SELECT MIN(message.msg_timestamp)
+                    FROM pull_request_message_ref JOIN message
+                    ON pull_request_message_ref.pr_message_ref_src_comment_id = message.platform_msg_id
+                    AND message.cntrb_id NOT IN (SELECT cntrb_id FROM contributors WHERE cntrb_login LIKE '%[bot]')
+                    WHERE pull_request_message_ref.pull_request_id = pull_requests.pull_request_id),
+                (SELECT MIN(pull_request_reviews.pr_review_submitted_at)
+                    FROM pull_request_reviews
+                    WHERE pull_request_reviews.pull_request_id = pull_requests.pull_request_id)
+            FROM pull_requests
+            WHERE pull_requests.pull_request_id IN (SELECT pull_request_id FROM affected_prs)""",
+        f"""INSERT INTO {schema}.author_commits (repo_id, commit_date, login, commits)
+            SELECT repo_id, CAST(cmt_author_timestamp AS DATE), cntrb_login, COUNT(*)
+            FROM ({human_commits}) AS human_commits
+            WHERE cntrb_login IS NOT NULL
+            GROUP BY repo_id, CAST(cmt_author_timestamp AS DATE), cntrb_login""",
+        f"""INSERT INTO {schema}.repo_commits (repo_id, commit_date, commits)
+            SELECT repo_id, CAST(cmt_author_timestamp AS DATE), COUNT(DISTINCT cmt_commit_hash)
+            FROM ({human_commits}) AS human_commits
+            GROUP BY repo_id, CAST(cmt_author_timestamp AS DATE)""",
+        f"INSERT INTO {schema}.refresh_log (since, full_refresh) VALUES ({'NULL' if full else ':since'}, {'TRUE' if full else 'FALSE'})",
+    ]
+
+    return statements
+
+def install_summary_tables(engine, schema=SUMMARY_SCHEMA):
+    """ Creates the summary tables and fills them
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+    schema : str
+    """
+    import sqlalchemy as s
+
+    with engine.begin() as conn:
+        for statement in summary_ddl(schema):
+            conn.execute(s.sql.text(statement))
+
+    refresh_summary_tables(engine, schema, full=True)
+
+def last_refresh(engine, schema=SUMMARY_SCHEMA):
+    """ Gets the time of the last refresh of the summary tables
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+    schema : str
+
+    Returns
+    -------
+    refreshed_at : datetime
+        or None if the summary tables don't exist or were never refreshed
+    """
+    import sqlalchemy as s
+
+    if not engine.dialect.has_table(engine, 'refresh_log', schema=schema):
+        return None
+
+    refreshed_at = engine.execute(s.sql.text(f"SELECT MAX(refreshed_at) FROM {schema}.refresh_log")).scalar()
+
+    return refreshed_at
+
+def refresh_summary_tables(engine, schema=SUMMARY_SCHEMA, full=False, since=None, overlap_days=31):
+    """ Refreshes the summary tables in one transaction
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+    schema : str
+    full : bool
+        rebuild the tables from all of the data
+    since : datetime
+        replace the rows that can be changed by data newer than this (optional)
+    overlap_days : int
+        without since, the rows are replaced starting this many days before
+        the last refresh, to pick up data that was collected late
+
+    Returns
+    -------
+    since : datetime
+        None for a full refresh
+    """
+    import datetime
+    import sqlalchemy as s
+
+    if not full and since == None:
+        refreshed_at = last_refresh(engine, schema)
+        if refreshed_at == None:
+            full = True
+        else:
+            since = refreshed_at - datetime.timedelta(days=overlap_days)
+
+    with engine.begin() as conn:
+        for statement in refresh_sql(schema, full):
+            if full:
+                conn.execute(s.sql.text(statement))
+            else:
+                conn.execute(s.sql.text(statement), since=since)
+
+    # Without this, the planner doesn't know the new sizes of the tables
+    with engine.begin() as conn:
+        conn.execute(s.sql.text(f"ANALYZE {schema}.pr_monthly_counts, {schema}.pr_first_response, {schema}.author_commits, {schema}.repo_commits"))
+
+    _summary_schemas.clear()
+
+    return None if full else since
+
+def drop_summary_tables(engine, schema=SUMMARY_SCHEMA):
+    """ Removes the summary tables, so the metrics are read from the raw tables
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+    schema : str
+    """
+    import sqlalchemy as s
+
+    with engine.begin() as conn:
+        conn.execute(s.sql.text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+
+    _summary_schemas.clear()
+
+def summary_schema(engine, end_date):
+    """ Gets the schema of the summary tables, if they can be used for a run
+    ending at end_date. They are only used on PostgreSQL, and only if they
+    were refreshed after the end date.
+
+    Parameters
+    ----------
+    engine : sqlalchemy database object
+    end_date : str
+
+    Returns
+    -------
+    schema : str
+        or None if the raw tables should be used
+    """
+    from utils.date_calcs import convert_dates
+    from utils.sql_dialect import dialect_name
+
+    key = (str(engine.url), end_date)
+    if key not in _summary_schemas:
+        schema = None
+        if dialect_name(engine) == 'postgresql':
+            refreshed_at = last_refresh(engine)
+            start_dt, end_dt = convert_dates(end_date, end_date)
+            if refreshed_at != None and refreshed_at >= end_dt:
+                schema = SUMMARY_SCHEMA
+        _summary_schemas[key] = schema
+
+    return _summary_schemas[key]
@@ -0,0 +1,296 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains the functions that write the summary of a run, with one row per
+repo for each combination of years and business days, as CSV, JSON lines or
+Parquet (see the --summary-format option of health_by_repo.py).
+
+Each repo's row is a dict of the same values as the CSV columns, as strings,
+which is what is saved in the checkpoint manifest and the work queue. The
+rows are written as each repo finishes, and buffered and written in batches
+of batch_size rows:
+* csv: the columns below, quoted with the csv module, so that a repo name
+  with a comma or a quote can't shift the columns
+* jsonl: a JSON object per line, with the values typed (see typed_record)
+* parquet: the same typed values, with a row group for each batch. Needs
+  pyarrow. The file can only be read once it is closed at the end of the run.
+
+A row that is still in a batch when a run dies is not lost: the summaries
+are rewritten from the checkpoint manifest when the run is resumed.
+"""
+
+SUMMARY_COLUMNS = ['org_name', 'repo_name', 'releases', 'first_resp_mos', 'closure_ratio_mos', 'bus_factor', 'bus_factor_percents', 'fork', 'archive']
+
+# Added with --approximate (see utils/approximate.py)
+APPROXIMATE_COLUMNS = ['approximate', 'first_resp_mos_ci', 'closure_ratio_mos_ci', 'bus_factor_ci']
+
+SUMMARY_FORMATS = ['csv', 'jsonl', 'parquet']
+
+# Rows written at once, and in each Parquet row group
+BATCH_SIZE = 100
+
+def summary_columns(approximate=False):
+    """ Gets the columns of the summary CSVs
+
+    Parameters
+    ----------
+    approximate : bool
+        if True, the columns for --approximate are included
+
+    Returns
+    -------
+    columns : list
+    """
+
+    return SUMMARY_COLUMNS + (APPROXIMATE_COLUMNS if approximate else [])
+
+def summary_row(org_name, repo_name, values, is_forked, is_archived, interval=None):
+    """ Creates the row of a repo for a summary
+
+    Parameters
+    ----------
+    org_name : str
+    repo_name : str
+    values : dict
+        from summary_values in utils/dashboard.py
+    is_forked : bool
+    is_archived : bool or str
+        'ERROR' if it could not be found
+    interval : dict
+        the intervals for these business days from approximate_metric_data,
+        with --approximate
+
+    Returns
+    -------
+    row : dict
+        column -> value as a string, like the CSV
+    """
+
+    row = dict(values, org_name=org_name, repo_name=repo_name, fork=str(is_forked), archive=str(is_archived))
+    if interval != None:
+        row.update(interval)
+
+    return {column: row[column] for column in summary_columns(interval != None)}
+
+def typed_record(row, years, bus_days):
+    """ Converts a row to the typed values written as JSON lines and Parquet.
+    The counts are numbers, the percents and the approximate values are
+    lists, fork and archive are booleans and the intervals are [low, high].
+    Values that could not be computed, like 'Too Few PRs', are null and are
+    listed in missing with the reason, like 'first_resp_mos: Too Few PRs'.
+    The values of the metrics that were not selected are null.
+
+    Parameters
+    ----------
+    row : dict
+        from summary_row
+    years : int
+    bus_days : int
+
+    Returns
+    -------
+    record : dict
+    """
+
+    record = {'org_name': row['org_name'], 'repo_name': row['repo_name'], 'years': years, 'bus_days': bus_days}
+    missing = []
+
+    for column in ['releases', 'first_resp_mos', 'closure_ratio_mos', 'bus_factor']:
+        record[column] = int(row[column]) if row[column].isdigit() else None
+        if row[column] != '' and record[column] == None:
+            missing.append(column + ': ' + row[column])
+
+    percents = row['bus_factor_percents']
+    record['bus_factor_percents'] = [float(x) for x in percents.split('--')] if percents not in ['', 'Error'] else None
+
+    for column in ['fork', 'archive']:
+        record[column] = {'True': True, 'False': False}.get(row[column])
+        if record[column] == None:
+            missing.append(column + ': ' + row[column])
+
+    record['missing'] = missing
+
+    if 'approximate' in row:
+        record['approximate'] = row['approximate'].split(';') if row['approximate'] else []
+        for column in ['first_resp_mos_ci', 'closure_ratio_mos_ci', 'bus_factor_ci']:
+            record[column] = [int(x) for x in row[column].split('-')] if row[column] else None
+
+    return record
+
+def parquet_schema(approximate=False):
+    """ Gets the pyarrow schema of the typed records
+
+    Parameters
+    ----------
+    approximate : bool
+
+    Returns
+    -------
+    schema : pyarrow schema
+    """
+    import pyarrow as pa
+
+    fields = [('org_name', pa.string()), ('repo_name', pa.string()), ('years', pa.int64()), ('bus_days', pa.int64()),
+        ('releases', pa.int64()), ('first_resp_mos', pa.int64()), ('closure_ratio_mos', pa.int64()), ('bus_factor', pa.int64()),
+        ('bus_factor_percents', pa.list_(pa.float64())), ('fork', pa.bool_()), ('archive', pa.bool_()), ('missing', pa.list_(pa.string()))]
+    if approximate:
+        fields += [('approximate', pa.list_(pa.string())), ('first_resp_mos_ci', pa.list_(pa.int64())),
+            ('closure_ratio_mos_ci', pa.list_(pa.int64())), ('bus_factor_ci', pa.list_(pa.int64()))]
+
+    return pa.schema(fields)
+
+def summary_filename(path, name, years, bus_days, summary_format):
+    """ Creates the filename of a summary
+
+    Parameters
+    ----------
+    path : str
+        the org folder, or the repo folder for a single repo
+    name : str
+        '_' + org_name, or the repo name for a single repo
+    years : int
+    bus_days : int
+    summary_format : str
+        one of SUMMARY_FORMATS
+
+    Returns
+    -------
+    filename : str
+    """
+
+    return path + '/' + name + '_output_yr_' + str(years) + '_bdays_' + str(bus_days) + '.' + summary_format
+
+def open_summary(filename, summary_format, key, years, bus_days, approximate=False, batch_size=BATCH_SIZE):
+    """ Opens a summary and writes its header
+
+    Parameters
+    ----------
+    filename : str
+    summary_format : str
+        one of SUMMARY_FORMATS
+    key : str
+        from csv_key in utils/checkpoint.py, the key of this summary's rows
+    years : int
+    bus_days : int
+    approximate : bool
+        if True, the intervals from --approximate are written
+    batch_size : int
+        rows buffered before they are written
+
+    Returns
+    -------
+    writer : dict
+        the open file and the rows waiting to be written
+    """
+    import csv
+
+    writer = {'format': summary_format, 'filename': filename, 'key': key, 'years': years, 'bus_days': bus_days,
+        'approximate': approximate, 'batch': [], 'batch_size': max(batch_size, 1)}
+
+    if summary_format == 'parquet':
+        import pyarrow.parquet as pq
+
+        writer['schema'] = parquet_schema(approximate)
+        writer['parquet'] = pq.ParquetWriter(filename, writer['schema'])
+    else:
+        writer['file'] = open(filename, 'w', newline='')
+        if summary_format == 'csv':
+            writer['csv'] = csv.writer(writer['file'], lineterminator='\n')
+            writer['csv'].writerow(summary_columns(approximate))
+
+    return writer
+
+def open_summaries(path, name, years_list, bus_days_list, summary_formats, approximate=False, batch_size=BATCH_SIZE):
+    """ Opens a summary in each format for every combination of years and
+    business days
+
+    Parameters
+    ----------
+    path : str
+    name : str
+        see summary_filename
+    years_list : list
+    bus_days_list : list
+    summary_formats : list
+    approximate : bool
+    batch_size : int
+
+    Returns
+    -------
+    writers : list
+        from open_summary
+    """
+    from utils.checkpoint import csv_key
+
+    writers = []
+    for years in years_list:
+        for bus_days in bus_days_list:
+            for summary_format in summary_formats:
+                filename = summary_filename(path, name, years, bus_days, summary_format)
+                writers.append(open_summary(filename, summary_format, csv_key(years, bus_days), years, bus_days, approximate, batch_size))
+
+    return writers
+
+def write_summary(writers, rows):
+    """ Adds a repo's rows to the summaries, writing each one's batch once it
+    is full
+
+    Parameters
+    ----------
+    writers : list
+        from open_summary
+    rows : dict
+        csv_key -> the repo's row for that summary, from summary_row. Repos
+        that were archived or skipped have no rows.
+    """
+
+    for writer in writers:
+        if writer['key'] in rows:
+            writer['batch'].append(rows[writer['key']])
+            if len(writer['batch']) >= writer['batch_size']:
+                flush_summary(writer)
+
+def flush_summary(writer):
+    """ Writes the rows waiting in a summary's batch
+
+    Parameters
+    ----------
+    writer : dict
+        from open_summary
+    """
+    import json
+
+    if not writer['batch']:
+        return
+
+    if writer['format'] == 'csv':
+        columns = summary_columns(writer['approximate'])
+        writer['csv'].writerows([[row.get(column, '') for column in columns] for row in writer['batch']])
+    else:
+        records = [typed_record(row, writer['years'], writer['bus_days']) for row in writer['batch']]
+        if writer['format'] == 'jsonl':
+            writer['file'].write(''.join(json.dumps(record) + '\n' for record in records))
+        else:
+            import pyarrow as pa
+
+            writer['parquet'].write_table(pa.Table.from_pylist(records, schema=writer['schema']))
+
+    if 'file' in writer:
+        writer['file'].flush()
+    writer['batch'] = []
+
+def close_summary(writer):
+    """ Writes the last batch and closes a summary
+
+    Parameters
+    ----------
+    writer : dict
+        from open_summary
+    """
+
+    flush_summary(writer)
+
+    if writer['format'] == 'parquet':
+        writer['parquet'].close()
+    else:
+        writer['file'].close()
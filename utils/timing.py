@@ -0,0 +1,431 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains functions that time each stage of a run, so that it is possible
+to see whether the time for an org goes to the queries, the pandas processing
+or drawing and saving the graphs.
+
+Each timed stage is recorded as a dict with:
+* stage: 'query', 'transform', 'render' or 'repo' (the rest of the main loop)
+* org, repo, metric and query tags, when they are known
+* seconds: the time spent in the stage itself, excluding any stages that ran
+  inside it, so that the seconds of all of the records add up to the total
+* elapsed: the wall time of the stage, including any stages inside it
+* rows: the number of rows fetched, for the 'query' stage
+* memory_peak_bytes: the highest memory allocated by Python during the stage,
+  over what was allocated when it started, when memory is being profiled with
+  tracemalloc (see utils/memory.py), and memory_start_bytes: what was
+  allocated when it started
+
+Recording a stage only takes a couple of clock reads and appending a dict to
+a list, so this is always on. The records can be written as a JSON lines
+trace and as a Prometheus textfile, and summarized at the end of a run.
+
+So that a run over a very large org doesn't keep a record of every stage,
+the records of each repo are folded into bounded totals once the repo is
+finished (see fold_records): the totals for each stage and metric, and the
+TOP_REPOS repos with the most seconds and the highest memory peaks. The
+records are written to the trace as they are folded.
+"""
+import contextvars
+import heapq
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Tags (org, repo, metric, query) added to every stage recorded in the
+# current context. Each thread starts with no tags.
+_tags = contextvars.ContextVar('timing_tags', default={})
+
+# Stack of the seconds spent in nested stages, and their memory peaks, for
+# each thread
+_stacks = threading.local()
+
+_records = []
+_records_lock = threading.Lock()
+
+# The number of slowest repos, and of repos with the highest memory peaks,
+# kept in the totals
+TOP_REPOS = 20
+
+# Totals of the records folded so far (see fold_records):
+# * stages: (stage, metric) -> {'seconds', 'calls', 'rows'}, and
+#   'memory_peak_bytes' for the stages whose memory was profiled
+# * slowest: heap of (seconds, repo, [(stage, seconds)]) for the slowest repos
+# * highest: heap of (memory peak, repo) for the repos with the highest peaks
+# * over_budget: the repos whose memory peak was over the budget
+# * skipped: the repos skipped to stay within the memory budget
+# * rows: the rows fetched by the queries
+_totals = {'stages': {}, 'slowest': [], 'highest': [], 'over_budget': [], 'skipped': [], 'rows': 0}
+
+# The open trace file, with start_trace
+_trace = {'file': None}
+
+# Whether stages are recorded. The stages are still timed when this is off,
+# since the seconds of nested stages are needed for the ones around them.
+_recording = True
+
+@contextmanager
+def tagged(**tags):
+    """ Adds tags to every stage recorded inside the with statement
+
+    Parameters
+    ----------
+    **tags : str
+        for example org=org_name, repo=repo_name
+    """
+    token = _tags.set({**_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+@contextmanager
+def stage(name, **tags):
+    """ Times the stage inside the with statement and records it with the
+    current tags. The record is the target of the with statement, so that
+    values like the number of rows can be added to it.
+
+    Parameters
+    ----------
+    name : str
+        'query', 'transform', 'render' or 'repo'
+    **tags : str
+        tags for this stage only, for example metric='release'
+
+    Yields
+    ------
+    record : dict
+    """
+    record = {'stage': name, **_tags.get(), **tags}
+
+    if not hasattr(_stacks, 'nested'):
+        _stacks.nested = []
+    stack = _stacks.nested
+
+    frame = {'seconds': 0.0}
+    if tracemalloc.is_tracing():
+        # The traced peak is reset for each stage, so the highest peak seen
+        # so far is kept for the stage that this one is nested in
+        current, peak = tracemalloc.get_traced_memory()
+        if stack and 'peak' in stack[-1]:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        frame['start_memory'] = current
+        frame['peak'] = current
+    stack.append(frame)
+
+    start = time.perf_counter()
+
+    try:
+        yield record
+    finally:
+        elapsed = time.perf_counter() - start
+        frame = stack.pop()
+        if stack:
+            stack[-1]['seconds'] += elapsed
+
+        record['seconds'] = elapsed - frame['seconds']
+        record['elapsed'] = elapsed
+
+        if 'start_memory' in frame:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(frame['peak'], peak)
+            record['memory_start_bytes'] = frame['start_memory']
+            record['memory_peak_bytes'] = peak - frame['start_memory']
+            if stack and 'peak' in stack[-1]:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+
+        if _recording:
+            with _records_lock:
+                _records.append(record)
+
+def record_event(name, **fields):
+    """ Records something that happened, like a repo being skipped, along with
+    the timings, with the current tags
+
+    Parameters
+    ----------
+    name : str
+    **fields : values to record
+    """
+    record = {'stage': name, **_tags.get(), **fields, 'seconds': 0.0, 'elapsed': 0.0}
+
+    if _recording:
+        with _records_lock:
+            _records.append(record)
+
+def run_tagged(tags, function, *args):
+    """ Runs a function with tags added to every stage recorded by it. This is
+    used to carry the tags over to the threads that run the queries.
+
+    Parameters
+    ----------
+    tags : dict
+    function : function
+    *args : arguments for the function
+
+    Returns
+    -------
+    the result of the function
+    """
+    with tagged(**tags):
+        return function(*args)
+
+def get_records():
+    """ Gets a copy of the stages recorded so far
+
+    Returns
+    -------
+    records : list
+        one dict for each stage
+    """
+    with _records_lock:
+        return list(_records)
+
+def set_recording(recording):
+    """ Turns recording the stages on or off, for long running processes
+    like metrics_service.py that don't use the records, which would
+    otherwise be kept for as long as the process runs
+
+    Parameters
+    ----------
+    recording : bool
+    """
+    global _recording
+
+    _recording = recording
+
+def clear_records():
+    """ Removes the stages recorded so far, and their totals
+    """
+    with _records_lock:
+        _records.clear()
+
+    _totals.update({'stages': {}, 'slowest': [], 'highest': [], 'over_budget': [], 'skipped': [], 'rows': 0})
+
+def start_trace(filename):
+    """ Opens the trace, to which each stage is written as one line of JSON
+    when it is folded into the totals
+
+    Parameters
+    ----------
+    filename : str
+    """
+
+    _trace['file'] = open(filename, 'w')
+
+def close_trace():
+    """ Closes the trace, after folding the stages that are left
+    """
+
+    fold_records(finished=True)
+    if _trace['file'] != None:
+        _trace['file'].close()
+        _trace['file'] = None
+
+def fold_records(repo_name=None, budget_mb=None, finished=False):
+    """ Adds the records of a repo that is finished, and the ones that are
+    not for a repo, to the totals and the trace, and removes them. The
+    records of the repos that are still being gathered are left until they
+    are finished.
+
+    Parameters
+    ----------
+    repo_name : str
+        the repo that is finished
+    budget_mb : float
+        memory budget for each repo in MB, to list the repos over it
+    finished : bool
+        if True, every record is folded, at the end of a run
+
+    Returns
+    -------
+    repo_seconds : float
+        the seconds recorded for the repo
+    """
+    import json
+
+    with _records_lock:
+        if finished:
+            folded = list(_records)
+            _records.clear()
+        else:
+            folded = [record for record in _records if record.get('repo', repo_name) == repo_name]
+            _records[:] = [record for record in _records if record.get('repo', repo_name) != repo_name]
+
+    repos = {}
+    for record in folded:
+        if _trace['file'] != None:
+            _trace['file'].write(json.dumps(record, default=str) + '\n')
+
+        key = (record['stage'], record.get('metric', 'none'))
+        totals = _totals['stages'].setdefault(key, {'seconds': 0.0, 'calls': 0, 'rows': 0})
+        totals['seconds'] += record['seconds']
+        totals['calls'] += 1
+        totals['rows'] += record.get('rows', 0)
+        _totals['rows'] += record.get('rows', 0)
+        if 'memory_peak_bytes' in record:
+            totals['memory_peak_bytes'] = max(totals.get('memory_peak_bytes', 0), record['memory_peak_bytes'])
+
+        if record['stage'] == 'skip':
+            _totals['skipped'].append(record.get('repo', ''))
+
+        if 'repo' in record:
+            repo = repos.setdefault(record['repo'], {'by_stage': {}})
+            repo['by_stage'][record['stage']] = repo['by_stage'].get(record['stage'], 0) + record['seconds']
+
+            # The peak for a repo is measured from what was allocated before
+            # its first stage, so it includes the query results held by the
+            # later stages
+            if 'memory_peak_bytes' in record:
+                repo['start'] = min(repo.get('start', record['memory_start_bytes']), record['memory_start_bytes'])
+                repo['high'] = max(repo.get('high', 0), record['memory_start_bytes'] + record['memory_peak_bytes'])
+
+    for name, repo in repos.items():
+        push_top(_totals['slowest'], (sum(repo['by_stage'].values()), name, sorted(repo['by_stage'].items())))
+
+        if 'high' in repo:
+            peak = repo['high'] - repo['start']
+            push_top(_totals['highest'], (peak, name))
+            if budget_mb != None and peak > budget_mb * 1024 * 1024:
+                _totals['over_budget'].append(name)
+
+    if repo_name in repos:
+        return sum(repos[repo_name]['by_stage'].values())
+    return 0.0
+
+def push_top(heap, item):
+    """ Adds an item to a heap of the TOP_REPOS largest items
+
+    Parameters
+    ----------
+    heap : list
+    item : tuple
+        compared by its first value
+    """
+
+    if len(heap) < TOP_REPOS:
+        heapq.heappush(heap, item)
+    else:
+        heapq.heappushpop(heap, item)
+
+def get_totals():
+    """ Gets the totals of the records folded so far
+
+    Returns
+    -------
+    totals : dict
+        like _totals, with slowest and highest sorted from the largest
+    """
+
+    totals = dict(_totals)
+    totals['slowest'] = sorted(_totals['slowest'], reverse=True)
+    totals['highest'] = sorted(_totals['highest'], reverse=True)
+
+    return totals
+
+def prometheus_labels(labels):
+    """ Formats labels for the Prometheus text format
+
+    Parameters
+    ----------
+    labels : dict
+
+    Returns
+    -------
+    label_str : str
+        for example {org="x",stage="query"}
+    """
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(key + '="' + value + '"')
+
+    return '{' + ','.join(pairs) + '}'
+
+def write_prometheus(filename, org_name, run_seconds):
+    """ Writes the totals for each stage and metric in the Prometheus text
+    format, to be picked up by the node_exporter textfile collector. The
+    totals are not split by repo to keep the number of series small, and are
+    the ones of the records folded so far. The file
+    is written to a temporary file and renamed so that it is never read half
+    written.
+
+    Parameters
+    ----------
+    filename : str
+        should end with .prom for the textfile collector
+    org_name : str
+    run_seconds : float
+        the wall time of the whole run
+    """
+    import os
+
+    stages = get_totals()['stages']
+    seconds = {key: totals['seconds'] for key, totals in stages.items()}
+    calls = {key: totals['calls'] for key, totals in stages.items()}
+    rows = {key: totals['rows'] for key, totals in stages.items() if key[0] == 'query'}
+
+    lines = [
+        '# HELP health_model_stage_seconds Seconds spent in each stage during the last run.',
+        '# TYPE health_model_stage_seconds gauge',
+    ]
+    for (stage_name, metric), value in sorted(seconds.items()):
+        lines.append('health_model_stage_seconds' + prometheus_labels({'org': org_name, 'stage': stage_name, 'metric': metric}) + ' ' + repr(value))
+
+    lines += [
+        '# HELP health_model_stage_calls Number of times each stage ran during the last run.',
+        '# TYPE health_model_stage_calls gauge',
+    ]
+    for (stage_name, metric), value in sorted(calls.items()):
+        lines.append('health_model_stage_calls' + prometheus_labels({'org': org_name, 'stage': stage_name, 'metric': metric}) + ' ' + str(value))
+
+    lines += [
+        '# HELP health_model_rows_fetched Rows fetched by the queries during the last run.',
+        '# TYPE health_model_rows_fetched gauge',
+    ]
+    for (stage_name, metric), value in sorted(rows.items()):
+        lines.append('health_model_rows_fetched' + prometheus_labels({'org': org_name, 'metric': metric}) + ' ' + str(value))
+
+    lines += [
+        '# HELP health_model_run_seconds Wall time of the last run.',
+        '# TYPE health_model_run_seconds gauge',
+        'health_model_run_seconds' + prometheus_labels({'org': org_name}) + ' ' + repr(run_seconds),
+        '# HELP health_model_last_run_timestamp_seconds Time when the last run finished.',
+        '# TYPE health_model_last_run_timestamp_seconds gauge',
+        'health_model_last_run_timestamp_seconds' + prometheus_labels({'org': org_name}) + ' ' + repr(time.time()),
+    ]
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_filename, filename)
+
+def print_summary(top=5):
+    """ Prints the stages and the repos that took the most time, from the
+    records folded so far
+
+    Parameters
+    ----------
+    top : int
+        the number of stages and repos to print
+    """
+    totals = get_totals()
+    stages = totals['stages']
+
+    if not stages:
+        return
+
+    print('\nSlowest stages (stage / metric):')
+    for key in sorted(stages, key=lambda key: stages[key]['seconds'], reverse=True)[:top]:
+        print('  {:<32} {:>9.3f}s in {} calls'.format(' / '.join(key), stages[key]['seconds'], stages[key]['calls']))
+
+    if totals['slowest']:
+        print('Slowest repos:')
+        for seconds, repo, by_stage in totals['slowest'][:top]:
+            by_stage = ', '.join('{} {:.3f}s'.format(name, value) for name, value in by_stage)
+            print('  {:<32} {:>9.3f}s ({})'.format(repo, seconds, by_stage))
+
+    print('Rows fetched:', totals['rows'])
@@ -0,0 +1,366 @@
+# Copyright Dawn M. Foster <dawn@dawnfoster.com>
+# MIT License
+
+""" Contains functions for running an org on several machines at once, with
+the repos shared out through a work queue kept in a SQLite file on storage
+that every machine can reach (see the coordinator and worker options of
+health_by_repo.py).
+
+* The coordinator adds every repo in the org to the queue, along with the
+  parameters of the run, waits for the workers and then merges their results
+  into the summaries, in the same order as a run on one machine.
+* Each worker claims one repo at a time with a lease, gathers the data and
+  creates the graphs for it, and saves its rows for the summaries in the
+  queue. While a worker is running, a background thread renews the leases of
+  the repos it holds. If a worker dies, its leases run out and the repos are
+  claimed by another worker. Repos that fail are tried again, up to
+  MAX_ATTEMPTS times.
+
+SQLite locks the whole file while a repo is claimed, which takes a few
+milliseconds, so many workers can share one queue. The locking relies on the
+file system, so on network storage it needs working POSIX locks (NFSv4, for
+example). Several workers on one machine always work.
+"""
+
+# Seconds a worker holds a repo before another worker may claim it, unless
+# the lease is renewed. Leases are renewed every third of this.
+LEASE_SECONDS = 300
+
+# Times a repo is tried before it is left as failed
+MAX_ATTEMPTS = 3
+
+# Seconds between checks of the queue while waiting on other workers
+POLL_SECONDS = 5
+
+def connect_queue(filename):
+    """ Opens a work queue, waiting for other workers that have it locked
+
+    Parameters
+    ----------
+    filename : str
+
+    Returns
+    -------
+    connection : sqlite3 connection
+        in autocommit mode, so that transactions are started explicitly
+    """
+    import sqlite3
+
+    return sqlite3.connect(filename, timeout=60, isolation_level=None)
+
+def create_queue(filename, params, repos):
+    """ Creates a work queue with the repos of an org, or reuses the one in
+    filename if it was made with the same parameters, so that a coordinator
+    can be started again. Failed repos are given their attempts back.
+
+    Parameters
+    ----------
+    filename : str
+    params : dict
+        the parameters of the run, which the workers use
+    repos : list
+        (repo_id, repo_name) tuples, in the order they should be claimed
+
+    Returns
+    -------
+    created : bool
+        True if the queue is new, False if it was reused, or None if the file
+        holds a queue made with other parameters
+    """
+    import json
+
+    connection = connect_queue(filename)
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        connection.execute('CREATE TABLE IF NOT EXISTS params (params TEXT)')
+        connection.execute("""CREATE TABLE IF NOT EXISTS repos (
+                repo_id TEXT PRIMARY KEY,
+                repo_name TEXT,
+                position INTEGER,
+                status TEXT,
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER,
+                summary_rows TEXT,
+                error TEXT)""")
+
+        row = connection.execute('SELECT params FROM params').fetchone()
+        if row != None:
+            if json.loads(row[0]) != params:
+                connection.execute('ROLLBACK')
+                return None
+            connection.execute("UPDATE repos SET status = 'pending', attempts = 0 WHERE status = 'failed'")
+            connection.execute('COMMIT')
+            return False
+
+        connection.execute('INSERT INTO params VALUES (?)', (json.dumps(params),))
+        connection.executemany("INSERT INTO repos VALUES (?, ?, ?, 'pending', NULL, NULL, 0, NULL, NULL)",
+            [(str(repo_id), repo_name, position) for position, (repo_id, repo_name) in enumerate(repos)])
+        connection.execute('COMMIT')
+        return True
+    finally:
+        connection.close()
+
+def queue_params(filename):
+    """ Reads the parameters of the run from a work queue
+
+    Parameters
+    ----------
+    filename : str
+
+    Returns
+    -------
+    params : dict
+        or None if there is no queue in the file
+    """
+    import json
+    import sqlite3
+    from os.path import exists
+
+    if not exists(filename):
+        return None
+
+    connection = connect_queue(filename)
+    try:
+        row = connection.execute('SELECT params FROM params').fetchone()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        connection.close()
+
+    return None if row == None else json.loads(row[0])
+
+def claim_repo(filename, worker_id):
+    """ Claims the next repo in the queue: the first pending repo, or a repo
+    whose lease has run out
+
+    Parameters
+    ----------
+    filename : str
+    worker_id : str
+
+    Returns
+    -------
+    repo : tuple
+        (repo_id, repo_name), or None if there is nothing to claim right now
+    """
+    import time
+
+    now = time.time()
+
+    connection = connect_queue(filename)
+    try:
+        # BEGIN IMMEDIATE takes the write lock, so two workers can't claim
+        # the same repo
+        connection.execute('BEGIN IMMEDIATE')
+
+        # Repos whose last attempt ran out of time are not tried again
+        connection.execute("""
+                UPDATE repos SET status = 'failed', worker = NULL, error = 'The lease ran out on the last attempt'
+                WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?
+                """, (now, MAX_ATTEMPTS))
+
+        row = connection.execute("""
+                SELECT repo_id, repo_name FROM repos
+                WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?))
+                AND attempts < ?
+                ORDER BY position
+                LIMIT 1
+                """, (now, MAX_ATTEMPTS)).fetchone()
+
+        if row != None:
+            connection.execute("""
+                    UPDATE repos SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1
+                    WHERE repo_id = ?
+                    """, (worker_id, now + LEASE_SECONDS, row[0]))
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
+
+    return row
+
+def renew_leases(filename, worker_id):
+    """ Renews the leases on every repo held by a worker
+
+    Parameters
+    ----------
+    filename : str
+    worker_id : str
+    """
+    import time
+
+    connection = connect_queue(filename)
+    try:
+        connection.execute("UPDATE repos SET lease_expires = ? WHERE worker = ? AND status = 'leased'",
+            (time.time() + LEASE_SECONDS, worker_id))
+    finally:
+        connection.close()
+
+def start_heartbeat(filename, worker_id):
+    """ Starts a background thread that renews a worker's leases every third
+    of LEASE_SECONDS
+
+    Parameters
+    ----------
+    filename : str
+    worker_id : str
+
+    Returns
+    -------
+    stop : threading.Event
+        set it to stop the thread
+    """
+    import threading
+
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(LEASE_SECONDS / 3):
+            renew_leases(filename, worker_id)
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    return stop
+
+def finish_repo(filename, repo_id, worker_id, summary_rows=None, error=None):
+    """ Saves the result of a repo. A failed repo goes back to the queue until
+    it has been tried MAX_ATTEMPTS times.
+
+    Parameters
+    ----------
+    filename : str
+    repo_id : str
+    worker_id : str
+    summary_rows : dict
+        csv_key -> the repo's row for that summary (see
+        utils/summary_writer.py), for a repo that is done
+    error : str
+        what went wrong, for a failed repo
+    """
+    import json
+
+    connection = connect_queue(filename)
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        if error == None:
+            connection.execute("""
+                    UPDATE repos SET status = 'done', worker = ?, lease_expires = NULL, summary_rows = ?, error = NULL
+                    WHERE repo_id = ?
+                    """, (worker_id, json.dumps(summary_rows or {}), str(repo_id)))
+        else:
+            # Another worker may have finished the repo if this lease ran out
+            connection.execute("""
+                    UPDATE repos SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END,
+                        worker = NULL, lease_expires = NULL, error = ?
+                    WHERE repo_id = ? AND status != 'done'
+                    """, (MAX_ATTEMPTS, error, str(repo_id)))
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
+
+def queue_counts(filename):
+    """ Counts the repos in a work queue by status
+
+    Parameters
+    ----------
+    filename : str
+
+    Returns
+    -------
+    counts : dict
+        status ('pending', 'leased', 'done' or 'failed') -> number of repos
+    """
+    connection = connect_queue(filename)
+    try:
+        rows = connection.execute('SELECT status, COUNT(*) FROM repos GROUP BY status').fetchall()
+    finally:
+        connection.close()
+
+    counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+    counts.update(dict(rows))
+
+    return counts
+
+def iter_claimed_repos(filename, worker_id):
+    """ Claims repos from a work queue one at a time until every repo is done
+    or failed. While other workers hold leases, it waits in case one of them
+    dies and its repos have to be claimed again. The next repo should only
+    be claimed once the last one is finished, so that a worker never waits
+    on a lease of its own.
+
+    Parameters
+    ----------
+    filename : str
+    worker_id : str
+
+    Yields
+    ------
+    repo_id : str
+    repo_name : str
+    """
+    import time
+
+    while True:
+        repo = claim_repo(filename, worker_id)
+        if repo != None:
+            yield repo
+            continue
+
+        if queue_counts(filename)['leased'] == 0:
+            break
+        time.sleep(POLL_SECONDS)
+
+def wait_for_queue(filename):
+    """ Waits until every repo in a work queue is done or failed, printing
+    the progress when it changes
+
+    Parameters
+    ----------
+    filename : str
+    """
+    import time
+
+    last_counts = None
+    while True:
+        counts = queue_counts(filename)
+        if counts != last_counts:
+            print('Work queue:', counts['done'], 'done,', counts['leased'], 'in progress,', counts['pending'], 'waiting,', counts['failed'], 'failed')
+            last_counts = counts
+
+        if counts['pending'] == 0 and counts['leased'] == 0:
+            break
+        time.sleep(POLL_SECONDS)
+
+def merge_queue(filename, summary_writers):
+    """ Writes the rows saved by the workers to the summaries, in the order
+    the repos were added to the queue
+
+    Parameters
+    ----------
+    filename : str
+    summary_writers : list
+        from open_summary in utils/summary_writer.py
+
+    Returns
+    -------
+    failed : list
+        (repo_name, error) tuples for the repos that failed or were not done
+    """
+    import json
+    from utils.summary_writer import write_summary
+
+    connection = connect_queue(filename)
+    try:
+        rows = connection.execute('SELECT repo_name, status, summary_rows, error FROM repos ORDER BY position').fetchall()
+    finally:
+        connection.close()
+
+    failed = []
+    for repo_name, status, summary_rows, error in rows:
+        if status != 'done':
+            failed.append((repo_name, error or status))
+            continue
+
+        write_summary(summary_writers, json.loads(summary_rows))
+
+    return failed